@@ -48,7 +48,6 @@ setup(
         'attrs>=19.2.0',
         'Pillow>=6.2.0',
         'enum34;python_version<"3.4"',
-        'aggdraw',
         'numpy',
         'scipy',
         'scikit-image',
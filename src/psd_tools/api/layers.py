@@ -402,23 +402,46 @@ class Layer(object):
             return compose_layer(self, force=force)
         return compose(self, force=force, bbox=bbox, layer_filter=layer_filter)
 
-    def numpy(self, channel=None, real_mask=True):
+    def numpy(self, channel=None, real_mask=True, dtype=None, copy=True):
         """
         Get NumPy array of the layer.
 
+        Decoded arrays are kept in a process-wide LRU cache,
+        :py:data:`psd_tools.api.numpy_io.decoded_cache`. By default, the
+        returned array is a copy and safe to modify.
+
         :param channel: Which channel to return, can be 'color',
             'shape', 'alpha', or 'mask'. Default is 'color+alpha'.
+        :param dtype: Output dtype. Default `None` gives float32 in
+            [0.0, 1.0]. 'native' gives the stored values without scaling,
+            i.e., uint8 for 1 and 8-bit, uint16 for 16-bit, and float32 for
+            32-bit documents. Other numpy dtypes are scaled to their range.
+        :param copy: If `False`, return the cached array without copying.
+            The array is read-only and shared with other callers.
         :return: :py:class:`numpy.ndarray` or None if there is no pixel.
         """
         from .numpy_io import get_array
-        return get_array(self, channel, real_mask=real_mask)
+        data = get_array(self, channel, real_mask=real_mask, dtype=dtype)
+        if data is None or not copy:
+            return data
+        return data.copy()
 
-    ## set _data to the channel (temporally only for RGB image)
     def set_channel_numpy(self, channel=None, _data=None):
+        """
+        Set NumPy array to the layer channels.
+
+        The layer size does not change; the array must match the layer, or
+        the mask for 'mask' channel.
+
+        :param channel: Which channel to set, can be 'color', 'shape', or
+            'mask'. Default is 'color+alpha'.
+        :param _data: :py:class:`numpy.ndarray` of (height, width, C) shape.
+            Floating point data is taken in [0.0, 1.0], integer data in the
+            range of its dtype.
+        """
         from .numpy_io import set_array
         if _data is not None:
             set_array(self, channel, _data)
-        
 
     def composite(
         self,
@@ -823,13 +846,15 @@ class PixelLayer(Layer):
         
         :return: None
         """
-        ori_pil_img = self.topil()
-        resized_pil_img = ori_pil_img.resize((new_size[0], new_size[1]))
-        resized_img_data = np.array(resized_pil_img)
-        resized_img_data = np.ascontiguousarray(resized_img_data, dtype='u1')
+        from PIL import Image
+        data = self.numpy()
+        resized = np.stack([
+            np.asarray(Image.fromarray(data[:, :, i]).resize(new_size))
+            for i in range(data.shape[2])
+        ], axis=2)
         self._record.right = self._record.left + new_size[0]
         self._record.bottom = self._record.top + new_size[1]
-        self.set_channel_numpy(_data=resized_img_data.reshape(new_size[0]*new_size[1], 4))
+        self.set_channel_numpy(_data=resized)
 
 
 class SmartObjectLayer(Layer):
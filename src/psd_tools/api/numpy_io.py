@@ -1,11 +1,22 @@
 from ctypes import sizeof
 import numpy as np
 import logging
+import weakref
+from concurrent.futures import ThreadPoolExecutor
 
 from psd_tools.constants import ChannelID, Tag, ColorMode, Resource
+from psd_tools.utils import LRUCache, _sizeof
 import sys
 logger = logging.getLogger(__name__)
 
+#: Process-wide cache of decoded layer arrays. Adjust the memory budget by
+#: ``decoded_cache.max_bytes``, and inspect ``decoded_cache.stats``.
+decoded_cache = LRUCache(max_bytes=256 * 1024 * 1024)
+
+# Records with cached arrays, and the ids of collected ones to be purged.
+_tracked_records = set()
+_collected_records = []
+
 EXPECTED_CHANNELS = {
     ColorMode.BITMAP: 1,
     ColorMode.GRAYSCALE: 1,
@@ -22,121 +33,258 @@ def set_array(layer, channel, _data, **kwargs):
         pass
     else:
         set_layer_data(layer, channel, _data, **kwargs)
+        invalidate_cache(layer)
 
 def get_array(layer, channel, **kwargs):
     if layer.kind == 'psdimage':
-        return get_image_data(layer, channel)
-    elif layer.kind == 'pixel':
-        return get_pixel_data(layer, channel)
-    else:
+        return get_image_data(layer, channel, **kwargs)
+    if kwargs.get('rows') is not None:
+        # Row ranges are for streaming, and not worth caching.
         return get_layer_data(layer, channel, **kwargs)
-    return None
+
+    _purge_collected()
+    _track(layer._record)
+    # Channel data bytes are part of the key, so any replaced channel misses.
+    channels = tuple(
+        (info.id, data.data)
+        for info, data in zip(layer._record.channel_info, layer._channels)
+    )
+    key = (id(layer._record), layer.kind, channel, layer.width, layer.height,
+           layer._psd.depth) + tuple(sorted(kwargs.items())) + channels
+    cached = decoded_cache.get(key)
+    if cached is not None:
+        return cached[0]
+
+    data = get_layer_data(layer, channel, **kwargs)
+    if data is not None:
+        data.flags.writeable = False  # Shared by the cache.
+    # The key keeps the compressed channel data alive, count it as well.
+    nbytes = _sizeof(data) + sum(len(raw) for _, raw in channels)
+    decoded_cache.put(key, (data, ), nbytes=nbytes)
+    return data
+
+
+def invalidate_cache(layer):
+    """Drop decoded arrays of the layer from the cache."""
+    record_id = id(layer._record)
+    decoded_cache.discard(lambda key: key[0] == record_id)
+
+
+def _track(record):
+    """Purge cached arrays of the record once it is garbage collected."""
+    record_id = id(record)
+    if record_id not in _tracked_records:
+        _tracked_records.add(record_id)
+        # Defer the purge, finalizers may run in the middle of cache updates.
+        weakref.finalize(record, _collected_records.append, record_id)
+
+
+def _purge_collected():
+    while _collected_records:
+        record_id = _collected_records.pop()
+        _tracked_records.discard(record_id)
+        decoded_cache.discard(lambda key: key[0] == record_id)
 
 ## TODO: test mask... what is user layer mask
-def get_image_data(psd, channel):
+def get_image_data(psd, channel, dtype=None, rows=None):
+    """
+    Get the merged image data.
+
+    :param rows: Optional (start, stop) range of rows to decode.
+    """
+    height = psd.height if rows is None else rows[1] - rows[0]
     if (channel == 'mask'
         ) or (channel == 'shape' and not has_transparency(psd)):
-        return np.ones((psd.height, psd.width, 1), dtype=np.float32)
+        return _convert_dtype(
+            np.full((height, psd.width, 1), _MAX_VALUE[psd.depth],
+                    dtype=_NATIVE_DTYPE[psd.depth]), psd.depth, dtype
+        )
+
+    expected_channels = EXPECTED_CHANNELS[psd.color_mode]
+    if channel == 'shape':
+        indices = [get_transparency_index(psd) % psd.channels]
+    elif channel == 'color' and psd.color_mode == ColorMode.INDEXED:
+        indices = [0]
+    elif channel == 'color' and psd.color_mode != ColorMode.MULTICHANNEL:
+        # Alpha is needed to remove the white background.
+        indices = list(range(min(psd.channels, expected_channels + 1)))
+    else:
+        indices = list(range(psd.channels))
+    planes = psd._record.image_data.get_data(
+        psd._record.header, channels=indices, rows=rows
+    )
+    data = _merge_planes(psd, planes, height, channel, dtype)
+
+    if channel == 'color' and psd.color_mode != ColorMode.MULTICHANNEL:
+        # TODO: psd.color_mode == ColorMode.INDEXED --> Convert?
+        return data[:, :, :expected_channels]
+    return data
+
 
-    lut = None
-    if psd.color_mode == ColorMode.INDEXED:
+def iter_image_data(psd, band_height=256, dtype=None):
+    """
+    Iterate over bands of rows of the merged image data.
+
+    Each band contains all the channels as :py:func:`get_image_data` with
+    `channel=None`, but only one band is decoded at a time.
+
+    :return: iterator of (height, width, C) :py:class:`numpy.ndarray`.
+    """
+    header = psd._record.header
+    for top, planes in psd._record.image_data.iter_rows(header, band_height):
+        height = min(band_height, psd.height - top)
+        yield _merge_planes(psd, planes, height, None, dtype)
+
+
+def _merge_planes(psd, planes, height, channel, dtype):
+    data = np.empty((height, psd.width, len(planes)),
+                    dtype=np.dtype(_NATIVE_DTYPE[psd.depth]).newbyteorder('>'))
+    for i, plane in enumerate(planes):
+        plane = _parse_native(plane, psd.depth)
+        data[:, :, i] = plane.reshape((height, -1))[:, :psd.width]
+
+    depth = psd.depth
+    if psd.color_mode == ColorMode.INDEXED and channel != 'shape':
         lut = np.frombuffer(psd._record.color_mode_data.value, np.uint8)
         lut = lut.reshape((3, -1)).transpose()
-    data = psd._record.image_data.get_data(psd._record.header, False)
-    data = _parse_array(data, psd.depth, lut=lut)
-    if lut is not None:
-        data = data.reshape((psd.height, psd.width, -1))
+        data = np.concatenate([lut[data[:, :, 0]], data[:, :, 1:]], axis=2)
+        depth = 8
+    data = _convert_dtype(data, depth, dtype)
+    return _remove_background(data, psd)
+
+
+def set_layer_data(layer, channel, data, real_mask=True):
+    """
+    Encode array data into the layer channels.
+
+    :param data: (height, width, C) array, or (height * width, C) array for
+        backward compatibility. Floating point data is taken in [0.0, 1.0],
+        integer data in the range of its dtype.
+    """
+    width, height = layer.width, layer.height
+    if channel == 'mask':
+        if layer.mask._has_real() and real_mask:
+            channel_ids = [ChannelID.REAL_USER_LAYER_MASK]
+        else:
+            channel_ids = [ChannelID.USER_LAYER_MASK]
+        width, height = layer.mask.width, layer.mask.height
+    elif channel == 'shape':
+        channel_ids = [ChannelID.TRANSPARENCY_MASK]
     else:
-        data = data.reshape((-1, psd.height, psd.width)).transpose((1, 2, 0))
-    data = _remove_background(data, psd)
+        expected_channels = EXPECTED_CHANNELS.get(layer._psd.color_mode)
+        channel_ids = [
+            info.id for info in layer._record.channel_info if info.id >= 0
+        ][:expected_channels]
+        if channel != 'color':
+            channel_ids.append(ChannelID.TRANSPARENCY_MASK)
 
-    if channel == 'shape':
-        return np.expand_dims(data[:, :, get_transparency_index(psd)], 2)
-    elif channel == 'color':
-        if psd.color_mode == ColorMode.MULTICHANNEL:
-            return data
-        # TODO: psd.color_mode == ColorMode.INDEXED --> Convert?
-        return data[:, :, :EXPECTED_CHANNELS[psd.color_mode]]
+    data = np.asarray(data)
+    if data.ndim == 2 and data.shape[0] == width * height:
+        data = data.reshape((height, width, -1))
+    elif data.ndim == 2:
+        data = data[:, :, np.newaxis]
+    if data.shape[:2] != (height, width):
+        raise ValueError(
+            'Invalid data shape %r for %dx%d layer' %
+            (data.shape, width, height)
+        )
+    if data.shape[2] < len(channel_ids):
+        logger.debug('Fewer channels given, keeping the rest unchanged')
+        channel_ids = channel_ids[:data.shape[2]]
 
-    return data
+    index = {
+        info.id: channel_data
+        for info, channel_data in
+        zip(layer._record.channel_info, layer._channels)
+    }
+    targets = [(i, index[c]) for i, c in enumerate(channel_ids) if c in index]
+    if len(targets) < len(channel_ids):
+        logger.debug('Missing channel in the layer record, skipped')
 
-## TODO: write this function follow the original coding style.    
-def get_pixel_data(layer, channel):
-    channels = []
-    for info in layer._record.channel_info:
-        width, height = layer.width, layer.height
-        index = {info.id: i for i, info in enumerate(layer._record.channel_info)}
-        depth = layer._psd.depth
-        channel_data = layer._channels[index[info.id]]
-        if width == 0 or height == 0 or len(channel_data.data) == 0:
-            channels.append(None)
-        if info.id >= 0:   
-            channel = channel_data.get_data(width, height, depth, layer._psd.version)
-            channel_arr = np.frombuffer(channel, '>u1')
-            channels.append(channel_arr)
-    image_data = np.stack(channels, axis=1).reshape(layer.height, layer.width, 3)
-    return image_data
-
-## support RGB mode for now.
-def set_layer_data(layer, channel, _data):
     depth, version = layer._psd.depth, layer._psd.version
-    iterator = zip(layer._record.channel_info, layer._channels)
-    index = {info.id: i for i, info in enumerate(layer._record.channel_info)}
-    width, height = layer.width, layer.height 
-    for info, data in iterator: 
-        if info.id >= 0:
-            data.set_data(_data[:, info.id].tobytes(), width, height, depth, version)
+    planes = _to_planes(data[:, :, [i for i, _ in targets]], depth)
+
+    def _encode(item):
+        plane, channel_data = item
+        channel_data.set_data(plane.tobytes(), width, height, depth, version)
+
+    with ThreadPoolExecutor(max_workers=max(1, len(targets))) as executor:
+        list(executor.map(_encode, zip(planes, (x for _, x in targets))))
+
+
+def _to_planes(data, depth):
+    """Convert (height, width, C) array to big-endian (C, height, width)."""
+    if depth == 1:
+        bits = _to_planes(data, 8) > 127
+        return np.packbits(bits, axis=2)
+
+    native = np.dtype(_NATIVE_DTYPE[depth])
+    planes = np.empty(
+        (data.shape[2], data.shape[0], data.shape[1]),
+        dtype=native.newbyteorder('>')
+    )
+    source = data.transpose((2, 0, 1))
+    if np.issubdtype(data.dtype, np.integer) and data.dtype != native:
+        source = source.astype(np.float32) / np.iinfo(data.dtype).max
+    if np.issubdtype(source.dtype, np.floating) and depth != 32:
+        source = np.clip(source, 0., 1.) * _MAX_VALUE[depth] + .5
+    # Conversion and byte swap happen in a single assignment.
+    planes[...] = source
+    return planes
+
+
+def get_layer_data(layer, channel, real_mask=True, dtype=None, rows=None):
+    """
+    :param rows: Optional (start, stop) range of rows to decode, relative to
+        the top of the layer or mask.
+    """
+    width, height = layer.width, layer.height
+    if channel == 'mask':
+        if layer.mask._has_real() and real_mask:
+            channel_ids = [ChannelID.REAL_USER_LAYER_MASK]
         else:
-            ## TODO: make sure this wont bring any trouble (RGBA)
-            data.set_data(_data[:, 3].tobytes(), width, height, depth, version)
-
-def get_layer_data(layer, channel, real_mask=True):
-    def _find_channel(layer, width, height, condition):
-        depth, version = layer._psd.depth, layer._psd.version   
-        iterator = zip(layer._record.channel_info, layer._channels)
-        channels = [
-            _parse_array(data.get_data(width, height, depth, version), depth)
-            for info, data in iterator
-            if condition(info) and len(data.data) > 0
+            channel_ids = [ChannelID.USER_LAYER_MASK]
+        width, height = layer.mask.width, layer.mask.height
+    elif channel == 'shape':
+        channel_ids = [ChannelID.TRANSPARENCY_MASK]
+    else:
+        expected_channels = EXPECTED_CHANNELS.get(layer._psd.color_mode)
+        channel_ids = [
+            info.id for info in layer._record.channel_info if info.id >= 0
         ]
-        if len(channels) and channels[0].size > 0:
-            result = np.stack(channels, axis=1).reshape((height, width, -1))
-            expected_channels = EXPECTED_CHANNELS.get(layer._psd.color_mode)
-            if result.shape[2] > expected_channels:
-                logger.debug('Extra channel found')
-                return result[:, :, :expected_channels]
-            return result
+        if len(channel_ids) > expected_channels:
+            logger.debug('Extra channel found')
+            channel_ids = channel_ids[:expected_channels]
+        if channel != 'color':
+            channel_ids.append(ChannelID.TRANSPARENCY_MASK)
+    return _decode_channels(layer, channel_ids, width, height, dtype, rows)
+
+
+def _decode_channels(
+    layer, channel_ids, width, height, dtype=None, rows=None
+):
+    """Decode the given channels into a single (height, width, C) array."""
+    depth, version = layer._psd.depth, layer._psd.version
+    index = {
+        info.id: data
+        for info, data in zip(layer._record.channel_info, layer._channels)
+        if len(data.data) > 0
+    }
+    channels = [index[i] for i in channel_ids if i in index]
+    if not channels or width == 0 or height == 0:
         return None
 
-    if channel == 'color':
-        return _find_channel(
-            layer, layer.width, layer.height, lambda x: x.id >= 0
-        )
-    elif channel == 'shape':
-        return _find_channel(
-            layer, layer.width, layer.height,
-            lambda x: x.id == ChannelID.TRANSPARENCY_MASK
+    size = height if rows is None else rows[1] - rows[0]
+    result = np.empty((size, width, len(channels)),
+                      dtype=np.dtype(_NATIVE_DTYPE[depth]).newbyteorder('>'))
+    for i, data in enumerate(channels):
+        plane = _parse_native(
+            data.get_data(width, height, depth, version, rows=rows), depth
         )
-    elif channel == 'mask':
-        if layer.mask._has_real() and real_mask:
-            channel_id = ChannelID.REAL_USER_LAYER_MASK
-        else:
-            channel_id = ChannelID.USER_LAYER_MASK
-        return _find_channel(
-            layer, layer.mask.width, layer.mask.height,
-            lambda x: x.id == channel_id
-        )
-
-    color = _find_channel(
-        layer, layer.width, layer.height, lambda x: x.id >= 0
-    )
-    shape = _find_channel(
-        layer, layer.width, layer.height,
-        lambda x: x.id == ChannelID.TRANSPARENCY_MASK
-    )
-    if shape is None:
-        return color
-    return np.concatenate([color, shape], axis=2)
+        if depth == 1:
+            plane = plane.reshape((size, -1))[:, :width]
+        result[:, :, i] = plane.reshape((size, width))
+    return _convert_dtype(result, depth, dtype)
 
 
 def get_pattern(pattern):
@@ -176,6 +324,68 @@ def get_transparency_index(psd):
     return -1  # Assume the last channel is the transparency
 
 
+_NATIVE_DTYPE = {1: np.uint8, 8: np.uint8, 16: np.uint16, 32: np.float32}
+
+_MAX_VALUE = {1: 1, 8: 255, 16: 65535, 32: 1.}
+
+
+def _parse_native(data, depth, lut=None):
+    """Parse data without conversion, as a view of the buffer if possible."""
+    if depth == 8:
+        parsed = np.frombuffer(data, '>u1')
+        if lut is not None:
+            parsed = lut[parsed]
+        return parsed
+    elif depth == 16:
+        return np.frombuffer(data, '>u2')
+    elif depth == 32:
+        return np.frombuffer(data, '>f4')
+    elif depth == 1:
+        return np.unpackbits(np.frombuffer(data, np.uint8))
+    else:
+        raise ValueError('Unsupported depth: %g' % depth)
+
+
+def _convert_dtype(data, depth, dtype=None):
+    """
+    Convert natively parsed data to the given dtype.
+
+    `None` gives float32 in [0.0, 1.0], and 'native' gives the decoded values
+    in the native byte order. Integer dtypes are scaled to their full range.
+    """
+    if isinstance(dtype, str) and dtype == 'native':
+        if data.dtype.isnative:
+            return data
+        if data.flags.writeable:
+            # Swap in place when the data is a fresh copy.
+            data.byteswap(inplace=True)
+            return data.view(data.dtype.newbyteorder('='))
+        return data.astype(data.dtype.newbyteorder('='))
+
+    dtype = np.dtype(np.float32 if dtype is None else dtype)
+    source = _MAX_VALUE[depth]
+    if np.issubdtype(dtype, np.floating):
+        result = data.astype(dtype)
+        if source != 1:
+            result /= source
+        return result
+
+    target = np.iinfo(dtype).max
+    if depth == 32:
+        result = np.clip(data, 0., 1.).astype(np.float32)
+        result *= target
+        result += .5
+        return result.astype(dtype)
+    if source == target:
+        return data.astype(dtype, copy=False)
+    result = data.astype(np.uint32)
+    result *= target
+    if source > 1:
+        result += source // 2
+        result //= source
+    return result.astype(dtype)
+
+
 def _parse_array(data, depth, lut=None):
     if depth == 8:
         parsed = np.frombuffer(data, '>u1')
@@ -195,9 +405,43 @@ def _parse_array(data, depth, lut=None):
 def _remove_background(data, psd):
     """ImageData preview is rendered on a white background."""
     if psd.color_mode == ColorMode.RGB and data.shape[2] > 3:
-        color = data[:, :, :3]
-        alpha = data[:, :, 3:4]
-        a = np.repeat(alpha, color.shape[2], axis=2)
-        color[a > 0] = (color + alpha - 1)[a > 0] / a[a > 0]
-        data[:, :, :3] = color
+        if not data.flags.writeable:
+            data = data.copy()
+        remove_white_background(data)
     return data
+
+
+def remove_white_background(data, band_height=256):
+    """
+    Un-premultiply the white matte of (height, width, 4) RGBA data in place.
+
+    Color is restored by `(color + alpha - 1) / alpha` where alpha is
+    positive, in the value range of the dtype. Integer data are processed in
+    bands of rows through float32 to bound the temporary memory.
+
+    :param data: writable :py:class:`numpy.ndarray`.
+    :param band_height: number of rows to process at once for integer data.
+    :return: `data`.
+    """
+    if np.issubdtype(data.dtype, np.floating):
+        _unmatte(data[:, :, :3], data[:, :, 3:4], 1.)
+        return data
+
+    scale = float(np.iinfo(data.dtype).max)
+    for y in range(0, data.shape[0], band_height):
+        band = data[y:y + band_height]
+        values = band.astype(np.float32)
+        _unmatte(values[:, :, :3], values[:, :, 3:4], scale)
+        np.clip(values, 0., scale, out=values)
+        values += .5
+        band[:, :, :3] = values[:, :, :3]
+    return data
+
+
+def _unmatte(color, alpha, scale):
+    # Transparent pixels keep their values.
+    mask = alpha > 0
+    np.add(color, alpha - scale, out=color, where=mask)
+    if scale != 1.:
+        alpha = alpha / scale
+    np.divide(color, alpha, out=color, where=mask)
@@ -2,11 +2,18 @@
 PIL IO module.
 """
 from __future__ import absolute_import, unicode_literals
+import hashlib
 import logging
 import io
 
+import numpy as np
+
 from psd_tools.constants import ColorMode, ChannelID, Resource
-from .numpy_io import has_transparency, get_transparency_index
+from psd_tools.utils import LRUCache
+from .numpy_io import (
+    get_array, has_transparency, get_transparency_index,
+    remove_white_background
+)
 
 logger = logging.getLogger(__name__)
 
@@ -65,27 +72,54 @@ def convert_image_data_to_pil(psd, channel, apply_icc):
 
     alpha = None
     icc = None
-    channel_data = psd._record.image_data.get_data(psd._record.header)
     size = (psd.width, psd.height)
+    header = psd._record.header
     if channel is None:
-        channels = [_create_image(size, c, psd.depth) for c in channel_data]
-
-        if has_transparency(psd):
-            alpha = channels[get_transparency_index(psd)]
+        if apply_icc and (Resource.ICC_PROFILE in psd.image_resources):
+            icc = psd.image_resources.get_data(Resource.ICC_PROFILE)
 
         if psd.color_mode == ColorMode.INDEXED:
-            image = channels[0]
-            image.putpalette(psd._record.color_mode_data.interleave())
+            mode, indices = 'P', [0]
         elif psd.color_mode == ColorMode.MULTICHANNEL:
-            image = channels[0]  # Multi-channel mode is a collection of alpha.
+            # Multi-channel mode is a collection of alpha.
+            mode, indices = 'L', [0]
         else:
             mode = get_pil_mode(psd.color_mode)
-            image = Image.merge(mode, channels[:get_pil_channels(mode)])
-
-        if apply_icc and (Resource.ICC_PROFILE in psd.image_resources):
-            icc = psd.image_resources.get_data(Resource.ICC_PROFILE)
+            indices = list(range(get_pil_channels(mode)))
+        alpha_index = None
+        if has_transparency(psd) and mode in ('RGB', 'L'):
+            alpha_index = get_transparency_index(psd) % psd.channels
+
+        if alpha_index is not None and icc is None:
+            # Interleave alpha to the same buffer and remove the matte there.
+            data = _interleave(
+                size, header.depth,
+                psd._record.image_data.get_data(
+                    header, channels=indices + [alpha_index]
+                )
+            )
+            if mode == 'RGB':
+                remove_white_background(data)
+            return _frombuffer(mode + 'A', size, data)
+
+        image = _create_image_from_planes(
+            mode, size, header.depth,
+            psd._record.image_data.get_data(header, channels=indices)
+        )
+        if alpha_index is not None:
+            alpha = _create_image_from_planes(
+                'L', size, header.depth,
+                psd._record.image_data.get_data(
+                    header, channels=[alpha_index]
+                )
+            )
+        if mode == 'P':
+            image.putpalette(psd._record.color_mode_data.interleave())
     else:
-        image = _create_image(size, channel_data[channel], psd.depth)
+        channel_data = psd._record.image_data.get_data(
+            header, channels=[channel]
+        )
+        image = _create_image(size, channel_data[0], psd.depth)
 
     if not image:
         return None
@@ -166,17 +200,22 @@ def convert_thumbnail_to_pil(thumbnail, mode='RGB'):
 
 
 def _merge_channels(layer):
-    from PIL import Image
     mode = get_pil_mode(layer._psd.color_mode)
-    # channels = []
     channels = [
-        _get_channel(layer, info.id) for info in layer._record.channel_info
-        if info.id >= 0
+        data for info, data in zip(
+            layer._record.channel_info, layer._channels
+        ) if info.id >= 0
     ]
-    if any(image is None for image in channels):
+    if any(len(data.data) == 0 for data in channels):
+        return None
+    if layer.width == 0 or layer.height == 0:
         return None
-    channels = _check_channels(channels, layer._psd.color_mode)
-    return Image.merge(mode, channels)
+    _check_channels(channels, layer._psd.color_mode)
+    depth = layer._psd.depth
+    if depth == 1:
+        return _get_channel(layer, ChannelID.CHANNEL_0)
+    data = get_array(layer, 'color', dtype='native')
+    return _frombuffer(mode, (layer.width, layer.height), _to_uint8(data, depth))
 
 
 def _get_channel(layer, channel):
@@ -217,6 +256,41 @@ def _create_image(size, data, depth):
         raise ValueError('Unsupported depth: %g' % depth)
 
 
+def _create_image_from_planes(mode, size, depth, planes):
+    if depth == 1:
+        return _create_image(size, planes[0], depth)
+    return _frombuffer(mode, size, _interleave(size, depth, planes))
+
+
+def _interleave(size, depth, planes):
+    """Decode planes into one interleaved (height, width, C) uint8 buffer."""
+    width, height = size
+    data = np.empty((height, width, len(planes)), dtype=np.uint8)
+    dtype = {8: '>u1', 16: '>u2', 32: '>f4'}[depth]
+    for i, plane in enumerate(planes):
+        values = np.frombuffer(plane, dtype, count=width * height)
+        data[:, :, i] = _to_uint8(values, depth).reshape((height, width))
+    return data
+
+
+def _to_uint8(data, depth):
+    """Same conversion as :py:func:`_create_image`."""
+    if depth == 16:
+        return (data >> 8).astype(np.uint8)
+    elif depth == 32:
+        return np.clip(data * 256., 0., 255.).astype(np.uint8)
+    return data
+
+
+def _frombuffer(mode, size, data):
+    from PIL import Image
+    if mode == 'LAB':
+        # The LAB unpacker flips the sign bit of a and b channels.
+        data = data ^ np.array([0, 128, 128], dtype=np.uint8)
+    data = np.ascontiguousarray(data)
+    return Image.frombuffer(mode, size, data, 'raw', mode, 0, 1)
+
+
 def _check_channels(channels, color_mode):
     expected_channels = ColorMode.channels(color_mode)
     if len(channels) > expected_channels:
@@ -236,7 +310,6 @@ def _check_channels(channels, color_mode):
 
 def _apply_icc(image, icc_profile):
     """Apply ICC Color profile."""
-    from io import BytesIO
     try:
         from PIL import ImageCms
     except ImportError:
@@ -245,32 +318,63 @@ def _apply_icc(image, icc_profile):
         )
         return image
     try:
-        in_profile = ImageCms.ImageCmsProfile(BytesIO(icc_profile))
-        out_profile = ImageCms.createProfile('sRGB')
         outputMode = image.mode if image.mode in ('L', 'LA', 'RGBA') else 'RGB'
-        return ImageCms.profileToProfile(image, in_profile, out_profile, outputMode=outputMode)
+        transform = get_icc_transform(icc_profile, image.mode, outputMode)
+        return ImageCms.applyTransform(image, transform)
     except ImageCms.PyCMSError as e:
         logger.warning('PyCMSError: %s' % (e))
 
     return image
 
 
+#: Cache of ICC transforms to sRGB. Adjust the size by
+#: ``icc_transform_cache.max_items``.
+icc_transform_cache = LRUCache(max_items=32)
+
+
+def get_icc_transform(
+    icc_profile, input_mode, output_mode='RGB', intent=0
+):
+    """
+    Get a cached transform from the ICC profile to sRGB.
+
+    Transforms are keyed by the digest of the profile bytes, the modes, and
+    the rendering intent, so the same embedded profile across documents
+    shares one transform.
+
+    :param icc_profile: ICC profile `bytes`.
+    :param input_mode: PIL mode of the input image.
+    :param output_mode: PIL mode of the output image.
+    :param intent: Rendering intent, see :py:mod:`PIL.ImageCms`.
+    :return: :py:class:`PIL.ImageCms.ImageCmsTransform`.
+    """
+    from io import BytesIO
+    from PIL import ImageCms
+
+    key = (
+        hashlib.blake2b(icc_profile, digest_size=16).digest(), input_mode,
+        output_mode, intent
+    )
+    transform = icc_transform_cache.get(key)
+    if transform is None:
+        logger.debug(
+            'Building ICC transform: %s to %s' % (input_mode, output_mode)
+        )
+        in_profile = ImageCms.ImageCmsProfile(BytesIO(icc_profile))
+        out_profile = ImageCms.createProfile('sRGB')
+        transform = ImageCms.buildTransform(
+            in_profile, out_profile, input_mode, output_mode,
+            renderingIntent=intent
+        )
+        icc_transform_cache.put(key, transform, nbytes=0)
+    return transform
+
+
 def _remove_white_background(image):
     """Remove white background in the preview image."""
-    from PIL import ImageMath, Image
+    from PIL import Image
     if image.mode == "RGBA":
-        bands = image.split()
-        a = bands[3]
-        rgb = [
-            ImageMath.eval(
-                'convert('
-                'float(x + a - 255) * 255.0 / float(max(a, 1)) * '
-                'float(min(a, 1)) + float(x) * float(1 - min(a, 1))'
-                ', "L")',
-                x=x,
-                a=a
-            ) for x in bands[:3]
-        ]
-        return Image.merge(bands=rgb + [a], mode="RGBA")
+        data = remove_white_background(np.array(image))
+        return Image.fromarray(data)
 
     return image
@@ -14,6 +14,7 @@ from psd_tools.api.layers import (
 )
 from psd_tools.api import adjustments
 from psd_tools.api import deprecated
+from psd_tools.utils import LRUCache
 
 logger = logging.getLogger(__name__)
 
@@ -39,6 +40,8 @@ class PSDImage(GroupMixin):
         self._record = data
         self._layers = []
         self._tagged_blocks = None
+        self._patterns = None
+        self._pattern_cache = LRUCache(max_bytes=32 * 1024 * 1024)
         self._init()
 
     @classmethod
@@ -159,16 +162,19 @@ class PSDImage(GroupMixin):
             image = image.crop(bbox)
         return image
 
-    def numpy(self, channel=None):
+    def numpy(self, channel=None, dtype=None):
         """
         Get NumPy array of the layer.
 
         :param channel: Which channel to return, can be 'color',
             'shape', 'alpha', or 'mask'. Default is 'color+alpha'.
+        :param dtype: Output dtype. Default `None` gives float32 in
+            [0.0, 1.0]. 'native' gives the stored values without scaling.
+            See :py:meth:`~psd_tools.api.layers.Layer.numpy`.
         :return: :py:class:`numpy.ndarray`
         """
         from .numpy_io import get_array
-        return get_array(self, channel)
+        return get_array(self, channel, dtype=dtype)
 
     def composite(
         self,
@@ -202,6 +208,127 @@ class PSDImage(GroupMixin):
             return self.topil(apply_icc=apply_icc)
         return composite_pil(self, color, alpha, viewport, layer_filter, force, apply_icc=apply_icc)
 
+    def composite_many(
+        self,
+        layer_filters,
+        viewport=None,
+        force=False,
+        color=1.0,
+        alpha=0.0,
+        ignore_preview=False,
+        apply_icc=False,
+        cache=None,
+    ):
+        """
+        Composite the PSD image for each of the layer filters.
+
+        Layer channels, masks, and fills are decoded once and shared across
+        all the variants, and groups whose layers are rendered identically
+        are composited once.
+
+        Example::
+
+            images = psd.composite_many([
+                lambda layer: layer.is_visible() and layer.name != 'Logo',
+                lambda layer: layer.is_visible() and layer.kind != 'type',
+            ])
+
+        :param layer_filters: Iterable of callables, each takes a layer as
+            argument and returns whether if the layer is composited. See
+            :py:meth:`composite`.
+        :param cache: :py:class:`~psd_tools.composite.CompositeCache` to
+            share. Default creates a new cache for this call.
+        :return: `list` of :py:class:`PIL.Image`.
+
+        See :py:meth:`composite` for the other arguments.
+        """
+        from psd_tools.composite import composite_pil, CompositeCache
+        cache = cache or CompositeCache()
+        images = []
+        for layer_filter in layer_filters:
+            if not (ignore_preview or force or
+                    layer_filter) and self.has_preview():
+                images.append(self.topil(apply_icc=apply_icc))
+                continue
+            images.append(
+                composite_pil(
+                    self,
+                    color,
+                    alpha,
+                    viewport,
+                    layer_filter,
+                    force,
+                    apply_icc=apply_icc,
+                    cache=cache,
+                )
+            )
+        return images
+
+    def iter_preview_rows(self, band=256, dtype=None):
+        """
+        Iterate over bands of rows of the pre-composited preview.
+
+        Only one band of the preview is decoded at a time, so this is
+        suitable for large PSB files. See
+        :py:func:`~psd_tools.api.stream_io.export_preview` to write the
+        preview to a file progressively.
+
+        Example::
+
+            for rows in psd.iter_preview_rows(band=512):
+                process(rows)
+
+        :param band: number of rows in each band.
+        :param dtype: Output dtype. See :py:meth:`numpy`.
+        :return: iterator of (rows, width, channels)
+            :py:class:`numpy.ndarray`, with all the channels as
+            :py:meth:`numpy`.
+        """
+        from .numpy_io import iter_image_data
+        return iter_image_data(self, band, dtype)
+
+    def composite_to(
+        self,
+        fp,
+        format='png',
+        band_height=256,
+        force=False,
+        color=1.0,
+        alpha=0.0,
+        layer_filter=None,
+    ):
+        """
+        Composite the PSD image and write it to a file band by band.
+
+        Unlike :py:meth:`composite`, the whole image is never held in memory;
+        each band of rows is composited and passed to an incremental encoder.
+        Non-RGB documents are converted to sRGB, and the output always has
+        an alpha channel.
+
+        Example::
+
+            psd.composite_to('output.png')
+            psd.composite_to('output.tiff', format='tiff', band_height=512)
+
+        :param fp: filename or file-like object. TIFF requires a seekable
+            file.
+        :param format: 'png' or 'tiff'.
+        :param band_height: number of rows to composite at once.
+
+        See :py:meth:`composite` for the other arguments.
+        """
+        from .stream_io import composite_to
+        composite_to(
+            self,
+            fp,
+            format=format,
+            band_height=band_height,
+            force=force,
+            color=color,
+            alpha=alpha,
+            layer_filter=layer_filter,
+        )
+
     def is_visible(self):
         """
         Returns visibility of the element.
@@ -516,14 +643,19 @@ class PSDImage(GroupMixin):
         )
 
     def _get_pattern(self, pattern_id):
-        """Get pattern item by id."""
-        for key in (Tag.PATTERNS1, Tag.PATTERNS2, Tag.PATTERNS3):
-            if key in self.tagged_blocks:
-                data = self.tagged_blocks.get_data(key)
-                for pattern in data:
-                    if pattern.pattern_id == pattern_id:
-                        return pattern
-        return None
+        """
+        Get pattern item by id.
+
+        Patterns are indexed by id on the first lookup. Decoded pattern tiles
+        are kept in :py:attr:`_pattern_cache` keyed by the id and the scale.
+        """
+        if self._patterns is None:
+            self._patterns = {}
+            for key in (Tag.PATTERNS1, Tag.PATTERNS2, Tag.PATTERNS3):
+                if self.tagged_blocks and key in self.tagged_blocks:
+                    for pattern in self.tagged_blocks.get_data(key):
+                        self._patterns.setdefault(pattern.pattern_id, pattern)
+        return self._patterns.get(pattern_id)
 
     def _init(self):
         """Initialize layer structure."""
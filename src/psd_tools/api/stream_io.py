@@ -0,0 +1,367 @@
+"""
+Streaming image export.
+
+Writers in this module take an image as horizontal bands of rows, so that
+very large documents can be exported with memory bounded by the band size.
+:py:class:`PNGWriter` feeds rows to an incremental zlib stream, and
+:py:class:`TIFFWriter` stores each band as a strip.
+"""
+from __future__ import absolute_import, unicode_literals
+import logging
+import struct
+import zlib
+
+import numpy as np
+
+from psd_tools.constants import ColorMode
+
+logger = logging.getLogger(__name__)
+
+
+class PNGWriter(object):
+    """
+    Incremental PNG encoder.
+
+    Example::
+
+        with open('output.png', 'wb') as f:
+            writer = PNGWriter(f, width, height, channels=4)
+            for rows in bands:
+                writer.write(rows)
+            writer.close()
+
+    :param fp: file-like object to write.
+    :param width: image width.
+    :param height: image height.
+    :param channels: 1 (L), 2 (LA), 3 (RGB), or 4 (RGBA).
+    :param bit_depth: 8 or 16.
+    :param level: zlib compression level.
+    """
+    _COLOR_TYPES = {1: 0, 2: 4, 3: 2, 4: 6}
+
+    def __init__(
+        self, fp, width, height, channels, bit_depth=8, level=6
+    ):
+        self._fp = fp
+        self._width = width
+        self._height = height
+        self._channels = channels
+        self._bit_depth = bit_depth
+        self._rows = 0
+        self._compressor = zlib.compressobj(level)
+        fp.write(b'\x89PNG\r\n\x1a\n')
+        self._write_chunk(
+            b'IHDR',
+            struct.pack(
+                '>IIBBBBB', width, height, bit_depth,
+                self._COLOR_TYPES[channels], 0, 0, 0
+            )
+        )
+
+    def write(self, rows):
+        """
+        Write a band of rows.
+
+        :param rows: (N, width, channels) array of uint8 or uint16.
+        """
+        rows = _check_rows(rows, self._width, self._channels)
+        dtype = '>u2' if self._bit_depth == 16 else 'u1'
+        data = rows.astype(dtype, copy=False).reshape((rows.shape[0], -1))
+        # Each scanline starts with the filter type, 0 for none.
+        scanlines = np.zeros((rows.shape[0], 1 + data.nbytes // rows.shape[0]),
+                             dtype=np.uint8)
+        scanlines[:, 1:] = data.view(np.uint8)
+        self._rows += rows.shape[0]
+        self._write_data(self._compressor.compress(scanlines.tobytes()))
+
+    def close(self):
+        """Finish the stream."""
+        if self._rows != self._height:
+            raise ValueError(
+                'Expected %d rows, written %d' % (self._height, self._rows)
+            )
+        self._write_data(self._compressor.flush())
+        self._write_chunk(b'IEND', b'')
+
+    def _write_data(self, data):
+        if data:
+            self._write_chunk(b'IDAT', data)
+
+    def _write_chunk(self, kind, data):
+        self._fp.write(struct.pack('>I', len(data)))
+        self._fp.write(kind)
+        self._fp.write(data)
+        self._fp.write(struct.pack('>I', zlib.crc32(kind + data) & 0xffffffff))
+
+
+class TIFFWriter(object):
+    """
+    Incremental TIFF encoder that writes each band as a strip.
+
+    All the bands except the last must have the same number of rows. The
+    file must be seekable, as the header is updated at :py:meth:`close`.
+
+    :param fp: seekable file-like object to write.
+    :param width: image width.
+    :param height: image height.
+    :param channels: 1 (L), 2 (LA), 3 (RGB), or 4 (RGBA).
+    :param bit_depth: 8 or 16.
+    :param compress: Whether to deflate strips.
+    """
+    def __init__(
+        self, fp, width, height, channels, bit_depth=8, compress=True
+    ):
+        self._fp = fp
+        self._width = width
+        self._height = height
+        self._channels = channels
+        self._bit_depth = bit_depth
+        self._compress = compress
+        self._offsets = []
+        self._counts = []
+        self._rows_per_strip = None
+        self._rows = 0
+        self._start = fp.tell()
+        fp.write(b'II*\x00' + struct.pack('<I', 0))
+
+    def write(self, rows):
+        """
+        Write a band of rows as a strip.
+
+        :param rows: (N, width, channels) array of uint8 or uint16.
+        """
+        rows = _check_rows(rows, self._width, self._channels)
+        if self._rows_per_strip is None:
+            self._rows_per_strip = rows.shape[0]
+        elif self._rows + rows.shape[0] < self._height and (
+            rows.shape[0] != self._rows_per_strip
+        ):
+            raise ValueError(
+                'Band height must be %d, given %d' %
+                (self._rows_per_strip, rows.shape[0])
+            )
+        dtype = '<u2' if self._bit_depth == 16 else 'u1'
+        data = rows.astype(dtype, copy=False).tobytes()
+        if self._compress:
+            data = zlib.compress(data)
+        self._offsets.append(self._fp.tell() - self._start)
+        self._counts.append(len(data))
+        self._fp.write(data)
+        self._rows += rows.shape[0]
+
+    def close(self):
+        """Write the image file directory and update the header."""
+        if self._rows != self._height:
+            raise ValueError(
+                'Expected %d rows, written %d' % (self._height, self._rows)
+            )
+        SHORT, LONG = 3, 4
+        photometric = 2 if self._channels >= 3 else 1
+        entries = [
+            (256, LONG, [self._width]),
+            (257, LONG, [self._height]),
+            (258, SHORT, [self._bit_depth] * self._channels),
+            (259, SHORT, [8 if self._compress else 1]),
+            (262, SHORT, [photometric]),
+            (273, LONG, self._offsets),
+            (277, SHORT, [self._channels]),
+            (278, LONG, [self._rows_per_strip or self._height]),
+            (279, LONG, self._counts),
+            (284, SHORT, [1]),
+        ]
+        if self._channels in (2, 4):
+            entries.append((338, SHORT, [2]))  # Unassociated alpha.
+
+        position = self._fp.tell()
+        if position % 2:
+            self._fp.write(b'\x00')
+            position += 1
+        ifd_offset = position - self._start
+        extra_offset = ifd_offset + 2 + 12 * len(entries) + 4
+        ifd, extra = [struct.pack('<H', len(entries))], []
+        for tag, kind, values in entries:
+            fmt = '<%d%s' % (len(values), 'H' if kind == SHORT else 'I')
+            data = struct.pack(fmt, *values)
+            if len(data) <= 4:
+                ifd.append(
+                    struct.pack('<HHI', tag, kind, len(values)) +
+                    data.ljust(4, b'\x00')
+                )
+            else:
+                ifd.append(
+                    struct.pack(
+                        '<HHII', tag, kind, len(values), extra_offset
+                    )
+                )
+                extra.append(data)
+                extra_offset += len(data)
+        ifd.append(struct.pack('<I', 0))
+        self._fp.write(b''.join(ifd + extra))
+        end = self._fp.tell()
+        self._fp.seek(self._start + 4)
+        self._fp.write(struct.pack('<I', ifd_offset))
+        self._fp.seek(end)
+
+
+WRITERS = {
+    'png': PNGWriter,
+    'tif': TIFFWriter,
+    'tiff': TIFFWriter,
+}
+
+
+def composite_to(
+    psd,
+    fp,
+    format='png',
+    band_height=256,
+    force=False,
+    color=1.0,
+    alpha=0.0,
+    layer_filter=None,
+    dtype=np.uint8,
+):
+    """
+    Composite the document band by band and write to the file.
+
+    Each band is composited with its own viewport, padded by the widest
+    stroke in the document, so only the rows of layer pixels that overlap
+    the band are decoded. Non-RGB documents are converted to sRGB, grayscale
+    is kept as gray.
+
+    :param psd: :py:class:`~psd_tools.api.psd_image.PSDImage`.
+    :param fp: filename or file-like object.
+    :param format: 'png' or 'tiff'.
+    :param band_height: number of rows to composite at once.
+    :param dtype: `np.uint8` or `np.uint16` output.
+    """
+    if hasattr(fp, 'write'):
+        _composite_to(
+            psd, fp, format, band_height, force, color, alpha, layer_filter,
+            dtype
+        )
+    else:
+        with open(fp, 'wb') as f:
+            _composite_to(
+                psd, f, format, band_height, force, color, alpha,
+                layer_filter, dtype
+            )
+
+
+def _composite_to(
+    psd, fp, format, band_height, force, color, alpha, layer_filter, dtype
+):
+    from psd_tools.composite import composite, quantize
+    from psd_tools.composite.color import convert_to_rgb
+    from psd_tools.composite.effects import get_effect_margin
+
+    writer_class = WRITERS.get(format.lower())
+    if writer_class is None:
+        raise ValueError('Unsupported format: %s' % format)
+
+    gray = psd.color_mode in (ColorMode.GRAYSCALE, ColorMode.DUOTONE)
+    channels = 2 if gray else 4
+    bit_depth = np.iinfo(dtype).bits
+    writer = writer_class(fp, psd.width, psd.height, channels, bit_depth)
+    margin = max(
+        [0] + [get_effect_margin(layer) for layer in psd.descendants()]
+    )
+    left, top, right, bottom = psd.viewbox
+    for y in range(top, bottom, band_height):
+        band = (y, min(y + band_height, bottom))
+        viewport = (left, max(top, band[0] - margin), right,
+                    min(bottom, band[1] + margin))
+        logger.debug('Compositing band %d-%d' % band)
+        values, _, values_alpha = composite(
+            psd,
+            color=color,
+            alpha=alpha,
+            viewport=viewport,
+            layer_filter=layer_filter,
+            force=force,
+        )
+        inner = slice(band[0] - viewport[1], band[1] - viewport[1])
+        values, values_alpha = values[inner], values_alpha[inner]
+        if gray:
+            values = values[:, :, :1]
+        elif psd.color_mode != ColorMode.RGB or values.shape[2] != 3:
+            values = convert_to_rgb(values, psd.color_mode)
+        writer.write(
+            quantize(np.concatenate([values, values_alpha], axis=2), dtype)
+        )
+    writer.close()
+
+
+def export_preview(psd, fp, format='png', band_height=256):
+    """
+    Write the pre-composited preview to the file band by band.
+
+    RGB and grayscale previews keep their bit depth, 8 or 16. Other color
+    modes are converted to 8-bit sRGB.
+
+    :param psd: :py:class:`~psd_tools.api.psd_image.PSDImage`.
+    :param fp: filename or file-like object.
+    :param format: 'png' or 'tiff'.
+    :param band_height: number of rows to decode at once.
+    """
+    if hasattr(fp, 'write'):
+        _export_preview(psd, fp, format, band_height)
+    else:
+        with open(fp, 'wb') as f:
+            _export_preview(psd, f, format, band_height)
+
+
+def _export_preview(psd, fp, format, band_height):
+    from psd_tools.composite import quantize
+    from psd_tools.composite.color import convert_to_rgb
+    from .numpy_io import (
+        EXPECTED_CHANNELS, has_transparency, get_transparency_index
+    )
+
+    writer_class = WRITERS.get(format.lower())
+    if writer_class is None:
+        raise ValueError('Unsupported format: %s' % format)
+
+    expected = EXPECTED_CHANNELS[psd.color_mode]
+    if psd.color_mode == ColorMode.DUOTONE:
+        expected = 1  # Only the first ink is shown.
+    passthrough = psd.color_mode in (
+        ColorMode.RGB, ColorMode.GRAYSCALE, ColorMode.DUOTONE
+    ) and psd.depth in (8, 16)
+    color_channels = expected if passthrough else 3
+    alpha_indices = []
+    if has_transparency(psd):
+        alpha_indices.append(get_transparency_index(psd) % psd.channels)
+    if psd.color_mode == ColorMode.INDEXED:
+        # Indexed color is expanded to RGB, shifting the other planes.
+        alpha_indices = [i + 2 for i in alpha_indices]
+    indices = list(range(expected)) + alpha_indices
+    dtype = np.uint16 if passthrough and psd.depth == 16 else np.uint8
+
+    writer = writer_class(
+        fp, psd.width, psd.height, color_channels + len(alpha_indices),
+        np.iinfo(dtype).bits
+    )
+    for rows in psd.iter_preview_rows(
+        band_height, dtype=dtype if passthrough else None
+    ):
+        rows = rows[:, :, indices]
+        if not passthrough:
+            color = convert_to_rgb(rows[:, :, :expected], psd.color_mode)
+            rows = quantize(
+                np.concatenate([color, rows[:, :, expected:]], axis=2),
+                dtype
+            )
+        writer.write(rows)
+    writer.close()
+
+
+def _check_rows(rows, width, channels):
+    if rows.ndim == 2:
+        rows = rows[:, :, np.newaxis]
+    if rows.shape[1:] != (width, channels):
+        raise ValueError(
+            'Invalid rows shape %r, expected (N, %d, %d)' %
+            ((rows.shape, width, channels))
+        )
+    return rows
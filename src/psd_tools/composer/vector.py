@@ -48,23 +48,24 @@ def draw_vector_mask(layer, bbox=None):
 
 def draw_stroke(backdrop, layer, vector_mask=None):
     from PIL import Image, ImageChops
-    import aggdraw
     from psd_tools.composer.blend import blend
+    from psd_tools.composite.rasterizer import (
+        flatten_curves, get_curves, stroke
+    )
     width = layer._psd.width
     height = layer._psd.height
     setting = layer.stroke._data
 
     # Draw mask.
     stroke_width = float(setting.get('strokeStyleLineWidth', 1.))
-    mask = Image.new('L', (width, height))
-    draw = aggdraw.Draw(mask)
-    for subpath in layer.vector_mask.paths:
-        path = ' '.join(map(str, _generate_symbol(subpath, width, height)))
-        symbol = aggdraw.Symbol(path)
-        pen = aggdraw.Pen(255, int(2 * stroke_width))
-        draw.symbol((0, 0), symbol, pen, None)
-    draw.flush()
-    del draw
+    polylines = [
+        flatten_curves(get_curves(subpath, width, height))
+        for subpath in layer.vector_mask.paths
+    ]
+    closed = [subpath.is_closed() for subpath in layer.vector_mask.paths]
+    mask = _to_image(
+        stroke(polylines, int(2 * stroke_width), width, height, closed)
+    )
 
     # For now, path operations are not implemented.
     if vector_mask:
@@ -99,49 +100,19 @@ def draw_stroke(backdrop, layer, vector_mask=None):
 
 def _draw_subpath(subpath, width, height):
     from PIL import Image
-    import aggdraw
-    mask = Image.new('L', (width, height), 0)
+    from psd_tools.composite.rasterizer import (
+        fill, flatten_curves, get_curves
+    )
     if len(subpath) <= 1:
         logger.warning('not enough knots: %d' % len(subpath))
-        return mask
-    path = ' '.join(map(str, _generate_symbol(subpath, width, height)))
-    draw = aggdraw.Draw(mask)
-    brush = aggdraw.Brush(255)
-    symbol = aggdraw.Symbol(path)
-    draw.symbol((0, 0), symbol, None, brush)
-    draw.flush()
-    del draw
-    return mask
-
-
-def _generate_symbol(path, width, height, command='C'):
-    """Sequence generator for SVG path."""
-    if len(path) == 0:
-        return
+        return Image.new('L', (width, height), 0)
+    polyline = flatten_curves(get_curves(subpath, width, height))
+    return _to_image(fill([polyline], width, height))
 
-    # Initial point.
-    yield 'M'
-    yield path[0].anchor[1] * width
-    yield path[0].anchor[0] * height
-    yield command
 
-    # Closed path or open path
-    points = (
-        zip(path, path[1:] +
-            path[0:1]) if path.is_closed() else zip(path, path[1:])
-    )
-
-    # Rest of the points.
-    for p1, p2 in points:
-        yield p1.leaving[1] * width
-        yield p1.leaving[0] * height
-        yield p2.preceding[1] * width
-        yield p2.preceding[0] * height
-        yield p2.anchor[1] * width
-        yield p2.anchor[0] * height
-
-    if path.is_closed():
-        yield 'Z'
+def _to_image(coverage):
+    from PIL import Image
+    return Image.fromarray((coverage * 255. + .5).astype('uint8'), 'L')
 
 
 def _apply_opacity(image, setting):
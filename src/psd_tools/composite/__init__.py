@@ -2,9 +2,10 @@ import numpy as np
 from psd_tools.api.psd_image import PSDImage
 from psd_tools.constants import Tag, BlendMode, ColorMode, Resource
 from psd_tools.api.layers import AdjustmentLayer, Layer
-from psd_tools.api.numpy_io import EXPECTED_CHANNELS
+from psd_tools.api.numpy_io import EXPECTED_CHANNELS, get_array
 from psd_tools.api.pil_io import post_process
 
+import contextlib
 import logging
 
 from psd_tools.psd import image_resources
@@ -13,13 +14,21 @@ from .vector import (
     create_fill, create_fill_desc, draw_vector_mask, draw_stroke,
     draw_solid_color_fill, draw_pattern_fill, draw_gradient_fill
 )
-from .effects import draw_stroke_effect
+from .adjustments import get_adjustment_lut
+from .effects import (
+    draw_stroke_effect, draw_shadow_effect, draw_glow_effect,
+    get_stroke_effect_size, get_blur_effect_size
+)
+from .cache import CompositeCache
+from .session import CompositeSession
+from .stack import PrefixStack
 
 logger = logging.getLogger(__name__)
 
 
 def composite_pil(
-    layer, color, alpha, viewport, layer_filter, force, as_layer=False, apply_icc = False
+    layer, color, alpha, viewport, layer_filter, force, as_layer=False, apply_icc = False,
+    cache=None
 ):
     from PIL import Image
     from psd_tools.api.pil_io import get_pil_mode
@@ -40,7 +49,9 @@ def composite_pil(
         viewport=viewport,
         layer_filter=layer_filter,
         force=force,
-        as_layer=as_layer
+        as_layer=as_layer,
+        cache=cache,
+        dtype=np.uint8,
     )
 
     mode = get_pil_mode(color_mode)
@@ -62,10 +73,15 @@ def composite_pil(
         color = color[:, :, 0]
     if color.shape[0] == 0 or color.shape[1] == 0:
         return None
-    image = Image.fromarray((255 * color).astype(np.uint8), mode)
+    image = Image.frombuffer(
+        mode, (color.shape[1], color.shape[0]), np.ascontiguousarray(color),
+        'raw', mode, 0, 1
+    )
     alpha_as_image = None
     if not force and delay_alpha_application:
-        alpha_as_image = Image.fromarray((255 * np.squeeze(alpha, axis=2)).astype(np.uint8), "L")
+        alpha_as_image = Image.frombuffer(
+            'L', (alpha.shape[1], alpha.shape[0]), alpha, 'raw', 'L', 0, 1
+        )
     icc = None
     image_resources = layer.image_resources if isinstance(layer, PSDImage) else layer._psd.image_resources
     if (apply_icc and Resource.ICC_PROFILE in image_resources):
@@ -81,21 +97,59 @@ def composite(
     layer_filter=None,
     force=False,
     as_layer=False,
+    cache=None,
+    dtype=None,
+    dither=False,
 ):
     """
     Composite the given group of layers.
+
+    :param cache: Optional :py:class:`CompositeCache` to reuse group
+        composites across calls.
+    :param dtype: Output dtype. Default `None` gives float32 in [0.0, 1.0].
+        `np.uint8` or `np.uint16` quantize the result in a single chunked
+        pass without float temporaries of the full size.
+    :param dither: Apply ordered dithering when quantizing to 8-bit.
     """
+    viewport = _get_viewport(group, viewport)
+
+    if getattr(group, 'kind', None) == 'psdimage' and len(group) == 0:
+        # Decode only the rows in the viewport, e.g., a band when streaming.
+        top = min(max(viewport[1], 0), group.height)
+        bottom = min(max(viewport[3], top), group.height)
+        color = get_array(group, 'color', rows=(top, bottom))
+        shape = get_array(group, 'shape', rows=(top, bottom))
+        bbox = (0, top, group.width, bottom)
+        if viewport != bbox:
+            color = paste(viewport, bbox, color, 1.)
+            shape = paste(viewport, bbox, shape)
+        if dtype is not None:
+            color = quantize(color, dtype, dither)
+            shape = quantize(shape, dtype, dither)
+        return color, shape, shape
+
+    compositor = _create_compositor(
+        group, viewport, color, alpha, layer_filter, force, cache
+    )
+    with cache.render() if cache is not None else contextlib.nullcontext():
+        for layer in (
+            group if hasattr(group, '__iter__') and not as_layer else [group]
+        ):
+            compositor.apply(layer)
+
+        return compositor.finish(dtype, dither)
+
+
+def _get_viewport(group, viewport=None):
     viewport = viewport or getattr(group, 'viewbox', None) or group.bbox
     if viewport == (0, 0, 0, 0):
         viewport = getattr(group, '_psd').viewbox
+    return viewport
 
-    if getattr(group, 'kind', None) == 'psdimage' and len(group) == 0:
-        color, shape = group.numpy('color'), group.numpy('shape')
-        if viewport != group.viewbox:
-            color = paste(viewport, group.bbox, color, 1.)
-            shape = paste(viewport, group.bbox, shape)
-        return color, shape, shape
 
+def _create_compositor(
+    group, viewport, color, alpha, layer_filter, force, cache=None
+):
     if not isinstance(color, np.ndarray) and not hasattr(color, '__iter__'):
         color_mode = getattr(group, '_psd', group).color_mode
         color = (color, ) * EXPECTED_CHANNELS.get(color_mode)
@@ -106,15 +160,9 @@ def composite(
 
     layer_filter = layer_filter or Layer.is_visible
 
-    compositor = Compositor(
-        viewport, color, alpha, isolated, layer_filter, force
+    return Compositor(
+        viewport, color, alpha, isolated, layer_filter, force, cache
     )
-    for layer in (
-        group if hasattr(group, '__iter__') and not as_layer else [group]
-    ):
-        compositor.apply(layer)
-
-    return compositor.finish()
 
 
 def paste(viewport, bbox, values, background=None):
@@ -158,10 +206,12 @@ class Compositor(object):
         isolated=False,
         layer_filter=None,
         force=False,
+        cache=None,
     ):
         self._viewport = viewport
         self._layer_filter = layer_filter
         self._force = force
+        self._cache = cache
         self._clip_mask = 1.
 
         if isolated:
@@ -188,6 +238,7 @@ class Compositor(object):
                                  dtype=np.float32)
         self._color = self._color_0
         self._alpha = self._alpha_0
+        self._tone_lut = None
 
     def apply(self, layer):
         logger.debug('Compositing %s' % layer)
@@ -196,9 +247,16 @@ class Compositor(object):
             logger.debug('Ignore %s' % layer)
             return
         if isinstance(layer, AdjustmentLayer):
-            logger.debug('Ignore adjustment %s' % layer)
+            self._apply_adjustment(layer)
             return
-        if _intersect(self._viewport, layer.bbox) == (0, 0, 0, 0):
+        self._flush_adjustments()
+        if self._has_pass_through_adjustment(layer):
+            self._apply_pass_through(layer)
+            return
+        size = max(get_stroke_effect_size(layer), get_blur_effect_size(layer))
+        if _intersect(self._viewport, _expand(layer.bbox, size)) == (
+            0, 0, 0, 0
+        ):
             logger.debug('Out of viewport %s' % (layer))
             return
 
@@ -213,23 +271,33 @@ class Compositor(object):
         shape *= shape_mask
         alpha *= shape_mask * opacity_mask * opacity_const
 
+        # Effects follow the layer shape around the bbox within their reach.
+        use_mask = (self._force and layer.has_vector_mask()) or (
+            not layer.has_pixels() and has_fill(layer)
+        )
+        region, shape_e = None, None
+        if size:
+            region, shape_e = self._get_effect_shape(
+                layer, shape_mask if use_mask else shape, use_mask, size
+            )
+        opacity = opacity_mask * opacity_const
+
         # TODO: Tag.BLEND_INTERIOR_ELEMENTS controls how inner effects apply.
 
-        # TODO: Apply before effects
+        if region is not None:
+            self._apply_drop_shadow(layer, region, shape_e, shape, opacity)
+            self._apply_outer_glow(layer, region, shape_e, opacity)
         self._apply_source(
             color, shape * shape_const, alpha * shape_const, layer.blend_mode,
             knockout
         )
 
-        # TODO: Apply after effects
         self._apply_color_overlay(layer, color, shape, alpha)
         self._apply_pattern_overlay(layer, color, shape, alpha)
         self._apply_gradient_overlay(layer, color, shape, alpha)
-        if ((self._force and layer.has_vector_mask()) or (
-            not layer.has_pixels()) and has_fill(layer)):
-            self._apply_stroke_effect(layer, color, shape_mask, alpha)
-        else:
-            self._apply_stroke_effect(layer, color, shape, alpha)
+        if region is not None:
+            self._apply_inner_effects(layer, region, shape_e, shape, alpha)
+            self._apply_stroke_effect(layer, region, shape_e, size)
 
     def _apply_source(self, color, shape, alpha, blend_mode, knockout=False):
         if self._color_0.shape[2] == 1 and 1 < color.shape[2]:
@@ -257,8 +325,114 @@ class Compositor(object):
                     self._alpha)
         )
 
-    def finish(self):
-        return self.color, self.shape, self.alpha
+    def _has_pass_through_adjustment(self, layer):
+        """Whether adjustments in the pass-through group reach the backdrop."""
+        if not layer.is_group() or layer.blend_mode != BlendMode.PASS_THROUGH:
+            return False
+        if layer.has_clip_layers() or layer.tagged_blocks.get_data(
+            Tag.KNOCKOUT_SETTING, 0
+        ):
+            return False
+        return any(
+            self._layer_filter(child) and (
+                isinstance(child, AdjustmentLayer) or
+                self._has_pass_through_adjustment(child)
+            ) for child in layer
+        )
+
+    def _apply_pass_through(self, layer):
+        """
+        Apply the children of the pass-through group in place.
+
+        A group composite cannot carry the change of an adjustment to the
+        backdrop, so the children apply directly, and the group mask and
+        opacity mix the result with the previous state.
+        """
+        state = (self._color, self._alpha, self._shape_g, self._alpha_g)
+        for child in layer:
+            self.apply(child)
+        self._flush_adjustments()
+
+        shape_mask, opacity_mask = self._get_mask(layer)
+        _, opacity_const = self._get_const(layer)
+        weight = shape_mask * opacity_mask * opacity_const
+        if isinstance(weight, np.ndarray) or weight != 1.:
+            result = (self._color, self._alpha, self._shape_g, self._alpha_g)
+            self._color, self._alpha, self._shape_g, self._alpha_g = (
+                before + (after - before) * weight
+                for before, after in zip(state, result)
+            )
+
+    def _apply_adjustment(self, layer):
+        """
+        Apply the adjustment to the backdrop.
+
+        Adjustments that apply fully, without a mask, opacity, or a blending
+        mode, are fused into one lookup table until the next layer.
+        """
+        lut = get_adjustment_lut(layer, self._color.shape[2])
+        if lut is None:
+            logger.debug('Ignore adjustment %s' % layer)
+            return
+
+        shape_mask, opacity_mask = self._get_mask(layer)
+        shape_const, opacity_const = self._get_const(layer)
+        opacity = shape_mask * opacity_mask * opacity_const * shape_const
+        if layer.blend_mode == BlendMode.NORMAL and not isinstance(
+            opacity, np.ndarray
+        ) and opacity == 1.:
+            logger.debug('Fuse adjustment %s' % layer)
+            if self._tone_lut is not None:
+                lut = self._tone_lut.then(lut)
+            self._tone_lut = lut
+            return
+
+        self._flush_adjustments()
+        self._blend_adjustment(lut, layer.blend_mode, opacity)
+
+    def _flush_adjustments(self):
+        """Apply the fused adjustments, if any."""
+        if self._tone_lut is not None:
+            lut, self._tone_lut = self._tone_lut, None
+            self._blend_adjustment(lut, BlendMode.NORMAL, 1.)
+
+    def _blend_adjustment(self, lut, blend_mode, opacity):
+        color = lut.apply(self._color)
+        if blend_mode != BlendMode.NORMAL:
+            color = BLEND_FUNC.get(blend_mode, normal)(self._color, color)
+        # Transparent pixels have nothing to adjust.
+        weight = opacity * (self._alpha > 0.)
+        self._color = self._color + (color - self._color) * weight
+
+    def finish(self, dtype=None, dither=False):
+        """
+        Get the composited result.
+
+        :param dtype: Optional integer dtype to quantize the result to. The
+            color is un-premultiplied from the backdrop, clipped, scaled, and
+            rounded band by band into the output buffer.
+        :param dither: Apply ordered dithering for 8-bit output.
+        :return: (color, shape, alpha) tuple of :py:class:`numpy.ndarray`.
+        """
+        self._flush_adjustments()
+        if dtype is None:
+            return self.color, self.shape, self.alpha
+
+        color = np.empty(
+            (self.height, self.width, self._color.shape[2]), dtype=dtype
+        )
+        for y in range(0, self.height, QUANTIZE_BAND_HEIGHT):
+            band = slice(y, y + QUANTIZE_BAND_HEIGHT)
+            alpha_0 = self._alpha_0[band]
+            values = self._color[band] - self._color_0[band]
+            values *= _divide(alpha_0, self._alpha_g[band]) - alpha_0
+            values += self._color[band]
+            _quantize_band(values, color[band], y, dither)
+        return (
+            color,
+            quantize(self._shape_g, dtype, dither),
+            quantize(self._alpha_g, dtype, dither),
+        )
 
     @property
     def viewport(self):
@@ -274,6 +448,7 @@ class Compositor(object):
 
     @property
     def color(self):
+        self._flush_adjustments()
         return _clip(
             self._color + (self._color - self._color_0) *
             (_divide(self._alpha_0, self._alpha_g) - self._alpha_0)
@@ -295,14 +470,30 @@ class Compositor(object):
         else:
             color_b = self._color
             alpha_b = self._alpha
+        color_b = paste(viewport, self._viewport, color_b, 1.)
+        alpha_b = paste(viewport, self._viewport, alpha_b)
+
+        key = None
+        if self._cache is not None:
+            # Isolated group does not depend on the backdrop.
+            isolated = layer.blend_mode != BlendMode.PASS_THROUGH
+            key = self._cache.group_key(
+                layer, (viewport, self._viewport), self._layer_filter,
+                self._force, None if isolated else (color_b, alpha_b)
+            )
+            cached = self._cache.get_group(key)
+            if cached is not None:
+                logger.debug('Cached %s' % layer)
+                return cached
 
         color, shape, alpha = composite(
             layer,
-            paste(viewport, self._viewport, color_b, 1.),
-            paste(viewport, self._viewport, alpha_b),
+            color_b,
+            alpha_b,
             viewport,
             layer_filter=self._layer_filter,
-            force=self._force
+            force=self._force,
+            cache=self._cache,
         )
         color = paste(self._viewport, viewport, color, 1.)
         shape = paste(self._viewport, viewport, shape)
@@ -315,15 +506,22 @@ class Compositor(object):
         assert color is not None
         assert shape is not None
         assert alpha is not None
+        if key is not None:
+            self._cache.put_group(key, (color, shape, alpha))
         return color, shape, alpha
 
     def _get_object(self, layer):
         """Get object attributes."""
-        color, shape = layer.numpy('color'), layer.numpy('shape')
+        color, shape, bbox = self._get_pixels(layer)
         if (self._force or not layer.has_pixels()) and has_fill(layer):
-            color, shape = create_fill(layer, layer.bbox)
+            # Draw only the part in the viewport, e.g., a band in streaming.
+            bbox = _intersect(self._viewport, layer.bbox)
+            color, shape = self._memoize(
+                ('fill', bbox), layer,
+                lambda: create_fill(layer, layer.bbox, bbox)
+            )
             if shape is None:
-                shape = np.ones((layer.height, layer.width, 1),
+                shape = np.ones((bbox[3] - bbox[1], bbox[2] - bbox[0], 1),
                                 dtype=np.float32)
 
         if color is None and shape is None:
@@ -334,11 +532,11 @@ class Compositor(object):
         if color is None:
             color = np.ones((self.height, self.width, 1), dtype=np.float32)
         else:
-            color = paste(self._viewport, layer.bbox, color, 1.)
+            color = paste(self._viewport, bbox, color, 1.)
         if shape is None:
             shape = np.ones((self.height, self.width, 1), dtype=np.float32)
         else:
-            shape = paste(self._viewport, layer.bbox, shape)
+            shape = paste(self._viewport, bbox, shape)
 
         alpha = shape * 1.  # Constant factor is always 1.
 
@@ -360,6 +558,36 @@ class Compositor(object):
         assert alpha is not None
         return color, shape, alpha
 
+    def _get_pixels(self, layer):
+        """
+        Get layer pixels, decoding only the rows within the viewport when
+        the viewport is a narrow band of the layer, such as in streaming.
+        """
+        bbox = layer.bbox
+        rows = self._get_rows(bbox)
+        if rows is not None:
+            return (
+                get_array(layer, 'color', rows=rows),
+                get_array(layer, 'shape', rows=rows),
+                (bbox[0], bbox[1] + rows[0], bbox[2], bbox[1] + rows[1]),
+            )
+        # Decoded pixels are shared through numpy_io.decoded_cache.
+        color, shape = get_array(layer, 'color'), get_array(layer, 'shape')
+        return color, shape, bbox
+
+    def _get_rows(self, bbox):
+        """
+        Rows of the bbox to decode when the viewport is a narrow band of it,
+        or `None` to decode all the rows.
+        """
+        top = max(self._viewport[1], bbox[1])
+        bottom = min(self._viewport[3], bbox[3])
+        if self._cache is None and 2 * (bottom - top) < bbox[3] - bbox[1]:
+            if bottom <= top:
+                return (0, 0)  # Outside of the viewport.
+            return (top - bbox[1], bottom - bbox[1])
+        return None
+
     def _apply_clip_layers(self, layer, color, alpha):
         # TODO: Consider Tag.BLEND_CLIPPING_ELEMENTS.
         compositor = Compositor(
@@ -367,10 +595,12 @@ class Compositor(object):
             color,
             alpha,
             layer_filter=self._layer_filter,
-            force=self._force
+            force=self._force,
+            cache=self._cache,
         )
         for clip_layer in layer.clip_layers:
             compositor.apply(clip_layer)
+        compositor._flush_adjustments()
         return compositor._color
 
     def _get_mask(self, layer):
@@ -379,10 +609,16 @@ class Compositor(object):
         opacity = 1.
         if layer.has_mask() and not layer.mask.disabled:
             # TODO: When force, ignore real mask.
-            mask = layer.numpy('mask', real_mask=not self._force)
+            bbox = layer.mask.bbox
+            rows = self._get_rows(bbox)
+            mask = get_array(
+                layer, 'mask', real_mask=not self._force, rows=rows
+            )
+            if rows is not None:
+                bbox = (bbox[0], bbox[1] + rows[0], bbox[2], bbox[1] + rows[1])
             if mask is not None:
                 shape = paste(
-                    self._viewport, layer.mask.bbox, mask,
+                    self._viewport, bbox, mask,
                     layer.mask.background_color / 255.
                 )
             if layer.mask.parameters:
@@ -399,14 +635,23 @@ class Compositor(object):
                 not layer.mask._has_real()
             )
         ):
-            shape_v = draw_vector_mask(layer)
-            shape_v = paste(self._viewport, layer._psd.viewbox, shape_v)
+            shape_v, bbox, background = self._memoize(
+                ('vector_mask', self._viewport), layer,
+                lambda: draw_vector_mask(layer, self._viewport)
+            )
+            shape_v = paste(self._viewport, bbox, shape_v, background)
             shape *= shape_v
 
         assert shape is not None
         assert opacity is not None
         return shape, opacity
 
+    def _memoize(self, kind, layer, func):
+        """Share rendered sources through the cache, if any."""
+        if self._cache is None:
+            return func()
+        return self._cache.get_source(kind, layer, self._force, func)
+
     def _get_const(self, layer):
         """Get constant attributes."""
         shape = layer.tagged_blocks.get_data(
@@ -428,10 +673,8 @@ class Compositor(object):
             layer, desc.get('strokeStyleContent'), viewport
         )
         color = paste(self._viewport, viewport, color, 1.)
-        shape = draw_stroke(layer)
-        if shape.shape[0] != self.height or shape.shape[1] != self.width:
-            bbox = (0, 0, shape.shape[1], shape.shape[0])
-            shape = paste(self._viewport, bbox, shape)
+        shape, bbox, background = draw_stroke(layer, self._viewport)
+        shape = paste(self._viewport, bbox, shape, background)
         opacity = desc.get('strokeStyleOpacity', 100.) / 100.
         alpha = shape * opacity
         return color, shape, alpha
@@ -489,18 +732,91 @@ class Compositor(object):
                 effect.blend_mode
             )
 
-    def _apply_stroke_effect(self, layer, color, shape, alpha):
+    def _get_effect_shape(self, layer, shape, use_mask, size):
+        """
+        Get the region of effects within the size from the layer bbox, and
+        the layer shape in the region.
+        """
+        region = _intersect(
+            _expand(self._viewport, size), _expand(layer.bbox, size)
+        )
+        if _intersect(region, self._viewport) == (0, 0, 0, 0):
+            return None, None
+        if region != _intersect(region, self._viewport):
+            # The shape beyond the viewport is still within the reach.
+            compositor = Compositor(
+                region,
+                layer_filter=self._layer_filter,
+                force=self._force,
+                cache=self._cache,
+            )
+            shape, _ = compositor._get_mask(layer)
+            if not use_mask:
+                shape = shape * compositor._get_object(layer)[1]
+            viewport = region
+        else:
+            viewport = self._viewport
+        if not isinstance(shape, np.ndarray):
+            shape = np.full((
+                viewport[3] - viewport[1], viewport[2] - viewport[0], 1
+            ), shape, dtype=np.float32)
+        return region, paste(region, viewport, shape)
+
+    def _apply_effect(self, region, color, shape, alpha, blend_mode):
+        """Apply the effect rendered in the region."""
+        self._apply_source(
+            paste(self._viewport, region, color, 1.),
+            paste(self._viewport, region, shape),
+            paste(self._viewport, region, alpha),
+            blend_mode,
+        )
+
+    def _apply_drop_shadow(self, layer, region, shape, shape_layer, opacity):
+        for effect in layer.effects.find('dropshadow'):
+            color_e, shape_e = draw_shadow_effect(region, shape, effect)
+            if effect.layer_knocks_out:
+                shape_e = shape_e * (
+                    1. - paste(region, self._viewport, shape_layer)
+                )
+            self._apply_effect(
+                region, color_e, shape_e,
+                shape_e * opacity * effect.opacity / 100., effect.blend_mode
+            )
+
+    def _apply_outer_glow(self, layer, region, shape, opacity):
+        for effect in layer.effects.find('outerglow'):
+            color_e, shape_e = draw_glow_effect(region, shape, effect)
+            shape_e = np.maximum(0., shape_e - shape)
+            self._apply_effect(
+                region, color_e, shape_e,
+                shape_e * opacity * effect.opacity / 100., effect.blend_mode
+            )
+
+    def _apply_inner_effects(self, layer, region, shape, shape_layer, alpha):
+        shape_layer = paste(region, self._viewport, shape_layer)
+        alpha = paste(region, self._viewport, alpha)
+        for name, draw in (
+            ('innerglow', draw_glow_effect),
+            ('innershadow', draw_shadow_effect),
+        ):
+            for effect in layer.effects.find(name):
+                color_e, shape_e = draw(region, shape, effect)
+                self._apply_effect(
+                    region, color_e, shape_layer * shape_e,
+                    alpha * shape_e * effect.opacity / 100., effect.blend_mode
+                )
+
+    def _apply_stroke_effect(self, layer, region, shape, size):
+        # Fills are anchored to the layer, independent of the viewport.
+        fill_box = _expand(layer.bbox, size)
         for effect in layer.effects.find('stroke'):
-            # Effect must happen at the layer viewport.
-            shape_in_bbox = paste(layer.bbox, self._viewport, shape)
-            color, shape_in_bbox = draw_stroke_effect(
-                layer.bbox, shape_in_bbox, effect.value, layer._psd
+            color_e, shape_e = draw_stroke_effect(
+                region, shape, effect.value, layer._psd, fill_box
             )
-            color = paste(self._viewport, layer.bbox, color)
-            shape = paste(self._viewport, layer.bbox, shape_in_bbox)
             opacity = effect.opacity / 100.
-            self._apply_source(
-                color, shape, shape * opacity, effect.blend_mode
+            self._apply_effect(
+                region, color_e, shape_e, shape_e * opacity,
+                effect.blend_mode
             )
 
 
@@ -513,6 +829,15 @@ def _intersect(a, b):
     return inter
 
 
+def _expand(bbox, margin):
+    if bbox == (0, 0, 0, 0):
+        return bbox
+    return (
+        bbox[0] - margin, bbox[1] - margin, bbox[2] + margin,
+        bbox[3] + margin
+    )
+
+
 def has_fill(layer):
     FILL_TAGS = (
         Tag.SOLID_COLOR_SHEET_SETTING,
@@ -528,6 +853,60 @@ def _union(backdrop, source):
     return backdrop + source - (backdrop * source)
 
 
+#: Number of rows quantized at once in :py:func:`quantize`.
+QUANTIZE_BAND_HEIGHT = 256
+
+# 8x8 Bayer matrix thresholds in [0, 1).
+_BAYER = np.array([
+    [0, 32, 8, 40, 2, 34, 10, 42],
+    [48, 16, 56, 24, 50, 18, 58, 26],
+    [12, 44, 4, 36, 14, 46, 6, 38],
+    [60, 28, 52, 20, 62, 30, 54, 22],
+    [3, 35, 11, 43, 1, 33, 9, 41],
+    [51, 19, 59, 27, 49, 17, 57, 25],
+    [15, 47, 7, 39, 13, 45, 5, 37],
+    [63, 31, 55, 23, 61, 29, 53, 21],
+], dtype=np.float32)[:, :, np.newaxis] / 64. + 1. / 128.
+
+
+def quantize(values, dtype, dither=False):
+    """
+    Quantize float values in [0.0, 1.0] to the integer dtype.
+
+    Values are clipped, scaled, and rounded band by band into the output.
+
+    :param values: (height, width, C) float array.
+    :param dtype: `np.uint8` or `np.uint16`.
+    :param dither: Apply ordered dithering for 8-bit output.
+    """
+    output = np.empty(values.shape, dtype=dtype)
+    for y in range(0, values.shape[0], QUANTIZE_BAND_HEIGHT):
+        band = slice(y, y + QUANTIZE_BAND_HEIGHT)
+        _quantize_band(values[band].copy(), output[band], y, dither)
+    return output
+
+
+def _quantize_band(values, output, y, dither):
+    """Clip, scale, and round the float band in place into output."""
+    scale = np.iinfo(output.dtype).max
+    np.clip(values, 0., 1., out=values)
+    values *= scale
+    if dither and scale == 255:
+        height, width = values.shape[:2]
+        offset = y % _BAYER.shape[0]
+        thresholds = np.tile(
+            _BAYER, (
+                (offset + height) // _BAYER.shape[0] + 1,
+                width // _BAYER.shape[1] + 1, 1
+            )
+        )
+        values += thresholds[offset:offset + height, :width]
+        np.minimum(values, scale, out=values)
+    else:
+        values += .5
+    output[...] = values
+
+
 def _clip(x):
     """Clip between [0, 1]."""
     return np.clip(x, 0., 1.)
@@ -0,0 +1,618 @@
+"""
+Adjustment layers as lookup tables.
+
+Tone adjustments such as curves and levels map each channel independently,
+so they are sampled once into 1-D lookup tables. Threshold and gradient map
+depend on the luminosity of the color instead, and are sampled as tables
+indexed by the luminosity. :py:class:`ToneLUT` keeps a per-channel table
+followed by an optional luminosity table, and consecutive adjustments fuse
+into a single :py:class:`ToneLUT` that maps the backdrop in one pass.
+
+Color adjustments such as hue/saturation and channel mixer mix the channels,
+and are sampled on a regular RGB grid into a 3-D lookup table evaluated with
+trilinear interpolation. :py:class:`ColorLUT` bakes adjacent color
+adjustments into one cube, keeping the tone adjustments before and after the
+cube as exact 1-D tables.
+
+Example::
+
+    from psd_tools.composite.adjustments import get_adjustment_lut
+
+    lut = get_adjustment_lut(layer, channels=3)
+    if lut is not None:
+        color = lut.apply(color)
+"""
+import logging
+import struct
+
+import numpy as np
+
+from psd_tools.composite import blend
+from psd_tools.composite.color import apply_lut, lab_to_rgb
+from psd_tools.constants import ColorMode
+
+logger = logging.getLogger(__name__)
+
+#: Number of entries of 1-D adjustment lookup tables.
+LUT_SIZE = 4096
+
+#: Luminosity weights of RGB channels for threshold and gradient map.
+LUMINOSITY = (0.299, 0.587, 0.114)
+
+#: Number of grid points per axis of 3-D adjustment lookup tables.
+CUBE_SIZE = 33
+
+#: Color modes that tone adjustments support.
+SUPPORTED_MODES = (ColorMode.RGB, ColorMode.GRAYSCALE, ColorMode.CMYK)
+
+
+class ToneLUT(object):
+    """
+    Fused 1-D lookup tables of tone adjustments.
+
+    The color is first mapped per channel by the `channel` table, then, if
+    given, the luminosity of the result indexes the `luminosity` table.
+
+    :param channel: (:py:data:`LUT_SIZE`, C) float32 table or `None`.
+    :param luminosity: (:py:data:`LUT_SIZE`, C) float32 table or `None`.
+    """
+    def __init__(self, channel=None, luminosity=None):
+        self.channel = channel
+        self.luminosity = luminosity
+
+    def then(self, other):
+        """
+        Fuse with the adjustment that follows.
+
+        :param other: :py:class:`ToneLUT` or :py:class:`ColorLUT` applied
+            after this one.
+        :return: :py:class:`ToneLUT` or :py:class:`ColorLUT`.
+        """
+        if isinstance(other, ColorLUT):
+            pre = self if other.pre is None else self.then(other.pre)
+            return ColorLUT(other.cube, pre, other.post)
+        if self.luminosity is not None:
+            # Everything after the luminosity table is a function of it.
+            return ToneLUT(
+                self.channel,
+                other.apply(self.luminosity[np.newaxis])[0],
+            )
+        channel = self.channel
+        if other.channel is not None:
+            channel = other.channel if channel is None else _lookup(
+                other.channel, channel
+            )
+        return ToneLUT(channel, other.luminosity)
+
+    def apply(self, color):
+        """
+        Map the color.
+
+        :param color: (height, width, C) float array in [0.0, 1.0].
+        :return: (height, width, C) float32 array.
+        """
+        color = np.asarray(color, dtype=np.float32)
+        if self.channel is not None:
+            color = _lookup(self.channel, color)
+        if self.luminosity is not None:
+            weights = _get_weights(color.shape[-1])
+            color = _lookup(
+                self.luminosity,
+                np.repeat(
+                    (color @ weights)[..., np.newaxis], color.shape[-1],
+                    axis=-1
+                )
+            )
+        return color
+
+
+class ColorLUT(object):
+    """
+    Fused 3-D lookup table of color adjustments.
+
+    The color is mapped by the optional `pre` tone table, the cube, and the
+    optional `post` tone table, in this order.
+
+    :param cube: (:py:data:`CUBE_SIZE`,) * 3 + (3,) float32 table.
+    :param pre: :py:class:`ToneLUT` or `None`.
+    :param post: :py:class:`ToneLUT` or `None`.
+    """
+    def __init__(self, cube, pre=None, post=None):
+        self.cube = cube
+        self.pre = pre
+        self.post = post
+
+    def then(self, other):
+        """
+        Fuse with the adjustment that follows.
+
+        :param other: :py:class:`ToneLUT` or :py:class:`ColorLUT` applied
+            after this one.
+        :return: :py:class:`ColorLUT`.
+        """
+        if isinstance(other, ToneLUT):
+            post = other if self.post is None else self.post.then(other)
+            return ColorLUT(self.cube, self.pre, post)
+        # Everything between the two cubes is baked into one.
+        values = self.cube.reshape(_get_grid().shape)
+        for lut in (self.post, other.pre):
+            if lut is not None:
+                values = lut.apply(values)
+        cube = apply_lut(values, other.cube).reshape(self.cube.shape)
+        return ColorLUT(cube, self.pre, other.post)
+
+    def apply(self, color):
+        """
+        Map the color.
+
+        :param color: (height, width, 3) float array in [0.0, 1.0].
+        :return: (height, width, 3) float32 array.
+        """
+        if self.pre is not None:
+            color = self.pre.apply(color)
+        # Interpolation weights may round off slightly above 1.
+        color = np.clip(apply_lut(color, self.cube), 0., 1.)
+        if self.post is not None:
+            color = self.post.apply(color)
+        return color
+
+
+def get_adjustment_lut(layer, channels):
+    """
+    Sample the adjustment of the layer.
+
+    :param layer: :py:class:`~psd_tools.api.layers.AdjustmentLayer`.
+    :param channels: Number of color channels of the composite.
+    :return: :py:class:`ToneLUT` or :py:class:`ColorLUT`, or `None` if the
+        layer is not a supported adjustment.
+    """
+    lut = get_tone_lut(layer, channels)
+    if lut is None:
+        lut = get_color_lut(layer, channels)
+    return lut
+
+
+def get_color_lut(layer, channels):
+    """
+    Sample the color adjustment of the layer on the RGB grid.
+
+    :param layer: :py:class:`~psd_tools.api.layers.AdjustmentLayer`.
+    :param channels: Number of color channels of the composite.
+    :return: :py:class:`ColorLUT`, or `None` if the layer is not a supported
+        color adjustment.
+    """
+    func = _COLOR_FUNCS.get(layer.kind)
+    if func is None or layer._psd.color_mode != ColorMode.RGB or (
+        channels != 3
+    ):
+        return None
+    cube = func(layer, _get_grid())
+    if cube is None:
+        return None
+    cube = np.clip(cube, 0., 1.).astype(np.float32)
+    return ColorLUT(cube.reshape((CUBE_SIZE, ) * 3 + (3, )))
+
+
+def get_tone_lut(layer, channels):
+    """
+    Sample the tone adjustment of the layer.
+
+    :param layer: :py:class:`~psd_tools.api.layers.AdjustmentLayer`.
+    :param channels: Number of color channels of the composite.
+    :return: :py:class:`ToneLUT`, or `None` if the layer is not a supported
+        tone adjustment.
+    """
+    color_mode = layer._psd.color_mode
+    func = _TONE_FUNCS.get(layer.kind)
+    if func is None or color_mode not in SUPPORTED_MODES:
+        return None
+    x = np.linspace(0., 1., LUT_SIZE)
+    if color_mode == ColorMode.CMYK:
+        # Composited CMYK is inverted, adjustments work on the ink amount.
+        lut = func(layer, 1. - x, channels)
+        for table in (lut.channel, lut.luminosity):
+            if table is not None:
+                table[:] = 1. - table
+        return lut
+    return func(layer, x, channels)
+
+
+def _get_grid():
+    """RGB grid points as a (size * size, size, 3) image."""
+    axis = np.linspace(0., 1., CUBE_SIZE, dtype=np.float32)
+    grid = np.stack(np.meshgrid(axis, axis, axis, indexing='ij'), axis=-1)
+    return grid.reshape((CUBE_SIZE * CUBE_SIZE, CUBE_SIZE, 3))
+
+
+def _lookup(table, values):
+    """Per-channel lookup of values in [0.0, 1.0] by the nearest entry."""
+    size, channels = table.shape
+    index = np.rint(np.clip(values, 0., 1.) * (size - 1)).astype(np.intp)
+    index += np.arange(channels) * size
+    return table.T.ravel()[index]
+
+
+def _get_weights(channels):
+    if channels == 3:
+        return np.array(LUMINOSITY, dtype=np.float32)
+    return np.full(channels, 1. / channels, dtype=np.float32)
+
+
+def _per_channel(values, channels):
+    values = np.asarray(values, dtype=np.float32)
+    if values.ndim == 1:
+        values = np.repeat(values[:, np.newaxis], channels, axis=1)
+    return np.ascontiguousarray(np.clip(values, 0., 1.))
+
+
+def _invert(layer, x, channels):
+    return ToneLUT(_per_channel(1. - x, channels))
+
+
+def _posterize(layer, x, channels):
+    levels = max(2, int(layer.posterize))
+    return ToneLUT(_per_channel(
+        np.minimum(np.floor(x * levels), levels - 1) / (levels - 1), channels
+    ))
+
+
+def _threshold(layer, x, channels):
+    level = int(layer.threshold) / 255.
+    return ToneLUT(luminosity=_per_channel(
+        (x >= level - 1e-6).astype(np.float32), channels
+    ))
+
+
+def _levels(layer, x, channels):
+    records = list(layer.data)
+    tables = []
+    for c in range(channels):
+        y = x
+        if channels > 1 and c + 1 < len(records):
+            y = _apply_level(records[c + 1], y)
+        tables.append(_apply_level(records[0], y))
+    return ToneLUT(_per_channel(np.stack(tables, axis=1), channels))
+
+
+def _apply_level(record, x):
+    low, high = record.input_floor / 255., record.input_ceiling / 255.
+    gamma = record.gamma / 100. if record.gamma else 1.
+    y = np.clip((x - low) / max(high - low, 1e-6), 0., 1.)
+    if gamma != 1.:
+        y = np.power(y, 1. / gamma)
+    return (
+        record.output_floor + y *
+        (record.output_ceiling - record.output_floor)
+    ) / 255.
+
+
+def _curves(layer, x, channels):
+    data = layer.data
+    if data.extra:
+        curves = [(item.channel_id, item.points) for item in data.extra]
+    elif data.version == 1:
+        ids = [i for i in range(32) if data.count_map & (1 << i)]
+        curves = list(zip(ids, data.data))
+    else:
+        curves = list(enumerate(data.data))
+    curves = dict(curves)
+
+    tables = []
+    for c in range(channels):
+        y = x
+        if channels > 1 and c + 1 in curves:
+            y = _apply_curve(curves[c + 1], y, data.is_map)
+        if 0 in curves:
+            y = _apply_curve(curves[0], y, data.is_map)
+        tables.append(y)
+    return ToneLUT(_per_channel(np.stack(tables, axis=1), channels))
+
+
+def _apply_curve(points, x, is_map):
+    if is_map:
+        return np.interp(x * 255., np.arange(256), points) / 255.
+    # Points are (output, input) pairs in [0, 255].
+    points = sorted((float(i), float(o)) for o, i in points)
+    X = np.array([p[0] for p in points]) / 255.
+    Y = np.array([p[1] for p in points]) / 255.
+    return np.clip(_natural_spline(X, Y, np.clip(x, X[0], X[-1])), 0., 1.)
+
+
+def _natural_spline(X, Y, x):
+    """Evaluate the natural cubic spline through the knots."""
+    n = len(X)
+    if n < 3:
+        return np.interp(x, X, Y)
+    h = np.diff(X)
+    A = np.zeros((n, n))
+    b = np.zeros(n)
+    A[0, 0] = A[-1, -1] = 1.
+    for i in range(1, n - 1):
+        A[i, i - 1:i + 2] = (h[i - 1], 2 * (h[i - 1] + h[i]), h[i])
+        b[i] = 6 * ((Y[i + 1] - Y[i]) / h[i] - (Y[i] - Y[i - 1]) / h[i - 1])
+    M = np.linalg.solve(A, b)
+    i = np.clip(np.searchsorted(X, x) - 1, 0, n - 2)
+    t0, t1 = x - X[i], X[i + 1] - x
+    return (
+        M[i] * t1**3 / (6 * h[i]) + M[i + 1] * t0**3 / (6 * h[i]) +
+        (Y[i] / h[i] - M[i] * h[i] / 6) * t1 +
+        (Y[i + 1] / h[i] - M[i + 1] * h[i] / 6) * t0
+    )
+
+
+def _exposure(layer, x, channels):
+    # Exposure works in linear light.
+    y = np.power(x, 2.2) * np.power(2., layer.exposure) + layer.offset
+    y = np.power(np.clip(y, 0., 1.), 1. / 2.2)
+    gamma = layer.gamma or 1.
+    return ToneLUT(_per_channel(np.power(y, 1. / gamma), channels))
+
+
+def _brightness_contrast(layer, x, channels):
+    brightness, contrast = layer.brightness, layer.contrast
+    if layer.use_legacy:
+        y = x + brightness / 255.
+        pivot = .5
+    else:
+        # Brightness bends the midtones, keeping black and white.
+        y = np.power(x, np.power(2., -brightness / 100.))
+        pivot = layer.mean / 255.
+    if contrast > 0:
+        slope = 1. / max(1. - contrast / 100., 1e-2)
+    else:
+        slope = 1. + contrast / 100.
+    y = (y - pivot) * slope + pivot
+    return ToneLUT(_per_channel(y, channels))
+
+
+def _gradient_map(layer, x, channels):
+    stops = sorted(layer.color_stops, key=lambda stop: stop.location)
+    X = np.array([stop.location / 4096. for stop in stops])
+    colors = np.array([stop.color[:3] for stop in stops]) / 65535.
+    if channels != 3:
+        colors = np.repeat(
+            (colors @ np.array(LUMINOSITY))[:, np.newaxis], channels, axis=1
+        )
+    if layer.reversed:
+        X = 1. - X[::-1]
+        colors = colors[::-1]
+    table = np.stack(
+        [np.interp(x, X, colors[:, c]) for c in range(channels)], axis=1
+    )
+    return ToneLUT(luminosity=_per_channel(table, channels))
+
+
+def _hue_saturation(layer, C):
+    if layer.enable_colorization:
+        hue, saturation, lightness = layer.colorization
+        H, S, L = _rgb_to_hsl(C)
+        C = _hsl_to_rgb(
+            np.full_like(L, (hue % 360) / 360.),
+            np.full_like(L, saturation / 100.), L
+        )
+        return _apply_lightness(C, lightness)
+
+    H, S, L = _rgb_to_hsl(C)
+    hue, saturation, lightness = (
+        np.full_like(H, value) for value in layer.master
+    )
+    degrees = H * 360.
+    for ranges, settings in layer.data:
+        weight = _hue_weight(degrees, ranges)
+        hue = hue + weight * settings[0]
+        saturation = saturation + weight * settings[1]
+        lightness = lightness + weight * settings[2]
+    H = np.mod(H + hue / 360., 1.)
+    S = np.clip(S * (1. + saturation / 100.), 0., 1.)
+    return _apply_lightness(_hsl_to_rgb(H, S, L), lightness)
+
+
+def _hue_weight(degrees, ranges):
+    """Weight of the hue range, ramps between the first and last two."""
+    start = ranges[0]
+    x = [(value - start) % 360 for value in ranges]
+    x[3] = max(x[3], x[2])
+    return np.interp(
+        np.mod(degrees - start, 360.), x, [0., 1., 1., 0.], right=0.
+    )
+
+
+def _apply_lightness(C, lightness):
+    lightness = np.asarray(lightness, dtype=np.float32) / 100.
+    if lightness.ndim:
+        lightness = lightness[..., np.newaxis]
+    return np.where(
+        lightness > 0, C + (1. - C) * lightness, C * (1. + lightness)
+    )
+
+
+def _channel_mixer(layer, C):
+    data = layer._data
+    # Rows beyond the first are kept in the trailing bytes.
+    size = len(data.unknown) // 2 * 2
+    values = list(data.data) + list(
+        struct.unpack('>%dh' % (size // 2), data.unknown[:size])
+    )
+    if len(values) < 15:
+        return None
+    rows = np.array(values[:15], dtype=np.float32).reshape((3, 5)) / 100.
+    if layer.monochrome:
+        rows = np.repeat(rows[:1], 3, axis=0)
+    return C @ rows[:, :3].T + rows[:, 4]
+
+
+def _selective_color(layer, C):
+    plates = np.array(layer.data[1:10], dtype=np.float32) / 100.
+    C_max = np.max(C, axis=2)
+    C_min = np.min(C, axis=2)
+    C_mid = np.sum(C, axis=2) - C_max - C_min
+    R, G, B = C[:, :, 0], C[:, :, 1], C[:, :, 2]
+    amounts = (
+        np.where(R == C_max, C_max - C_mid, 0.),  # Reds.
+        np.where(B == C_min, C_mid - C_min, 0.),  # Yellows.
+        np.where(G == C_max, C_max - C_mid, 0.),  # Greens.
+        np.where(R == C_min, C_mid - C_min, 0.),  # Cyans.
+        np.where(B == C_max, C_max - C_mid, 0.),  # Blues.
+        np.where(G == C_min, C_mid - C_min, 0.),  # Magentas.
+        np.maximum(C_min - .5, 0.) * 2.,  # Whites.
+        np.clip(1. - np.abs(C_max - .5) - np.abs(C_min - .5), 0., 1.),
+        np.maximum(.5 - C_max, 0.) * 2.,  # Blacks.
+    )
+    ink = 1. - C
+    # Relative method scales by the amount of ink present.
+    scale = ink if layer.method == 0 else 1.
+    delta = np.zeros_like(C)
+    for amount, plate in zip(amounts, plates):
+        delta += amount[:, :, np.newaxis] * (plate[:3] + plate[3])
+    return 1. - np.clip(ink + delta * scale, 0., 1.)
+
+
+def _photo_filter(layer, C):
+    color = _get_filter_color(layer)
+    if color is None:
+        logger.debug('Unsupported photo filter color: %s' % layer)
+        return None
+    density = layer.density / 100.
+    result = C * (1. - density + density * color)
+    if layer.luminosity:
+        result = blend.luminosity(result, C)
+    return result
+
+
+def _get_filter_color(layer):
+    components = layer.color_components
+    if layer.color_space == 0:
+        return np.array(components[:3], dtype=np.float32) / 65535.
+    if layer.color_space == 7:
+        L, a, b = struct.unpack('>Hhh', struct.pack('>3H', *components[:3]))
+        lab = np.array([[[L / 10000., (a / 100. + 128.) / 255.,
+                          (b / 100. + 128.) / 255.]]])
+        return lab_to_rgb(np.clip(lab, 0., 1.))[0, 0]
+    if layer.color_space == 8:
+        return np.full(3, components[0] / 10000., dtype=np.float32)
+    return None
+
+
+def _black_and_white(layer, C):
+    weights = np.array([
+        layer.red, layer.yellow, layer.green, layer.cyan, layer.blue,
+        layer.magenta
+    ], dtype=np.float32) / 100.
+    order = np.sort(C, axis=2)
+    C_min, C_mid, C_max = order[:, :, 0], order[:, :, 1], order[:, :, 2]
+    # Primaries are at even, secondaries between them at odd indices.
+    primary = np.argmax(C, axis=2) * 2
+    secondary = (np.argmin(C, axis=2) * 2 + 3) % 6
+    gray = (
+        C_min + (C_max - C_mid) * weights[primary] +
+        (C_mid - C_min) * weights[secondary]
+    )
+    result = np.repeat(gray[:, :, np.newaxis], 3, axis=2)
+    if layer.use_tint and layer.tint_color:
+        tint = np.array([
+            layer.tint_color.get(key, 0.) for key in (b'Rd  ', b'Grn ', b'Bl  ')
+        ], dtype=np.float32) / 255.
+        result = blend.color(
+            np.clip(result, 0., 1.), np.broadcast_to(tint, C.shape).copy()
+        )
+    return result
+
+
+def _color_balance(layer, C):
+    H, S, L = _rgb_to_hsl(C)
+    L = L[:, :, np.newaxis]
+    a, b, scale = .25, .333, .7
+    shadows = np.clip((L - b) / -a + .5, 0., 1.) * scale
+    midtones = np.clip((L - b) / a + .5, 0., 1.) * np.clip(
+        (L + b - 1.) / -a + .5, 0., 1.
+    ) * scale
+    highlights = np.clip((L + b - 1.) / a + .5, 0., 1.) * scale
+    result = C + (
+        shadows * np.array(layer.shadows) +
+        midtones * np.array(layer.midtones) +
+        highlights * np.array(layer.highlights)
+    ) / 100.
+    result = np.clip(result, 0., 1.)
+    if layer.luminosity:
+        result = blend.luminosity(result, C)
+    return result
+
+
+def _color_lookup(layer, C):
+    data = layer._data
+    lut_format = str(data.get(b'LUTFormat', ''))
+    raw = data.get(b'LUT3DFileData')
+    if raw is None or 'CUBE' not in lut_format.upper():
+        logger.debug('Unsupported color lookup: %s' % layer)
+        return None
+    try:
+        cube = _parse_cube(bytes(getattr(raw, 'value', raw)))
+    except ValueError as e:
+        logger.warning('Invalid color lookup %s: %s' % (layer, e))
+        return None
+    return apply_lut(C, cube)
+
+
+def _parse_cube(data):
+    """Parse the 3-D table of a .cube file, indexed by (r, g, b)."""
+    size, values = None, []
+    for line in data.decode('ascii', 'ignore').splitlines():
+        items = line.split()
+        if not items or line.startswith('#'):
+            continue
+        if items[0] == 'LUT_3D_SIZE' and len(items) == 2:
+            size = int(items[1])
+        elif items[0][0] in '+-.0123456789' and len(items) == 3:
+            values.append([float(x) for x in items])
+    if size is None or size < 2 or len(values) != size**3:
+        raise ValueError('Invalid 3D LUT of %d entries' % len(values))
+    # Red changes fastest in the file.
+    cube = np.array(values, dtype=np.float32).reshape((size, ) * 3 + (3, ))
+    return np.ascontiguousarray(cube.transpose((2, 1, 0, 3)))
+
+
+def _rgb_to_hsl(C):
+    C_max = np.max(C, axis=-1)
+    C_min = np.min(C, axis=-1)
+    L = (C_max + C_min) / 2.
+    d = C_max - C_min
+    S = np.where(
+        d > 0, d / np.maximum(1. - np.abs(2. * L - 1.), 1e-6), 0.
+    )
+    R, G, B = C[..., 0], C[..., 1], C[..., 2]
+    d = np.maximum(d, 1e-6)
+    H = np.where(
+        C_max == R, np.mod((G - B) / d, 6.),
+        np.where(C_max == G, (B - R) / d + 2., (R - G) / d + 4.)
+    ) / 6.
+    return H, np.clip(S, 0., 1.), L
+
+
+def _hsl_to_rgb(H, S, L):
+    chroma = (1. - np.abs(2. * L - 1.)) * S
+    k = np.mod(np.stack([H * 12., H * 12. + 8., H * 12. + 4.], axis=-1), 12.)
+    return L[..., np.newaxis] - (chroma / 2.)[..., np.newaxis] * np.clip(
+        np.minimum(k - 3., 9. - k), -1., 1.
+    )
+
+
+_TONE_FUNCS = {
+    'brightnesscontrast': _brightness_contrast,
+    'curves': _curves,
+    'exposure': _exposure,
+    'gradientmap': _gradient_map,
+    'invert': _invert,
+    'levels': _levels,
+    'posterize': _posterize,
+    'threshold': _threshold,
+}
+
+_COLOR_FUNCS = {
+    'blackandwhite': _black_and_white,
+    'channelmixer': _channel_mixer,
+    'colorbalance': _color_balance,
+    'colorlookup': _color_lookup,
+    'huesaturation': _hue_saturation,
+    'photofilter': _photo_filter,
+    'selectivecolor': _selective_color,
+}
@@ -0,0 +1,211 @@
+"""
+Composite cache.
+
+:py:class:`CompositeCache` memoizes group composites and rendered layer
+sources across :py:func:`~psd_tools.composite.composite` calls, so unchanged
+groups shared across renders of different variants are not recomposited and
+fills and vector masks are rendered once. Decoded layer pixels and masks are
+shared through :py:data:`psd_tools.api.numpy_io.decoded_cache` instead.
+"""
+import contextlib
+import hashlib
+import logging
+import threading
+
+from psd_tools.api.layers import AdjustmentLayer
+from psd_tools.constants import Tag
+from psd_tools.utils import LRUCache
+
+logger = logging.getLogger(__name__)
+
+#: Tagged blocks of effects, fills, and vector data, which may be edited in
+#: place and are included in the layer state as a digest.
+DIGEST_KEYS = (
+    Tag.OBJECT_BASED_EFFECTS_LAYER_INFO,
+    Tag.OBJECT_BASED_EFFECTS_LAYER_INFO_V0,
+    Tag.OBJECT_BASED_EFFECTS_LAYER_INFO_V1,
+    Tag.EFFECTS_LAYER,
+    Tag.SOLID_COLOR_SHEET_SETTING,
+    Tag.GRADIENT_FILL_SETTING,
+    Tag.PATTERN_FILL_SETTING,
+    Tag.VECTOR_MASK_SETTING1,
+    Tag.VECTOR_MASK_SETTING2,
+    Tag.VECTOR_STROKE_DATA,
+    Tag.VECTOR_STROKE_CONTENT_DATA,
+    Tag.VECTOR_ORIGINATION_DATA,
+)
+
+
+class CompositeCache(object):
+    """
+    Memoization of composited groups with LRU and memory-budget eviction.
+
+    A group result is keyed by the rendering state of the group and its
+    descendants (records, channel data identity, digests of effects, fills,
+    vector masks and adjustments, and layer_filter outcome), the viewport,
+    and for non-isolated groups, the backdrop pixels.
+
+    Rendered layer sources, such as fills and vector masks, are keyed by the
+    rendering state of the layer and shared among the same budget.
+
+    Example::
+
+        from psd_tools.composite import composite, CompositeCache
+
+        cache = CompositeCache(max_bytes=512 * 1024 * 1024)
+        for layer_filter in variants:
+            color, shape, alpha = composite(
+                psd, layer_filter=layer_filter, cache=cache)
+
+    :param max_bytes: memory budget in bytes for the cached buffers.
+    """
+    def __init__(self, max_bytes=256 * 1024 * 1024):
+        self._items = LRUCache(max_bytes)
+        self._local = threading.local()
+
+    @property
+    def stats(self):
+        """
+        Cache statistics.
+
+        :return: `dict` of hits, misses, evictions, items, and nbytes.
+        """
+        return self._items.stats
+
+    def clear(self):
+        """Drop all the cached results."""
+        self._items.clear()
+
+    @contextlib.contextmanager
+    def render(self):
+        """
+        Memoize layer states for the duration of a render.
+
+        Nested renders share the memo of the outermost one. Layers must not
+        be edited during the render.
+        """
+        if getattr(self._local, 'states', None) is not None:
+            yield
+            return
+        self._local.states = {}
+        try:
+            yield
+        finally:
+            self._local.states = None
+
+    def get_group(self, key):
+        """Returns a copy of the cached (color, shape, alpha) or `None`."""
+        value = self._items.get(key)
+        if value is None:
+            return None
+        return tuple(x.copy() for x in value)
+
+    def put_group(self, key, value):
+        """Stores a copy of (color, shape, alpha)."""
+        self._items.put(key, tuple(x.copy() for x in value))
+
+    def get_source(self, kind, layer, force, func):
+        """
+        Returns the memoized tuple of rendered arrays for the layer.
+
+        The returned arrays are shared; callers must not modify them.
+
+        :param kind: Kind of the source, such as 'fill' or 'vector_mask'.
+        :param func: Callable that renders the source tuple on a miss.
+        """
+        key = ('source', kind, bool(force), id(layer), layer.bbox
+               ) + self._get_state(layer)
+        value = self._items.get(key)
+        if value is None:
+            value = func()
+            self._items.put(key, value)
+        return value
+
+    def group_key(
+        self, layer, viewport, layer_filter, force, backdrop=None
+    ):
+        """
+        Returns a key for the group composite.
+
+        :param backdrop: (color, alpha) arrays when the result depends on the
+            backdrop, or `None`.
+        """
+        if backdrop is not None:
+            digest = hashlib.blake2b(digest_size=16)
+            for values in backdrop:
+                digest.update(values.tobytes())
+            backdrop = digest.digest()
+        return (
+            'group',
+            viewport,
+            bool(force),
+            backdrop,
+            self._get_tree_key(layer, layer_filter),
+        )
+
+    def _get_state(self, layer):
+        states = getattr(self._local, 'states', None)
+        if states is None:
+            return get_state(layer)
+        key = ('state', id(layer))
+        if key not in states:
+            states[key] = get_state(layer)
+        return states[key]
+
+    def _get_tree_key(self, layer, layer_filter):
+        """Key of the layer, its children, and clip layers."""
+        states = getattr(self._local, 'states', None)
+        memo_key = ('tree', id(layer), layer_filter)
+        if states is not None and memo_key in states:
+            return states[memo_key]
+        key = (id(layer), layer_filter(layer), layer.bbox
+               ) + self._get_state(layer) + (
+                   tuple(
+                       self._get_tree_key(child, layer_filter)
+                       for child in (layer if layer.is_group() else ())
+                   ),
+                   tuple(
+                       self._get_tree_key(clip_layer, layer_filter)
+                       for clip_layer in layer.clip_layers
+                   ),
+               )
+        if states is not None:
+            states[memo_key] = key
+        return key
+
+
+def get_state(layer):
+    """
+    Snapshot of the layer properties that affect rendering.
+
+    Channel data are included as the `bytes` objects, so replacing channel
+    data via :py:meth:`~psd_tools.api.layers.Layer.set_channel_numpy`
+    changes the state. Effects, fills, vector data, and adjustment
+    parameters are included as the digest of their tagged blocks, as they
+    may be edited in place.
+    """
+    record = layer._record
+    mask = layer.mask if layer.has_mask() else None
+    keys = DIGEST_KEYS
+    if isinstance(layer, AdjustmentLayer):
+        keys += (layer._KEY, )
+    return (
+        record.flags.visible,
+        record.opacity,
+        layer.blend_mode,
+        record.clipping,
+        layer.tagged_blocks.get_data(Tag.BLEND_FILL_OPACITY, 255),
+        mask.disabled if mask else None,
+        mask.bbox if mask else None,
+        _get_digest(layer, keys),
+    ) + tuple(channel.data for channel in layer._channels)
+
+
+def _get_digest(layer, keys):
+    """Digest of the tagged blocks of the given keys."""
+    digest = hashlib.blake2b(digest_size=16)
+    for key in keys:
+        block = layer.tagged_blocks.get(key)
+        if block is not None:
+            digest.update(block.tobytes())
+    return digest.digest()
@@ -0,0 +1,206 @@
+"""
+Color conversion of composited arrays.
+
+:py:func:`convert_to_rgb` converts the float (height, width, C) color of
+:py:func:`~psd_tools.composite.composite` results to sRGB without going
+through 8-bit PIL images. With an ICC profile, the LCMS transform is sampled
+once into a lookup table and interpolated, so the result keeps the float
+precision of the input.
+"""
+import hashlib
+import itertools
+import logging
+
+import numpy as np
+
+from psd_tools.api.pil_io import get_icc_transform
+from psd_tools.constants import ColorMode
+from psd_tools.utils import LRUCache
+
+logger = logging.getLogger(__name__)
+
+#: Cache of ICC lookup tables sampled from LCMS transforms.
+icc_lut_cache = LRUCache(max_bytes=64 * 1024 * 1024)
+
+#: Grid size of ICC lookup tables per number of input channels. The size
+#: minus one divides 255, so that grid nodes fall on exact 8-bit values.
+LUT_SIZE = {1: 256, 3: 52, 4: 18}
+
+# Lab D50 white point and XYZ D50 to linear sRGB (Bradford adapted).
+_D50 = np.array([0.96422, 1.0, 0.82521], dtype=np.float32)
+_XYZ_TO_SRGB = np.array([
+    [3.1338561, -1.6168667, -0.4906146],
+    [-0.9787684, 1.9161415, 0.0334540],
+    [0.0719453, -0.2289914, 1.4052427],
+], dtype=np.float32)
+
+_GAMMA_LUT_SIZE = 4096
+
+
+def _make_gamma_lut():
+    x = np.linspace(0., 1., _GAMMA_LUT_SIZE, dtype=np.float64)
+    return np.where(
+        x <= 0.0031308, 12.92 * x, 1.055 * np.power(x, 1. / 2.4) - 0.055
+    ).astype(np.float32)
+
+
+_GAMMA_LUT = _make_gamma_lut()
+
+
+def convert_to_rgb(color, color_mode, icc_profile=None, tile_height=256):
+    """
+    Convert composited color to sRGB.
+
+    Example::
+
+        from psd_tools.composite import composite
+        from psd_tools.composite.color import convert_to_rgb
+
+        color, shape, alpha = composite(psd)
+        rgb = convert_to_rgb(color, psd.color_mode, icc_profile)
+
+    :param color: (height, width, C) :py:class:`numpy.ndarray` of float in
+        [0.0, 1.0] or uint8, in the document color mode as composited.
+    :param color_mode: :py:class:`~psd_tools.constants.ColorMode`.
+    :param icc_profile: Optional ICC profile `bytes` of the document. Lab
+        color is device-independent and always converted analytically.
+    :param tile_height: Number of rows to convert at once.
+    :return: (height, width, 3) :py:class:`numpy.ndarray` of the same dtype.
+    """
+    is_uint8 = color.dtype == np.uint8
+    if is_uint8:
+        color = color.astype(np.float32) / 255.
+
+    if color_mode == ColorMode.LAB:
+        result = _convert_tiles(color, lab_to_rgb, tile_height)
+    elif icc_profile and color_mode in _ICC_MODES:
+        lut = get_icc_lut(icc_profile, color_mode)
+        result = _convert_tiles(
+            color, lambda x: apply_lut(x, lut), tile_height
+        )
+    elif color_mode == ColorMode.CMYK:
+        result = _convert_tiles(color, cmyk_to_rgb, tile_height)
+    elif color.shape[2] == 1:
+        result = gray_to_rgb(color)
+    else:
+        result = color[:, :, :3].astype(np.float32)
+
+    if is_uint8:
+        return (np.clip(result, 0., 1.) * 255. + .5).astype(np.uint8)
+    return result
+
+
+def cmyk_to_rgb(color):
+    """
+    Naive CMYK to RGB conversion.
+
+    Composited CMYK values are inverted, i.e., 1.0 is no ink, so each RGB
+    component is the product of the inverted ink and inverted black.
+    """
+    return color[:, :, :3] * color[:, :, 3:4]
+
+
+def gray_to_rgb(color):
+    """Gray to RGB conversion."""
+    return np.repeat(color[:, :, :1].astype(np.float32), 3, axis=2)
+
+
+def lab_to_rgb(color):
+    """
+    Lab (D50) to sRGB conversion.
+
+    Composited Lab values map L to [0, 100] and a, b to [-128, 127].
+    """
+    L = color[:, :, 0] * 100.
+    fy = (L + 16.) / 116.
+    fx = fy + (color[:, :, 1] * 255. - 128.) / 500.
+    fz = fy - (color[:, :, 2] * 255. - 128.) / 200.
+    xyz = np.stack([fx, fy, fz], axis=2)
+    cube = xyz ** 3
+    xyz = np.where(cube > 0.008856, cube, (xyz - 16. / 116.) / 7.787)
+    xyz *= _D50
+    linear = xyz @ _XYZ_TO_SRGB.T
+    np.clip(linear, 0., 1., out=linear)
+    index = (linear * (_GAMMA_LUT_SIZE - 1) + .5).astype(np.intp)
+    return _GAMMA_LUT[index]
+
+
+_ICC_MODES = {
+    ColorMode.GRAYSCALE: ('L', 1),
+    ColorMode.RGB: ('RGB', 3),
+    ColorMode.CMYK: ('CMYK', 4),
+}
+
+
+def get_icc_lut(icc_profile, color_mode):
+    """
+    Get a lookup table of the ICC transform to sRGB.
+
+    The cached LCMS transform is evaluated on a regular grid of the input
+    color space. The table is cached by the profile digest and color mode.
+
+    :return: :py:class:`numpy.ndarray` of (size,) * C + (3,) shape.
+    """
+    from PIL import Image, ImageCms
+
+    pil_mode, channels = _ICC_MODES[color_mode]
+    size = LUT_SIZE[channels]
+    key = (
+        hashlib.blake2b(icc_profile, digest_size=16).digest(), pil_mode, size
+    )
+    lut = icc_lut_cache.get(key)
+    if lut is not None:
+        return lut
+
+    logger.debug('Sampling ICC transform: %s, %d grid' % (pil_mode, size))
+    assert 255 % (size - 1) == 0, 'Grid nodes must be 8-bit values'
+    axis = np.arange(0, 256, 255 // (size - 1), dtype=np.uint8)
+    grid = np.stack(
+        np.meshgrid(*([axis] * channels), indexing='ij'), axis=-1
+    ).reshape((1, -1, channels))
+    if color_mode == ColorMode.CMYK:
+        grid = 255 - grid  # Composited CMYK is inverted.
+    grid = np.ascontiguousarray(grid)
+    image = Image.frombuffer(
+        pil_mode, (grid.shape[1], 1), grid, 'raw', pil_mode, 0, 1
+    )
+    transform = get_icc_transform(icc_profile, pil_mode, 'RGB')
+    output = np.asarray(ImageCms.applyTransform(image, transform))
+    lut = (output.astype(np.float32) / 255.).reshape(
+        (size, ) * channels + (3, )
+    )
+    icc_lut_cache.put(key, lut)
+    return lut
+
+
+def apply_lut(color, lut):
+    """
+    Apply an N-dimensional lookup table with multilinear interpolation.
+
+    :param color: (height, width, C) float array in [0.0, 1.0].
+    :param lut: (size,) * C + (K,) table.
+    :return: (height, width, K) float32 array.
+    """
+    channels = lut.ndim - 1
+    size = lut.shape[0]
+    position = np.clip(color[:, :, :channels], 0., 1.) * (size - 1)
+    index = np.minimum(position.astype(np.intp), size - 2)
+    fraction = (position - index).astype(np.float32)
+
+    result = np.zeros(color.shape[:2] + lut.shape[-1:], dtype=np.float32)
+    for corner in itertools.product((0, 1), repeat=channels):
+        weight = np.ones(color.shape[:2], dtype=np.float32)
+        for c, bit in enumerate(corner):
+            weight *= fraction[:, :, c] if bit else 1. - fraction[:, :, c]
+        values = lut[tuple(index[:, :, c] + bit
+                           for c, bit in enumerate(corner))]
+        result += weight[:, :, np.newaxis] * values
+    return result
+
+
+def _convert_tiles(color, func, tile_height):
+    height, width = color.shape[:2]
+    result = np.empty((height, width, 3), dtype=np.float32)
+    for y in range(0, height, tile_height):
+        result[y:y + tile_height] = func(color[y:y + tile_height])
+    return result
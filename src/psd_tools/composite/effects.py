@@ -1,30 +1,46 @@
 import numpy as np
-from skimage import filters
-from skimage.morphology import disk
+from scipy import ndimage
 import logging
 
+from psd_tools.api.effects import InnerGlow, InnerShadow
 from psd_tools.terminology import Enum, Key
 from .vector import (
-    draw_solid_color_fill, draw_pattern_fill, draw_gradient_fill
+    GRADIENT_LUT_SIZE, draw_solid_color_fill, draw_pattern_fill,
+    draw_gradient_fill, _get_gradient_lut
 )
-import psd_tools.composite
 
 logger = logging.getLogger(__name__)
 
 
-def draw_stroke_effect(viewport, shape, desc, psd):
+def draw_stroke_effect(viewport, shape, desc, psd, fill_box=None):
+    """
+    Draw a stroke effect.
+
+    :param viewport: Region of the shape.
+    :param shape: (height, width, 1) shape of the layer within the viewport.
+    :param desc: Descriptor of the stroke effect.
+    :param psd: :py:class:`~psd_tools.api.psd_image.PSDImage`.
+    :param fill_box: Region containing the viewport that gradient and
+        pattern fills are anchored to, so that the fill does not depend on
+        the viewport. Defaults to the viewport.
+    :return: (color, mask) tuple.
+    """
     logger.debug('Stroke effect has limited support')
     height, width = viewport[3] - viewport[1], viewport[2] - viewport[0]
     if not isinstance(shape, np.ndarray):
         shape = np.full((height, width, 1), shape, dtype=np.float32)
+    if fill_box is None:
+        fill_box = viewport
 
     paint = desc.get(Key.PaintType).enum
     if paint == Enum.SolidColor:
         color, _ = draw_solid_color_fill(viewport, desc)
     elif paint == Enum.Pattern:
-        color, _ = draw_pattern_fill(viewport, psd, desc)
+        color, _ = draw_pattern_fill(fill_box, psd, desc)
+        color = _crop(color, fill_box, viewport)
     elif paint == Enum.GradientFill:
-        color, _ = draw_gradient_fill(viewport, desc)
+        color, _ = draw_gradient_fill(fill_box, desc)
+        color = _crop(color, fill_box, viewport)
     else:
         logger.warning('No fill specification found.')
         color = np.ones((height, width, 1))
@@ -34,22 +50,227 @@ def draw_stroke_effect(viewport, shape, desc, psd):
 
     style = desc.get(Key.Style).enum
     size = float(desc.get(Key.SizeKey, 1.0))
-    if style in (Enum.OutsetFrame, Enum.InsetFrame):
-        size *= 2
-
-    edges = filters.scharr(shape[:, :, 0])
-    pen = disk(int(size / 2. - 1))
-    mask = filters.rank.maximum((255 * edges).astype(np.uint8),
-                                pen).astype(np.float32) / 255.
-    mask = psd_tools.composite._divide(
-        mask - np.min(mask),
-        np.max(mask) - np.min(mask)
-    )
-    mask = np.expand_dims(mask, 2)
-
+    distance = _signed_distance(shape[:, :, 0])
     if style == Enum.OutsetFrame:
-        mask = np.maximum(0, mask - shape)
+        mask = np.maximum(0, _coverage(size - distance) - shape[:, :, 0])
     elif style == Enum.InsetFrame:
-        mask = np.maximum(0, mask * shape)
+        mask = np.minimum(shape[:, :, 0], _coverage(size + distance))
+    else:
+        mask = _coverage(size / 2. - np.abs(distance))
+
+    return color, mask[:, :, np.newaxis].astype(np.float32)
+
+
+def _crop(values, bbox, viewport):
+    """Slice the viewport out of values drawn over the bbox."""
+    left, top = viewport[0] - bbox[0], viewport[1] - bbox[1]
+    return values[
+        top:top + viewport[3] - viewport[1],
+        left:left + viewport[2] - viewport[0]
+    ]
+
+
+def get_stroke_effect_size(layer):
+    """
+    Reach in pixels of the stroke effects of the layer from its shape edge.
+    """
+    size = 0
+    for effect in layer.effects.find('stroke'):
+        width = float(effect.value.get(Key.SizeKey, 1.0))
+        if effect.value.get(Key.Style).enum == Enum.CenteredFrame:
+            width /= 2.
+        size = max(size, int(np.ceil(width)) + 1)
+    return size
+
+
+def draw_shadow_effect(viewport, shape, effect):
+    """
+    Draw a drop shadow or an inner shadow.
+
+    The shadow is the layer shape, or its inverse for inner shadows, offset
+    along the light angle, spread by a distance transform and blurred.
+
+    :param viewport: Region of the shape.
+    :param shape: (height, width, 1) shape of the layer within the viewport.
+    :param effect: :py:class:`~psd_tools.api.effects.DropShadow` or
+        :py:class:`~psd_tools.api.effects.InnerShadow`.
+    :return: (color, mask) tuple. Inner shadows are not clipped by the shape.
+    """
+    inner = isinstance(effect, InnerShadow)
+    background = 1. if inner else 0.
+    source = 1. - shape[:, :, 0] if inner else shape[:, :, 0]
+
+    angle = np.radians(float(effect.angle))
+    distance = float(effect.distance)
+    offset = (distance * np.sin(angle), -distance * np.cos(angle))
+    if offset != (0., 0.):
+        source = ndimage.shift(
+            source, offset, order=1, mode='constant', cval=background
+        )
+
+    mask = _blur_matte(
+        source, float(effect.size), float(effect.choke), background
+    )
+    mask = _apply_contour(mask, effect.contour)
+    color, _ = draw_solid_color_fill(viewport, effect.value)
+    return color, mask[:, :, np.newaxis].astype(np.float32)
+
+
+def draw_glow_effect(viewport, shape, effect):
+    """
+    Draw an outer glow or an inner glow.
+
+    Softer glows blur the spread shape, precise glows fall off linearly with
+    the distance to the spread shape. Inner glows start from the edge or the
+    center of the shape.
+
+    :param viewport: Region of the shape.
+    :param shape: (height, width, 1) shape of the layer within the viewport.
+    :param effect: :py:class:`~psd_tools.api.effects.OuterGlow` or
+        :py:class:`~psd_tools.api.effects.InnerGlow`.
+    :return: (color, mask) tuple. Inner glows are not clipped by the shape.
+    """
+    inner = isinstance(effect, InnerGlow)
+    background = 1. if inner else 0.
+    source = 1. - shape[:, :, 0] if inner else shape[:, :, 0]
+
+    size, choke = float(effect.size), float(effect.choke)
+    if effect.glow_type == Enum.PreciseMatte:
+        spread = size * choke / 100.
+        mask = np.clip(
+            1. - (_signed_distance(source) - spread) /
+            max(1., size - spread), 0., 1.
+        )
+    else:
+        mask = _blur_matte(source, size, choke, background)
+    if inner and effect.glow_source == Enum.CenterGlow:
+        mask = 1. - mask
+    mask = _apply_contour(mask, effect.contour)
+
+    if Key.Color in effect.value:
+        color, _ = draw_solid_color_fill(viewport, effect.value)
+    else:
+        # Gradient runs from the shape edge outward.
+        G, Ga = _get_gradient_lut(effect.gradient)
+        index = np.rint((1. - mask) * (GRADIENT_LUT_SIZE - 1)).astype(np.intp)
+        color = G[index]
+        if Ga is not None:
+            mask = mask * Ga[index]
+    return color, mask[:, :, np.newaxis].astype(np.float32)
+
+
+def get_blur_effect_size(layer):
+    """
+    Reach in pixels of the shadow and glow effects of the layer from its
+    shape edge.
+    """
+    size = 0
+    for name in ('dropshadow', 'innershadow', 'outerglow', 'innerglow'):
+        for effect in layer.effects.find(name):
+            reach = float(effect.size) + float(
+                getattr(effect, 'distance', 0.)
+            )
+            size = max(size, int(np.ceil(reach)) + 1)
+    return size
+
+
+def get_effect_margin(layer):
+    """
+    Reach in pixels of vector strokes, stroke effects, shadows and glows
+    that may extend the layer bbox.
+    """
+    width = 0
+    if layer.has_stroke() and layer.stroke.enabled:
+        width = max(width, float(layer.stroke.line_width))
+    for effect in layer.effects.find('stroke'):
+        width = max(width, float(effect.value.get(Key.SizeKey, 1.0)))
+    return max(int(np.ceil(width)) + 1, get_blur_effect_size(layer))
+
+
+def _blur_matte(source, size, choke, background=0.):
+    """
+    Spread the matte by the choke percentage of the size, then blur it by
+    the rest of the size.
+    """
+    spread = size * choke / 100.
+    if spread > 0:
+        source = _coverage(spread - _signed_distance(source))
+    return _gaussian_blur(source, (size - spread) / 2., background)
+
+
+def _gaussian_blur(values, sigma, background=0.):
+    """
+    Approximate Gaussian blur by three box blurs per axis.
+
+    Box blurs use running sums, so the cost does not depend on `sigma`.
+    Values outside of the array are `background`.
+    """
+    values = np.asarray(values, dtype=np.float32)
+    if sigma <= 0:
+        return values
+    for size in _box_sizes(sigma):
+        for axis in (0, 1):
+            values = ndimage.uniform_filter1d(
+                values, size, axis=axis, mode='constant', cval=background
+            )
+    return values
+
+
+def _box_sizes(sigma, n=3):
+    """
+    Odd widths of `n` box filters whose convolution has the variance of the
+    Gaussian.
+    """
+    ideal = np.sqrt(12. * sigma * sigma / n + 1.)
+    lower = int(np.floor(ideal))
+    if lower % 2 == 0:
+        lower -= 1
+    upper = lower + 2
+    count = int(round(
+        (12. * sigma * sigma - n * lower * lower - 4. * n * lower - 3. * n) /
+        (-4. * lower - 4.)
+    ))
+    return [lower if i < count else upper for i in range(n)]
+
+
+def _apply_contour(mask, contour):
+    """Map the mask by the contour curve, piecewise linearly."""
+    if not contour or Key.Curve not in contour:
+        return mask
+    points = sorted(
+        (float(x.get(Key.Horizontal)), float(x.get(Key.Vertical)))
+        for x in contour.get(Key.Curve)
+    )
+    if points == [(0., 0.), (255., 255.)]:
+        return mask
+    X, Y = zip(*points)
+    return np.interp(mask * 255., X, Y).astype(np.float32) / 255.
+
+
+def _signed_distance(shape):
+    """
+    Approximate signed distance to the edge of the shape, in pixels.
+
+    Distances are positive outside of the shape. Exact Euclidean distance
+    transforms give the distance between pixel centers, and partially covered
+    pixels refine the edge position by their coverage.
+    """
+    inside = shape >= .5
+    if np.all(inside):
+        outside = np.full(shape.shape, -np.inf)
+    elif not np.any(inside):
+        outside = np.full(shape.shape, np.inf)
+    else:
+        outside = np.where(
+            inside,
+            .5 - ndimage.distance_transform_edt(inside),
+            ndimage.distance_transform_edt(~inside) - .5,
+        )
+    edge = (shape > 0.) & (shape < 1.)
+    outside[edge] = .5 - shape[edge]
+    return outside
+
 
-    return color, mask
+def _coverage(distance):
+    """Antialiased coverage of the pixels within the distance."""
+    return np.clip(distance + .5, 0., 1.)
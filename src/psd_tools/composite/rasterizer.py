@@ -0,0 +1,293 @@
+"""
+Anti-aliased scanline rasterizer for vector paths.
+
+Curves are flattened to polylines, and each line segment accumulates its
+signed area into the pixel cells it crosses, in the manner of font
+rasterizers. The running sum along each scanline then gives the winding
+coverage of every pixel, which the fill rule maps to the mask value.
+
+Example::
+
+    from psd_tools.composite.rasterizer import fill, flatten_curves
+
+    polyline = flatten_curves(curves)
+    coverage = fill([polyline], width, height, rule='evenodd')
+"""
+import logging
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+#: Maximum distance in pixels between a curve and its flattened polyline.
+FLATNESS = 0.1
+
+#: Maximum number of line segments per Bezier curve.
+MAX_SEGMENTS = 1024
+
+#: Supported fill rules.
+FILL_RULES = ('nonzero', 'evenodd')
+
+
+def get_curves(path, width, height, offset=(0, 0)):
+    """
+    Cubic Bezier curves of a subpath in pixel coordinates.
+
+    :param path: :py:class:`~psd_tools.psd.vector.Subpath` of knots in
+        relative coordinates.
+    :param offset: (x, y) origin of the pixel coordinates.
+    :return: (N, 4, 2) array of control points in (x, y) order.
+    """
+    if len(path) == 0:
+        return np.zeros((0, 4, 2))
+    knots = np.array(
+        [(knot.preceding, knot.anchor, knot.leaving) for knot in path],
+        dtype=np.float64
+    )
+    knots = knots[:, :, ::-1] * (width, height) - offset
+    following = np.roll(knots, -1, axis=0)
+    curves = np.stack(
+        [knots[:, 1], knots[:, 2], following[:, 0], following[:, 1]], axis=1
+    )
+    return curves if path.is_closed() else curves[:-1]
+
+
+def flatten_curves(curves, tolerance=FLATNESS):
+    """
+    Flatten a chain of cubic Bezier curves to a polyline.
+
+    The number of segments of each curve is derived from the bound of the
+    second differences of its control points, so that the polyline deviates
+    at most `tolerance` from the curve. Straight curves stay a single line.
+
+    :param curves: (N, 4, 2) array of control points in (x, y) order, where
+        each curve starts at the end of the previous one.
+    :param tolerance: Maximum deviation in pixels.
+    :return: (M + 1, 2) float64 array of points.
+    """
+    curves = np.asarray(curves, dtype=np.float64).reshape((-1, 4, 2))
+    if len(curves) == 0:
+        return np.zeros((0, 2))
+
+    d1 = curves[:, 0] - 2 * curves[:, 1] + curves[:, 2]
+    d2 = curves[:, 1] - 2 * curves[:, 2] + curves[:, 3]
+    deviation = np.maximum(np.hypot(d1[:, 0], d1[:, 1]),
+                           np.hypot(d2[:, 0], d2[:, 1]))
+    counts = np.clip(
+        np.ceil(np.sqrt(0.75 * deviation / tolerance)), 1, MAX_SEGMENTS
+    ).astype(np.intp)
+
+    index = np.repeat(np.arange(len(curves)), counts)
+    starts = np.repeat(np.cumsum(counts) - counts, counts)
+    t = ((np.arange(len(index)) - starts + 1) /
+         counts[index])[:, np.newaxis]
+    s = 1. - t
+    p = curves[index]
+    points = (
+        s * s * s * p[:, 0] + 3. * s * s * t * p[:, 1] +
+        3. * s * t * t * p[:, 2] + t * t * t * p[:, 3]
+    )
+    return np.concatenate([curves[:1, 0], points])
+
+
+def fill(polylines, width, height, rule='nonzero'):
+    """
+    Rasterize the interior of closed polylines.
+
+    :param polylines: `list` of (N, 2) arrays in (x, y) pixel coordinates.
+        Each polyline is implicitly closed.
+    :param width: Width of the raster.
+    :param height: Height of the raster.
+    :param rule: Fill rule, 'nonzero' or 'evenodd'.
+    :return: (height, width) float32 coverage in [0.0, 1.0].
+    """
+    if rule not in FILL_RULES:
+        raise ValueError('Unknown fill rule: %r' % rule)
+    segments = [
+        _close(np.asarray(points, dtype=np.float64)) for points in polylines
+        if len(points) >= 3
+    ]
+    if not segments:
+        return np.zeros((height, width), dtype=np.float32)
+    segments = np.concatenate(segments)
+    winding = _accumulate(segments, width, height)
+    return _apply_rule(winding, rule)
+
+
+def stroke(polylines, line_width, width, height, closed=None,
+           miter_limit=4.):
+    """
+    Rasterize the outline of polylines with butt caps and miter joins.
+
+    Joins exceeding the miter limit fall back to bevel joins.
+
+    :param polylines: `list` of (N, 2) arrays in (x, y) pixel coordinates.
+    :param line_width: Width of the pen in pixels.
+    :param width: Width of the raster.
+    :param height: Height of the raster.
+    :param closed: `list` of `bool` whether each polyline is closed.
+    :param miter_limit: Maximum ratio of the miter length to the half width.
+    :return: (height, width) float32 coverage in [0.0, 1.0].
+    """
+    if closed is None:
+        closed = [False] * len(polylines)
+    polygons = [
+        _stroke_polygons(
+            np.asarray(points, dtype=np.float64), is_closed,
+            line_width / 2., miter_limit
+        ) for points, is_closed in zip(polylines, closed)
+    ]
+    polygons = [x for x in polygons if len(x)]
+    if not polygons or line_width <= 0:
+        return np.zeros((height, width), dtype=np.float32)
+    polygons = np.concatenate(polygons)
+
+    # Orient all the pieces the same way so that overlaps add up.
+    x, y = polygons[:, :, 0], polygons[:, :, 1]
+    area = np.sum(x * np.roll(y, -1, axis=1) - np.roll(x, -1, axis=1) * y,
+                  axis=1)
+    polygons[area < 0] = polygons[area < 0, ::-1]
+    segments = np.concatenate(
+        [polygons, np.roll(polygons, -1, axis=1)], axis=2
+    ).reshape((-1, 4))
+    winding = _accumulate(segments, width, height)
+    return _apply_rule(winding, 'nonzero')
+
+
+def _close(points):
+    """Line segments of the closed polyline, (N, 4) of x0, y0, x1, y1."""
+    return np.concatenate([points, np.roll(points, -1, axis=0)], axis=1)
+
+
+def _apply_rule(winding, rule):
+    coverage = np.abs(winding).astype(np.float32)
+    if rule == 'evenodd':
+        coverage = np.mod(coverage, 2., out=coverage)
+        coverage = np.minimum(coverage, 2. - coverage, out=coverage)
+    coverage = np.minimum(coverage, 1., out=coverage)
+    # Snap the round-off of the running sum, so empty pixels are exactly 0.
+    coverage[coverage < 1e-5] = 0.
+    coverage[coverage > 1. - 1e-5] = 1.
+    return coverage
+
+
+def _accumulate(segments, width, height):
+    """
+    Accumulate the signed area coverage of line segments.
+
+    Each segment is split at scanlines and pixel columns. A piece within a
+    cell adds its height to the cell, less the area on the right of it, and
+    carries that area to the next cell, so the cumulative sum of a scanline
+    is the winding coverage. Pieces on the left of the raster are clamped to
+    the first column, pieces on the right fall in the extra columns.
+
+    :param segments: (N, 4) array of x0, y0, x1, y1.
+    :return: (height, width) float64 array of winding coverage.
+    """
+    x0, y0, x1, y1 = segments.T
+    # Orient segments downward and keep the direction as the sign.
+    sign = np.where(y1 > y0, 1., -1.)
+    flip = y1 < y0
+    x0, x1 = np.where(flip, x1, x0), np.where(flip, x0, x1)
+    y0, y1 = np.where(flip, y1, y0), np.where(flip, y0, y1)
+    valid = (y0 < y1) & (y1 > 0) & (y0 < height)
+    if not np.any(valid):
+        return np.zeros((height, width))
+    x0, y0, x1, y1, sign = (x[valid] for x in (x0, y0, x1, y1, sign))
+    dxdy = (x1 - x0) / (y1 - y0)
+
+    # Split into scanlines.
+    top, bottom = np.maximum(y0, 0.), np.minimum(y1, float(height))
+    first = np.floor(top).astype(np.intp)
+    counts = np.ceil(bottom).astype(np.intp) - first
+    index = np.repeat(np.arange(len(first)), counts)
+    row = np.repeat(first, counts) + (
+        np.arange(len(index)) - np.repeat(np.cumsum(counts) - counts, counts)
+    )
+    ya = np.maximum(top[index], row)
+    yb = np.minimum(bottom[index], row + 1)
+    xa = x0[index] + (ya - y0[index]) * dxdy[index]
+    xb = x0[index] + (yb - y0[index]) * dxdy[index]
+    dy = (yb - ya) * sign[index]
+
+    # Split into cells; column -1 and width take the outside of the raster.
+    left, right = np.minimum(xa, xb), np.maximum(xa, xb)
+    first = np.clip(np.floor(left), -1, width).astype(np.intp)
+    counts = np.clip(np.floor(right), -1, width).astype(np.intp) - first + 1
+    index = np.repeat(np.arange(len(first)), counts)
+    column = np.repeat(first, counts) + (
+        np.arange(len(index)) - np.repeat(np.cumsum(counts) - counts, counts)
+    )
+    lower = np.where(column < 0, -np.inf, column)
+    upper = np.where(column >= width, np.inf, column + 1)
+    lo = np.clip(left[index], lower, upper)
+    hi = np.clip(right[index], lower, upper)
+    span = right[index] - left[index]
+    fraction = np.divide(
+        hi - lo, span, out=np.ones_like(span), where=span > 0
+    )
+    area = dy[index] * fraction
+    cell = np.clip(column, 0, width)
+    offset = np.clip((lo + hi) / 2., 0., float(width)) - cell
+
+    stride = width + 2
+    position = row[index] * stride + cell
+    acc = np.bincount(
+        np.concatenate([position, position + 1]),
+        weights=np.concatenate([area * (1. - offset), area * offset]),
+        minlength=height * stride
+    ).reshape((height, stride))
+    return np.cumsum(acc, axis=1, out=acc)[:, :width]
+
+
+def _stroke_polygons(points, closed, half_width, miter_limit):
+    """
+    Quadrilaterals of the stroke segments and joins, (N, 4, 2) array.
+    """
+    if len(points) >= 2:
+        keep = np.any(np.diff(points, axis=0) != 0, axis=1)
+        points = points[np.concatenate([[True], keep])]
+    if closed and len(points) >= 2 and np.all(points[0] == points[-1]):
+        points = points[:-1]
+    if len(points) < 2:
+        return np.zeros((0, 4, 2))
+    if closed:
+        points = np.concatenate([points, points[:1]])
+
+    p0, p1 = points[:-1], points[1:]
+    direction = p1 - p0
+    direction /= np.hypot(direction[:, 0], direction[:, 1])[:, np.newaxis]
+    normal = np.stack([-direction[:, 1], direction[:, 0]], axis=1)
+    offset = normal * half_width
+    quads = np.stack(
+        [p0 + offset, p1 + offset, p1 - offset, p0 - offset], axis=1
+    )
+
+    # Joins at the vertices between consecutive segments.
+    if closed:
+        d1, d2, vertex = np.roll(direction, 1, axis=0), direction, p0
+    else:
+        d1, d2, vertex = direction[:-1], direction[1:], p0[1:]
+    if len(vertex) == 0:
+        return quads
+    cross = d1[:, 0] * d2[:, 1] - d1[:, 1] * d2[:, 0]
+    side = -np.sign(cross)[:, np.newaxis]
+    o1 = np.stack([-d1[:, 1], d1[:, 0]], axis=1) * side
+    o2 = np.stack([-d2[:, 1], d2[:, 0]], axis=1) * side
+    bisector = o1 + o2
+    length = np.hypot(bisector[:, 0], bisector[:, 1])
+    valid = (cross != 0) & (length > 0)
+    o1, o2, bisector = o1[valid], o2[valid], bisector[valid]
+    vertex, length = vertex[valid], length[valid]
+    bisector /= length[:, np.newaxis]
+    cosine = np.sum(bisector * o1, axis=1)
+    ratio = 1. / np.maximum(cosine, 1e-12)
+    a = vertex + o1 * half_width
+    b = vertex + o2 * half_width
+    tip = np.where(
+        (ratio <= miter_limit)[:, np.newaxis],
+        vertex + bisector * (half_width * ratio)[:, np.newaxis],
+        (a + b) / 2.,
+    )
+    joins = np.stack([vertex, a, tip, b], axis=1)
+    return np.concatenate([quads, joins])
@@ -0,0 +1,264 @@
+"""
+Incremental compositing session.
+
+:py:class:`CompositeSession` keeps the composited buffers of a document and
+re-renders only the regions affected by layer edits, such as
+:py:meth:`~psd_tools.api.layers.Layer.move`, ``opacity``, ``visible`` or
+``blend_mode`` changes, or
+:py:meth:`~psd_tools.api.layers.Layer.set_channel_numpy`.
+"""
+import logging
+
+import numpy as np
+
+import psd_tools.composite
+from psd_tools.api.layers import AdjustmentLayer, Layer
+from psd_tools.constants import ChannelID
+from .cache import get_state
+from .effects import get_effect_margin
+
+logger = logging.getLogger(__name__)
+
+
+class CompositeSession(object):
+    """Persistent composite context for interactive editing.
+
+    The session composites the document once, then keeps a snapshot of the
+    layer properties that affect rendering. On :py:meth:`update`, changed
+    layers mark their old and new bounding boxes dirty, and only the dirty
+    rectangles are recomposited into the cached buffers.
+
+    Example::
+
+        session = CompositeSession(psd)
+        color, shape, alpha = session.update()
+
+        psd[1].move((10, 0))
+        psd[2].opacity = 128
+        color, shape, alpha = session.update()  # Re-renders edited regions.
+
+    :param group: :py:class:`~psd_tools.PSDImage` or group to composite.
+    :param viewport: Viewport bounding box specified by (x1, y1, x2, y2)
+        tuple. Default is the viewbox of the document.
+    :param color: Backdrop color specified by scalar or tuple of scalar.
+    :param alpha: Backdrop alpha in [0.0, 1.0].
+    :param layer_filter: Callable that takes a layer as argument and
+        returns whether if the layer is composited.
+    :param force: Boolean flag to force vector drawing.
+    """
+    def __init__(
+        self,
+        group,
+        viewport=None,
+        color=1.0,
+        alpha=0.0,
+        layer_filter=None,
+        force=False,
+    ):
+        self._group = group
+        self._viewport = viewport or getattr(group, 'viewbox', group.bbox)
+        self._backdrop = color
+        self._backdrop_alpha = alpha
+        self._layer_filter = layer_filter or Layer.is_visible
+        self._force = force
+        self._states = {}
+        self._dirty = []
+        self._color = None
+        self._shape = None
+        self._alpha = None
+
+    @property
+    def viewport(self):
+        return self._viewport
+
+    def invalidate(self, bbox=None):
+        """
+        Mark the given region dirty.
+
+        :param bbox: (left, top, right, bottom) tuple, or `None` to
+            invalidate the entire viewport.
+        """
+        bbox = bbox or self._viewport
+        bbox = psd_tools.composite._intersect(self._viewport, bbox)
+        if bbox != (0, 0, 0, 0):
+            self._dirty.append(bbox)
+
+    def update(self):
+        """
+        Recomposite dirty regions and return the current buffers.
+
+        :return: (color, shape, alpha) tuple of :py:class:`numpy.ndarray`.
+        """
+        if self._color is None:
+            self._snapshot()
+            self._dirty = []
+            self._color, self._shape, self._alpha = self._render(
+                self._viewport
+            )
+            return self.color, self.shape, self.alpha
+
+        self._collect_changes()
+        for region in _merge_rects(self._dirty):
+            self._update_region(region)
+        self._dirty = []
+        return self.color, self.shape, self.alpha
+
+    @property
+    def color(self):
+        return self._color
+
+    @property
+    def shape(self):
+        return self._shape
+
+    @property
+    def alpha(self):
+        return self._alpha
+
+    def _render(self, viewport):
+        return psd_tools.composite.composite(
+            self._group,
+            color=self._backdrop,
+            alpha=self._backdrop_alpha,
+            viewport=viewport,
+            layer_filter=self._layer_filter,
+            force=self._force,
+        )
+
+    def _update_region(self, region):
+        """Recomposite the region with a margin for edge-based effects."""
+        logger.debug('Recompositing %s' % (region, ))
+        margin = self._margin(region)
+        padded = psd_tools.composite._intersect(
+            self._viewport, (
+                region[0] - margin, region[1] - margin, region[2] + margin,
+                region[3] + margin
+            )
+        )
+        color, shape, alpha = self._render(padded)
+        if self._color.shape[2] != color.shape[2]:
+            self._color = np.repeat(self._color, color.shape[2], axis=2)
+
+        src = (
+            region[0] - padded[0], region[1] - padded[1],
+            region[2] - padded[0], region[3] - padded[1]
+        )
+        dst = (
+            region[0] - self._viewport[0], region[1] - self._viewport[1],
+            region[2] - self._viewport[0], region[3] - self._viewport[1]
+        )
+        for buffer, values in (
+            (self._color, color),
+            (self._shape, shape),
+            (self._alpha, alpha),
+        ):
+            buffer[dst[1]:dst[3], dst[0]:dst[2], :] = \
+                values[src[1]:src[3], src[0]:src[2], :]
+
+    def _margin(self, region):
+        """Extra border to render for strokes that depend on neighbors."""
+        margin = 0
+        for layer in _iter_layers(self._group):
+            width = get_effect_margin(layer)
+            bbox = psd_tools.composite._expand(layer.bbox, width)
+            if psd_tools.composite._intersect(region, bbox) == (0, 0, 0, 0):
+                continue
+            margin = max(margin, width)
+        return margin
+
+    def _snapshot(self):
+        layers = list(_iter_layers(self._group))
+        for layer in [self._group] + layers:
+            if layer.is_group() and hasattr(layer, '_bbox'):
+                del layer._bbox  # Children might have moved.
+        self._states = {
+            id(layer): (
+                layer, _get_extent(layer, self._viewport), get_state(layer)
+            )
+            for layer in layers
+        }
+
+    def _collect_changes(self):
+        previous = self._states
+        self._snapshot()
+        changed = []
+        for key, (layer, bbox, state) in self._states.items():
+            if key not in previous:
+                changed.append((layer, None, bbox))
+                continue
+            _, old_bbox, old_state = previous[key]
+            # Group render is clipped to its bbox, which follows the children.
+            if old_state != state or old_bbox != bbox:
+                changed.append((layer, old_bbox, bbox))
+        for key, (layer, bbox, _) in previous.items():
+            if key not in self._states:
+                changed.append((layer, bbox, None))
+
+        for layer, old_bbox, bbox in changed:
+            logger.debug('Changed %s' % layer)
+            margin = get_effect_margin(layer)
+            if layer.is_group():
+                margin = max(
+                    [margin] +
+                    [get_effect_margin(x) for x in _iter_layers(layer)]
+                )
+            for region in (old_bbox, bbox):
+                if region is not None:
+                    self.invalidate(
+                        psd_tools.composite._expand(region, margin)
+                    )
+
+
+def _iter_layers(group):
+    """Iterate over all layers including clip layers."""
+    if hasattr(group, 'descendants'):
+        for layer in group.descendants(include_clip=True):
+            yield layer
+    else:
+        yield group
+
+
+def _get_extent(layer, viewport):
+    """
+    Region the layer affects. Adjustments, layers with an empty bbox such as
+    groups of adjustments, and pixels without transparency affect the
+    entire viewport.
+    """
+    if layer.bbox == (0, 0, 0, 0) or isinstance(layer, AdjustmentLayer):
+        return viewport
+    if _is_opaque(layer):
+        return viewport
+    if layer.is_group() and any(
+        isinstance(x, AdjustmentLayer) for x in layer.descendants()
+    ):
+        return viewport
+    return layer.bbox
+
+
+def _is_opaque(layer):
+    """Pixels without transparency channel cover the entire viewport."""
+    if layer.is_group() or not layer.has_pixels():
+        return False
+    return not any(
+        info.id == ChannelID.TRANSPARENCY_MASK and len(data.data) > 0
+        for info, data in zip(layer._record.channel_info, layer._channels)
+    )
+
+
+def _merge_rects(rects):
+    """Merge overlapping rectangles into their bounding rectangles."""
+    merged = []
+    for rect in rects:
+        while True:
+            for index, other in enumerate(merged):
+                if psd_tools.composite._intersect(rect, other) != (0, 0, 0, 0):
+                    rect = (
+                        min(rect[0], other[0]), min(rect[1], other[1]),
+                        max(rect[2], other[2]), max(rect[3], other[3])
+                    )
+                    del merged[index]
+                    break
+            else:
+                break
+        merged.append(rect)
+    return merged
@@ -0,0 +1,222 @@
+"""
+Prefix-stack compositing.
+
+:py:class:`PrefixStack` composites a group once and keeps the accumulated
+backdrop below each layer, so that renders with a single layer toggled or
+replaced only re-blend the layers above it within the affected region.
+"""
+import logging
+
+import psd_tools.composite
+from psd_tools.api.layers import Layer
+from .effects import get_effect_margin
+from .session import _get_extent
+
+logger = logging.getLogger(__name__)
+
+
+class PrefixStack(object):
+    """
+    Composite of a group that supports fast single-layer variations.
+
+    The stack keeps the compositor state before each layer of the group.
+    :py:meth:`toggle` and :py:meth:`replace` restore the state below the
+    given layer, then re-blend layers from that index to the top, restricted
+    to the region the changed layer affects. Everywhere else, the result is
+    the base composite.
+
+    The stack holds one set of buffers per layer, so memory grows linearly
+    with the number of layers in the group.
+
+    Example::
+
+        from psd_tools.composite import PrefixStack
+
+        stack = PrefixStack(psd)
+        for index in range(len(stack)):
+            color, shape, alpha = stack.toggle(index)
+
+    :param group: :py:class:`~psd_tools.PSDImage` or group to composite.
+    :param viewport: Viewport bounding box specified by (x1, y1, x2, y2)
+        tuple. Default is the viewbox of the document.
+    :param color: Backdrop color specified by scalar or tuple of scalar.
+    :param alpha: Backdrop alpha in [0.0, 1.0].
+    :param layer_filter: Callable that takes a layer as argument and
+        returns whether if the layer is composited.
+    :param force: Boolean flag to force vector drawing.
+    """
+    def __init__(
+        self,
+        group,
+        viewport=None,
+        color=1.0,
+        alpha=0.0,
+        layer_filter=None,
+        force=False,
+    ):
+        self._layers = list(group)
+        self._viewport = psd_tools.composite._get_viewport(group, viewport)
+        self._layer_filter = layer_filter or Layer.is_visible
+        self._force = force
+
+        compositor = psd_tools.composite._create_compositor(
+            group, self._viewport, color, alpha, self._layer_filter, force
+        )
+        self._states = []
+        for layer in self._layers:
+            self._states.append(_get_state(compositor))
+            compositor.apply(layer)
+        self._states.append(_get_state(compositor))
+        self._result = compositor.finish()
+
+    def __len__(self):
+        return len(self._layers)
+
+    def __getitem__(self, index):
+        return self._layers[index]
+
+    @property
+    def viewport(self):
+        return self._viewport
+
+    def composite(self):
+        """
+        Base composite of the group.
+
+        :return: (color, shape, alpha) tuple of :py:class:`numpy.ndarray`.
+        """
+        return tuple(x.copy() for x in self._result)
+
+    def backdrop(self, index):
+        """
+        Accumulated composite of the layers below the given index.
+
+        :return: (color, shape, alpha) tuple of :py:class:`numpy.ndarray`.
+        """
+        compositor = _restore(self._states[index], self._viewport, None)
+        return compositor.finish()
+
+    def toggle(self, index):
+        """
+        Composite with the visibility of the layer at the index toggled.
+
+        :return: (color, shape, alpha) tuple of :py:class:`numpy.ndarray`.
+        """
+        layer = self._layers[index]
+        if self._layer_filter(layer):
+            return self.replace(index, None)
+
+        def layer_filter(x):
+            return x is layer or self._layer_filter(x)
+
+        return self._render(
+            index, layer, _get_extent(layer, self._viewport), layer_filter
+        )
+
+    def replace(self, index, layer):
+        """
+        Composite with the layer at the index replaced.
+
+        :param layer: Layer to composite in place of the layer at the index,
+            or `None` to remove it.
+        :return: (color, shape, alpha) tuple of :py:class:`numpy.ndarray`.
+        """
+        bbox = _get_extent(self._layers[index], self._viewport)
+        if layer is not None:
+            bbox = _union_bbox(bbox, _get_extent(layer, self._viewport))
+        return self._render(index, layer, bbox, self._layer_filter)
+
+    def _render(self, index, layer, bbox, layer_filter):
+        margin = max(
+            [_margin(self._layers[index])] +
+            ([_margin(layer)] if layer is not None else [])
+        )
+        region = psd_tools.composite._intersect(
+            self._viewport, (
+                bbox[0] - margin, bbox[1] - margin, bbox[2] + margin,
+                bbox[3] + margin
+            )
+        )
+        result = self.composite()
+        if region == (0, 0, 0, 0):
+            return result
+
+        # Effects of the layers above need their neighbors at the border.
+        above = self._layers[index + 1:]
+        margin = max([margin] + [_margin(x) for x in above])
+        padded = psd_tools.composite._intersect(
+            self._viewport, (
+                region[0] - margin, region[1] - margin, region[2] + margin,
+                region[3] + margin
+            )
+        )
+        logger.debug('Re-blending layers %d.. in %s' % (index, padded))
+        compositor = _restore(self._states[index], self._viewport, padded)
+        compositor._layer_filter = layer_filter
+        compositor._force = self._force
+        if layer is not None:
+            compositor.apply(layer)
+        for x in above:
+            compositor.apply(x)
+
+        r = (
+            region[0] - self._viewport[0], region[1] - self._viewport[1],
+            region[2] - self._viewport[0], region[3] - self._viewport[1]
+        )
+        src = (
+            region[0] - padded[0], region[1] - padded[1],
+            region[2] - padded[0], region[3] - padded[1]
+        )
+        for buffer, values in zip(result, compositor.finish()):
+            buffer[r[1]:r[3], r[0]:r[2], :] = \
+                values[src[1]:src[3], src[0]:src[2], :]
+        return result
+
+
+def _get_state(compositor):
+    """
+    Compositor buffers are replaced, not modified, on each apply. Pending
+    adjustments are kept unapplied, so that they fuse as in one pass.
+    """
+    return (
+        compositor._color_0,
+        compositor._alpha_0,
+        compositor._color,
+        compositor._alpha,
+        compositor._shape_g,
+        compositor._alpha_g,
+        compositor._tone_lut,
+    )
+
+
+def _restore(state, viewport, region):
+    """Create a compositor over the region from the saved state."""
+    region = region or viewport
+    r = (
+        region[0] - viewport[0], region[1] - viewport[1],
+        region[2] - viewport[0], region[3] - viewport[1]
+    )
+    tone_lut = state[-1]
+    state = [x[r[1]:r[3], r[0]:r[2], :] for x in state[:-1]]
+    compositor = psd_tools.composite.Compositor(region, state[0], state[1])
+    (
+        compositor._color, compositor._alpha, compositor._shape_g,
+        compositor._alpha_g
+    ) = state[2:]
+    compositor._tone_lut = tone_lut
+    return compositor
+
+
+def _margin(layer):
+    layers = [layer]
+    if layer.is_group():
+        layers += list(layer.descendants())
+    return max(get_effect_margin(x) for x in layers)
+
+
+def _union_bbox(a, b):
+    if a == (0, 0, 0, 0):
+        return b
+    if b == (0, 0, 0, 0):
+        return a
+    return (min(a[0], b[0]), min(a[1], b[1]), max(a[2], b[2]), max(a[3], b[3]))
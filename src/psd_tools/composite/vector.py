@@ -1,14 +1,27 @@
+import hashlib
 import logging
 from typing import Tuple
 
 import numpy as np
 from psd_tools.api.numpy_io import EXPECTED_CHANNELS, get_pattern
+from psd_tools.composite.rasterizer import (
+    fill, flatten_curves, get_curves, stroke
+)
 from psd_tools.constants import Tag
 from psd_tools.terminology import Enum, Key, Klass, Type
-from scipy import interpolate
+from psd_tools.utils import LRUCache
 
 logger = logging.getLogger(__name__)
 
+#: Cache of rasterized vector masks and strokes keyed by the path geometry.
+#: Adjust the memory budget by ``coverage_cache.max_bytes``.
+coverage_cache = LRUCache(max_bytes=128 * 1024 * 1024)
+
+#: Cache of gradient color and alpha lookup tables keyed by the descriptor.
+gradient_cache = LRUCache(max_bytes=16 * 1024 * 1024)
+
+#: Number of entries of gradient lookup tables.
+GRADIENT_LUT_SIZE = 4096
 
 
 def _get_color(desc) -> Tuple[float, ...]:
@@ -68,11 +81,33 @@ def _get_color(desc) -> Tuple[float, ...]:
 
 
 
-def draw_vector_mask(layer):
-    return _draw_path(layer, brush={'color': 255})
+def draw_vector_mask(layer, viewport=None):
+    """
+    Rasterize the vector mask of the layer.
+
+    Only the bounding box of the path within the viewport is rasterized.
+    Results are shared through :py:data:`coverage_cache`, so the
+    returned mask is read-only.
+
+    :param layer: :py:class:`~psd_tools.api.layers.Layer`.
+    :param viewport: (left, top, right, bottom) tuple to rasterize, default
+        to the document viewbox.
+    :return: `tuple` of (mask, bbox, background), where mask is a float32
+        array covering bbox, and background is the value outside of bbox.
+    """
+    return _draw_path(layer, viewport, brush={'rule': 'nonzero'})
+
 
+def draw_stroke(layer, viewport=None):
+    """
+    Rasterize the vector stroke of the layer.
 
-def draw_stroke(layer):
+    :param layer: :py:class:`~psd_tools.api.layers.Layer`.
+    :param viewport: (left, top, right, bottom) tuple to rasterize, default
+        to the document viewbox.
+    :return: `tuple` of (mask, bbox, background), see
+        :py:func:`draw_vector_mask`.
+    """
     desc = layer.stroke._data
     # _CAP = {
     #     'strokeStyleButtCap': 0,
@@ -90,26 +125,28 @@ def draw_stroke(layer):
     # linecap = desc.get('strokeStyleLineCapType', None)
     # linecap = linecap.enum if linecap else 'strokeStyleButtCap'
     # miterlimit = desc.get('strokeStyleMiterLimit', 100.0) / 100.
-    # aggdraw >= 1.3.12 will support additional params.
+    # TODO: Support line caps, joins, and miter limit of the descriptor.
     return _draw_path(
         layer,
+        viewport,
         pen={
-            'color': 255,
-            'width': width,
+            'line_width': width,
             # 'linejoin': _JOIN.get(linejoin, 0),
             # 'linecap': _CAP.get(linecap, 0),
-            # 'miterlimit': miterlimit,
+            # 'miter_limit': miterlimit,
         }
     )
 
 
-def _draw_path(layer, brush=None, pen=None):
-    height, width = layer._psd.height, layer._psd.width
+def _draw_path(layer, viewport=None, brush=None, pen=None):
+    from psd_tools.composite import _intersect
+
+    size = (layer._psd.width, layer._psd.height)
+    viewport = viewport or layer._psd.viewbox
     color = 0
     if layer.vector_mask.initial_fill_rule and \
         len(layer.vector_mask.paths) == 0:
         color = 1
-    mask = np.full((height, width, 1), color, dtype=np.float32)
 
     # Group merged path components.
     paths = []
@@ -119,11 +156,32 @@ def _draw_path(layer, brush=None, pen=None):
         else:
             paths.append([subpath])
 
-    # Apply shape operation.
+    # Miter joins may extend beyond the half width of the pen.
+    padding = 2 * pen['line_width'] + 1 if pen else 1
+    bbox = _intersect(_get_path_bbox(paths, size, padding), viewport)
+
+    # Path bytes include the initial fill rule and all the subpaths.
+    key = (
+        hashlib.blake2b(
+            layer.vector_mask._data.path.tobytes(), digest_size=16
+        ).digest(),
+        tuple(sorted((brush or {}).items())),
+        tuple(sorted((pen or {}).items())),
+        size,
+        bbox,
+    )
+    cached = coverage_cache.get(key)
+    if cached is not None:
+        return cached
+
+    height, width = bbox[3] - bbox[1], bbox[2] - bbox[0]
+    mask = np.full((height, width, 1), color, dtype=np.float32)
+
+    # Apply shape operation, tracking the value outside of bbox.
+    background = color
     first = True
     for subpath_list in paths:
-        plane = _draw_subpath(subpath_list, width, height, brush, pen)
-        assert mask.shape == (height, width, 1)
+        plane = _draw_subpath(subpath_list, bbox, size, brush, pen)
         assert plane.shape == mask.shape
 
         op = subpath_list[0].operation
@@ -134,68 +192,70 @@ def _draw_path(layer, brush=None, pen=None):
         elif op == 2:  # Subtract.
             if first and brush:
                 mask = 1 - mask
+                background = 1 - background
             mask = np.maximum(0, mask - plane)
         elif op == 3:  # Intersect.
             if first and brush:
                 mask = 1 - mask
+                background = 1 - background
             mask = mask * plane
+            background = 0
         first = False
 
-    return np.minimum(1, np.maximum(0, mask))
+    mask = np.minimum(1, np.maximum(0, mask))
+    mask.flags.writeable = False  # Shared by the cache.
+    result = (mask, bbox, float(background))
+    coverage_cache.put(key, result)
+    return result
+
+
+def _get_path_bbox(paths, size, padding):
+    """Bounding box of knots, which contains the Bezier curves."""
+    points = [
+        point for subpath_list in paths for subpath in subpath_list
+        for knot in subpath
+        for point in (knot.preceding, knot.anchor, knot.leaving)
+    ]
+    if not points:
+        return (0, 0, 0, 0)
+    points = np.array(points, dtype=np.float64)
+    top, left = points.min(axis=0) * (size[1], size[0])
+    bottom, right = points.max(axis=0) * (size[1], size[0])
+    return (
+        int(np.floor(left - padding)),
+        int(np.floor(top - padding)),
+        int(np.ceil(right + padding)),
+        int(np.ceil(bottom + padding)),
+    )
 
 
-def _draw_subpath(subpath_list, width, height, brush, pen):
+def _draw_subpath(subpath_list, bbox, size, brush, pen):
     """
-    Rasterize Bezier curves.
+    Rasterize Bezier curves within bbox.
 
-    TODO: Replace aggdraw implementation with skimage.draw.
+    Each subpath is filled with `brush` or outlined with `pen` parameters of
+    :py:func:`~psd_tools.composite.rasterizer.fill` and
+    :py:func:`~psd_tools.composite.rasterizer.stroke`, then combined.
     """
-    import aggdraw
-    from PIL import Image
-    mask = Image.new('L', (width, height), 0)
-    draw = aggdraw.Draw(mask)
-    pen = aggdraw.Pen(**pen) if pen else None
-    brush = aggdraw.Brush(**brush) if brush else None
+    width, height = bbox[2] - bbox[0], bbox[3] - bbox[1]
+    mask = np.zeros((height, width), dtype=np.float32)
+    if width == 0 or height == 0:
+        return mask[:, :, np.newaxis]
+
     for subpath in subpath_list:
         if len(subpath) <= 1:
             logger.warning('not enough knots: %d' % len(subpath))
             continue
-        path = ' '.join(map(str, _generate_symbol(subpath, width, height)))
-        symbol = aggdraw.Symbol(path)
-        draw.symbol((0, 0), symbol, pen, brush)
-    draw.flush()
-    del draw
-    return np.expand_dims(np.array(mask).astype(np.float32) / 255., 2)
-
-
-def _generate_symbol(path, width, height, command='C'):
-    """Sequence generator for SVG path."""
-    if len(path) == 0:
-        return
-
-    # Initial point.
-    yield 'M'
-    yield path[0].anchor[1] * width
-    yield path[0].anchor[0] * height
-    yield command
-
-    # Closed path or open path
-    points = (
-        zip(path, path[1:] +
-            path[0:1]) if path.is_closed() else zip(path, path[1:])
-    )
-
-    # Rest of the points.
-    for p1, p2 in points:
-        yield p1.leaving[1] * width
-        yield p1.leaving[0] * height
-        yield p2.preceding[1] * width
-        yield p2.preceding[0] * height
-        yield p2.anchor[1] * width
-        yield p2.anchor[0] * height
-
-    if path.is_closed():
-        yield 'Z'
+        polyline = flatten_curves(
+            get_curves(subpath, size[0], size[1], offset=bbox[:2])
+        )
+        if pen:
+            plane = stroke([polyline], width=width, height=height,
+                           closed=[subpath.is_closed()], **pen)
+        else:
+            plane = fill([polyline], width, height, **brush)
+        mask += plane - mask * plane
+    return mask[:, :, np.newaxis]
 
 
 def create_fill_desc(layer, desc, viewport):
@@ -209,41 +269,47 @@ def create_fill_desc(layer, desc, viewport):
     return None, None
 
 
-def create_fill(layer, viewport):
-    """Create a fill image."""
+def create_fill(layer, viewport, region=None):
+    """
+    Create a fill image.
+
+    :param region: Optional part of the viewport to draw. The fill stays
+        anchored to the viewport.
+    """
     if Tag.SOLID_COLOR_SHEET_SETTING in layer.tagged_blocks:
         desc = layer.tagged_blocks.get_data(Tag.SOLID_COLOR_SHEET_SETTING)
-        return draw_solid_color_fill(viewport, desc)
+        return draw_solid_color_fill(viewport, desc, region)
     if Tag.PATTERN_FILL_SETTING in layer.tagged_blocks:
         desc = layer.tagged_blocks.get_data(Tag.PATTERN_FILL_SETTING)
-        return draw_pattern_fill(viewport, layer._psd, desc)
+        return draw_pattern_fill(viewport, layer._psd, desc, region)
     if Tag.GRADIENT_FILL_SETTING in layer.tagged_blocks:
         desc = layer.tagged_blocks.get_data(Tag.GRADIENT_FILL_SETTING)
-        return draw_gradient_fill(viewport, desc)
+        return draw_gradient_fill(viewport, desc, region)
     if Tag.VECTOR_STROKE_CONTENT_DATA in layer.tagged_blocks:
         stroke = layer.tagged_blocks.get_data(Tag.VECTOR_STROKE_DATA)
         if not stroke or stroke.get('fillEnabled').value is True:
             desc = layer.tagged_blocks.get_data(Tag.VECTOR_STROKE_CONTENT_DATA)
             if Key.Color in desc:
-                return draw_solid_color_fill(viewport, desc)
+                return draw_solid_color_fill(viewport, desc, region)
             elif Key.Pattern in desc:
-                return draw_pattern_fill(viewport, layer._psd, desc)
+                return draw_pattern_fill(viewport, layer._psd, desc, region)
             elif Key.Gradient in desc:
-                return draw_gradient_fill(viewport, desc)
+                return draw_gradient_fill(viewport, desc, region)
     return None, None
 
 
-def draw_solid_color_fill(viewport, desc):
+def draw_solid_color_fill(viewport, desc, region=None):
     """
     Create a solid color fill.
     """
     fill = _get_color(desc)
-    height, width = viewport[3] - viewport[1], viewport[2] - viewport[0]
+    region = region or viewport
+    height, width = region[3] - region[1], region[2] - region[0]
     color = np.full((height, width, len(fill)), fill, dtype=np.float32)
     return color, None
 
 
-def draw_pattern_fill(viewport, psd, desc):
+def draw_pattern_fill(viewport, psd, desc, region=None):
     """
     Create a pattern fill.
 
@@ -265,18 +331,52 @@ def draw_pattern_fill(viewport, psd, desc):
             'phase': Descriptor(b'Pnt '){'Hrzn': 0.0, 'Vrtc': 0.0}
             }
 
+    :param region: Optional part of the viewport to draw. The pattern is
+        tiled from the top-left corner of the viewport.
+
     .. todo:: Test this.
     """
     pattern_id = desc[Enum.Pattern][Key.ID].value.rstrip('\x00')
-    pattern = psd._get_pattern(pattern_id)
-    if not pattern:
+    scale = float(desc.get(Key.Scale, 100.)) / 100.
+    result = _get_pattern_tile(psd, pattern_id, scale)
+    if result is None:
         logger.error('Pattern not found: %s' % (pattern_id))
         return None, None
+    panel, channels = result
+
+    region = region or viewport
+    height, width = region[3] - region[1], region[2] - region[0]
+    if region != viewport:
+        panel = np.roll(
+            panel, (
+                (viewport[1] - region[1]) % panel.shape[0],
+                (viewport[0] - region[0]) % panel.shape[1],
+            ),
+            axis=(0, 1)
+        )
+    pixels = _tile(panel, height, width)
+    if pixels.shape[2] > channels:
+        return pixels[:, :, :channels], pixels[:, :, -1:]
+    return pixels, None
+
 
+def _get_pattern_tile(psd, pattern_id, scale):
+    """
+    Decoded and scaled pattern tile, shared through the document pattern
+    cache.
+
+    :return: (tile, channels) tuple, or `None` if the pattern is not found.
+    """
+    key = (pattern_id, scale)
+    result = psd._pattern_cache.get(key)
+    if result is not None:
+        return result
+
+    pattern = psd._get_pattern(pattern_id)
+    if not pattern:
+        return None
     panel = get_pattern(pattern)
     assert panel.shape[0] > 0
-
-    scale = float(desc.get(Key.Scale, 100.)) / 100.
     if scale != 1.:
         from skimage.transform import resize
         new_shape = (
@@ -284,23 +384,38 @@ def draw_pattern_fill(viewport, psd, desc):
             max(1, int(panel.shape[1] * scale))
         )
         panel = resize(panel, new_shape)
-
-    height, width = viewport[3] - viewport[1], viewport[2] - viewport[0]
-    reps = (
-        int(np.ceil(float(height) / panel.shape[0])),
-        int(np.ceil(float(width) / panel.shape[1])),
-        1,
-    )
-    channels = EXPECTED_CHANNELS.get(pattern.image_mode)
-    pixels = np.tile(panel, reps)[:height, :width, :]
-    if pixels.shape[2] > channels:
-        return pixels[:, :, :channels], pixels[:, :, -1:]
-    return pixels, None
+    panel = np.ascontiguousarray(panel, dtype=np.float32)
+    panel.flags.writeable = False  # Shared by the cache.
+    result = (panel, EXPECTED_CHANNELS.get(pattern.image_mode))
+    psd._pattern_cache.put(key, result)
+    return result
 
 
-def draw_gradient_fill(viewport, desc):
+def _tile(panel, height, width):
+    """
+    Repeat the tile over (height, width) by copying the filled region in
+    doubling blocks, without the intermediate array of `np.tile`.
+    """
+    pixels = np.empty((height, width, panel.shape[2]), dtype=panel.dtype)
+    rows, columns = min(height, panel.shape[0]), min(width, panel.shape[1])
+    pixels[:rows, :columns] = panel[:rows, :columns]
+    while columns < width:
+        size = min(columns, width - columns)
+        pixels[:rows, columns:columns + size] = pixels[:rows, :size]
+        columns += size
+    while rows < height:
+        size = min(rows, height - rows)
+        pixels[rows:rows + size] = pixels[:size]
+        rows += size
+    return pixels
+
+
+def draw_gradient_fill(viewport, desc, region=None):
     """
     Create a gradient fill image.
+
+    :param region: Optional part of the viewport to draw. The gradient
+        geometry is defined by the viewport.
     """
     height, width = viewport[3] - viewport[1], viewport[2] - viewport[0]
 
@@ -308,10 +423,17 @@ def draw_gradient_fill(viewport, desc):
     scale = float(desc.get(Key.Scale, 100.)) / 100.
     ratio = (angle % 90)
     scale *= (90. - ratio) / 90. * width + (ratio / 90.) * height
-    X, Y = np.meshgrid(
-        np.linspace(-width / scale, width / scale, width, dtype=np.float32),
-        np.linspace(-height / scale, height / scale, height, dtype=np.float32),
-    )
+    # 1-D coordinates broadcast to the full (height, width) index map.
+    X = np.linspace(
+        -width / scale, width / scale, width, dtype=np.float32
+    )[np.newaxis, :]
+    Y = np.linspace(
+        -height / scale, height / scale, height, dtype=np.float32
+    )[:, np.newaxis]
+    if region is not None and region != viewport:
+        X = X[:, region[0] - viewport[0]:region[2] - viewport[0]]
+        Y = Y[region[1] - viewport[1]:region[3] - viewport[1]]
+        height, width = Y.shape[0], X.shape[1]
 
     gradient_kind = desc.get(Key.Type).enum
     if gradient_kind == Enum.Linear:
@@ -329,13 +451,16 @@ def draw_gradient_fill(viewport, desc):
         logger.warning('Unknown gradient style: %s.' % (gradient_kind))
         Z = np.full((height, width), 0.5, dtype=np.float32)
 
-    Z = np.maximum(0., np.minimum(1., Z))
+    Z = np.broadcast_to(Z, (height, width))
+    index = np.rint(
+        np.clip(Z, 0., 1.) * (GRADIENT_LUT_SIZE - 1)
+    ).astype(np.intp)
     if bool(desc.get(Key.Reverse, False)):
-        Z = 1. - Z
+        index = (GRADIENT_LUT_SIZE - 1) - index
 
-    G, Ga = _make_gradient_color(desc.get(Key.Gradient))
-    color = G(Z) if G is not None else None
-    shape = np.expand_dims(Ga(Z), 2) if Ga is not None else None
+    G, Ga = _get_gradient_lut(desc.get(Key.Gradient))
+    color = G[index] if G is not None else None
+    shape = Ga[index][:, :, np.newaxis] if Ga is not None else None
     return color, shape
 
 
@@ -373,6 +498,28 @@ def _make_diamond_gradient(X, Y, angle):
     return Z
 
 
+def _get_gradient_lut(grad):
+    """
+    Color and alpha lookup tables of the gradient, shared by
+    :py:data:`gradient_cache`.
+
+    :return: (color, alpha) tuple of float32 arrays of
+        :py:data:`GRADIENT_LUT_SIZE` entries, either can be `None`.
+    """
+    key = hashlib.blake2b(grad.tobytes(), digest_size=16).digest()
+    lut = gradient_cache.get(key)
+    if lut is None:
+        lut = tuple(
+            None if x is None else np.asarray(x, dtype=np.float32)
+            for x in _make_gradient_color(grad)
+        )
+        for x in lut:
+            if x is not None:
+                x.flags.writeable = False  # Shared by the cache.
+        gradient_cache.put(key, lut)
+    return lut
+
+
 def _make_gradient_color(grad):
     gradient_form = grad.get(Type.GradientForm).enum
     if gradient_form == Enum.ColorNoise:
@@ -381,7 +528,7 @@ def _make_gradient_color(grad):
         return _make_linear_gradient_color(grad)
 
     logger.error('Unknown gradient form: %s' % gradient_form)
-    return None
+    return None, None
 
 
 def _make_linear_gradient_color(grad):
@@ -397,9 +544,7 @@ def _make_linear_gradient_color(grad):
     if len(X) == 1:
         X = [0., 1.]
         Y = [Y[0], Y[0]]
-    G = interpolate.interp1d(
-        X, Y, axis=0, bounds_error=False, fill_value=(Y[0], Y[-1])
-    )
+    G = _interpolate(X, Y)
     if Key.Transparency not in grad:
         return G, None
 
@@ -415,9 +560,7 @@ def _make_linear_gradient_color(grad):
     if len(X) == 1:
         X = [0., 1.]
         Y = [Y[0], Y[0]]
-    Ga = interpolate.interp1d(
-        X, Y, axis=0, bounds_error=False, fill_value=(Y[0], Y[-1])
-    )
+    Ga = _interpolate(X, Y)
     return G, Ga
 
 
@@ -441,7 +584,7 @@ def _make_noise_gradient_color(grad):
             'Mxm ': [0, 100, 100, 100]
         }
     """
-    from scipy.ndimage.filters import maximum_filter1d, uniform_filter1d
+    from scipy.ndimage import maximum_filter1d, uniform_filter1d
     logger.debug('Noise gradient is not accurate.')
     roughness = grad.get(Key.Smoothness).value / 4096.  # Larger is sharper.
     maximum = np.array([x.value for x in grad.get(Key.Maximum)],
@@ -458,27 +601,26 @@ def _make_noise_gradient_color(grad):
     Y = ((maximum - minimum) * Y + minimum) / 100.
     X = np.linspace(0, 1, 256, dtype=np.float32)
     if grad.get(Key.ShowTransparency):
-        G = interpolate.interp1d(
-            X,
-            Y[:, :-1],
-            axis=0,
-            bounds_error=False,
-            fill_value=(Y[0, :-1], Y[-1, :-1])
-        )
-        Ga = interpolate.interp1d(
-            X,
-            Y[:, -1],
-            axis=0,
-            bounds_error=False,
-            fill_value=(Y[0, -1], Y[-1, -1])
-        )
+        G = _interpolate(X, Y[:, :-1])
+        Ga = _interpolate(X, Y[:, -1])
     else:
-        G = interpolate.interp1d(
-            X,
-            Y[:, :3],
-            axis=0,
-            bounds_error=False,
-            fill_value=(Y[0, :3], Y[-1, :3])
-        )
+        G = _interpolate(X, Y[:, :3])
         Ga = None
     return G, Ga
+
+
+def _interpolate(X, Y):
+    """
+    Sample the piecewise linear function through the stops at
+    :py:data:`GRADIENT_LUT_SIZE` points in [0, 1]. Values outside of the
+    stops extend the first and last ones.
+    """
+    X = np.asarray(X, dtype=np.float64)
+    Y = np.asarray(Y, dtype=np.float64)
+    order = np.argsort(X, kind='stable')
+    X, Y = X[order], Y[order]
+    T = np.linspace(0., 1., GRADIENT_LUT_SIZE)
+    if Y.ndim == 1:
+        return np.interp(T, X, Y).astype(np.float32)
+    return np.stack([np.interp(T, X, Y[:, i]) for i in range(Y.shape[1])],
+                    axis=1).astype(np.float32)
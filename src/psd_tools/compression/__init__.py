@@ -7,13 +7,18 @@ import io
 import zlib
 from psd_tools.constants import Compression
 from psd_tools.utils import (
-    be_array_from_bytes, be_array_to_bytes, read_be_array, write_be_array
+    LRUCache, be_array_from_bytes, be_array_to_bytes, read_be_array,
+    write_be_array
 )
 try:
     from . import _rle as rle_impl
 except ImportError:
     from . import rle as rle_impl
 
+#: Cache of RLE row offsets for decoding rows band by band, keyed by the
+#: compressed data. The data held by the key counts toward the budget.
+rle_offsets_cache = LRUCache(max_bytes=256 * 1024 * 1024)
+
 
 def compress(data, compression, width, height, depth, version=1):
     """Compress raw data.
@@ -72,6 +77,47 @@ def decompress(data, compression, width, height, depth, version=1):
     return result
 
 
+def decompress_rows(
+    data, compression, width, height, depth, version=1, start=0, stop=None
+):
+    """Decompress a range of rows.
+
+    RAW and RLE data are decoded only for the requested rows, using the byte
+    counts table for RLE, which is parsed once and kept in
+    :py:data:`rle_offsets_cache`. ZIP data are decompressed in full and
+    sliced.
+
+    :param data: compressed data bytes.
+    :param compression: compression type,
+            see :py:class:`~psd_tools.constants.Compression`.
+    :param width: width.
+    :param height: height of the whole data.
+    :param depth: bit depth of the pixel.
+    :param version: psd file version.
+    :param start: first row to decode.
+    :param stop: row to stop decoding, or `None` for the last row.
+    :return: decompressed data bytes.
+    """
+    stop = height if stop is None else min(stop, height)
+    row_size = max((width * depth + 7) // 8, 1)
+    if compression == Compression.RAW:
+        return data[start * row_size:stop * row_size]
+    elif compression == Compression.RLE:
+        # Parse the byte counts table once for all the bands.
+        key = (data, height, version)
+        offsets = rle_offsets_cache.get(key)
+        if offsets is None:
+            offsets = rle_row_offsets(data, height, version)
+            rle_offsets_cache.put(
+                key, offsets, nbytes=len(data) + 8 * len(offsets)
+            )
+        return decode_rle_rows(
+            data, offsets, max(width * depth // 8, 1), start, stop
+        )
+    result = decompress(data, compression, width, height, depth, version)
+    return result[start * row_size:stop * row_size]
+
+
 def encode_rle(data, width, height, depth, version):
     row_size = width * depth // 8
     with io.BytesIO(data) as fp:
@@ -87,13 +133,32 @@ def encode_rle(data, width, height, depth, version):
     return result
 
 
-def decode_rle(data, width, height, depth, version):
+def decode_rle(data, width, height, depth, version, start=0, stop=None):
     row_size = max(width * depth // 8, 1)
+    offsets = rle_row_offsets(data, height, version)
+    return decode_rle_rows(data, offsets, row_size, start, stop)
+
+
+def rle_row_offsets(data, height, version):
+    """Offsets of RLE rows from the byte counts table.
+
+    :return: `list` of `height + 1` offsets into `data`.
+    """
     with io.BytesIO(data) as fp:
         bytes_counts = read_be_array(('H', 'I')[version - 1], height, fp)
-        return b''.join(
-            rle_impl.decode(fp.read(count), row_size) for count in bytes_counts
-        )
+        offsets = [fp.tell()]
+    for count in bytes_counts:
+        offsets.append(offsets[-1] + count)
+    return offsets
+
+
+def decode_rle_rows(data, offsets, row_size, start=0, stop=None):
+    """Decode a range of RLE rows given the offsets of rows."""
+    stop = len(offsets) - 1 if stop is None else stop
+    return b''.join(
+        rle_impl.decode(data[offsets[i]:offsets[i + 1]], row_size)
+        for i in range(start, stop)
+    )
 
 
 def encode_prediction(data, w, h, depth):
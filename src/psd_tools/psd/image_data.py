@@ -10,7 +10,9 @@ import attr
 import logging
 import io
 
-from psd_tools.compression import compress, decompress
+from psd_tools.compression import (
+    compress, decompress, decompress_rows, decode_rle_rows, rle_row_offsets
+)
 from psd_tools.constants import Compression
 from psd_tools.psd.base import BaseElement
 from psd_tools.validators import in_
@@ -54,13 +56,21 @@ class ImageData(BaseElement):
         logger.debug('  wrote image data, len=%d' % (fp.tell() - start_pos))
         return written
 
-    def get_data(self, header, split=True):
+    def get_data(self, header, split=True, channels=None, rows=None):
         """
         Get decompressed data.
 
         :param header: See :py:class:`~psd_tools.psd.header.FileHeader`.
+        :param channels: Indices of the channels to decode. RAW and RLE data
+            decode only the given channels. Default decodes all.
+        :param rows: Optional (start, stop) range of rows to decode. RAW and
+            RLE data decode only the given rows.
         :return: `list` of bytes corresponding each channel.
         """
+        if channels is not None or rows is not None:
+            if channels is None:
+                channels = range(header.channels)
+            return self._get_channels(header, channels, rows)
         data = decompress(
             self.data, self.compression, header.width,
             header.height * header.channels, header.depth, header.version
@@ -71,6 +81,68 @@ class ImageData(BaseElement):
                 return [f.read(plane_size) for _ in range(header.channels)]
         return data
 
+    def _get_channels(self, header, channels, rows=None):
+        start, stop = (0, header.height) if rows is None else rows
+        if self.compression not in (Compression.RAW, Compression.RLE):
+            data = self.get_data(header)
+            row_size = max((header.width * header.depth + 7) // 8, 1)
+            return [
+                data[i][start * row_size:stop * row_size] for i in channels
+            ]
+        return [
+            decompress_rows(
+                self.data, self.compression, header.width,
+                header.height * header.channels, header.depth,
+                header.version, i * header.height + start,
+                i * header.height + stop
+            ) for i in channels
+        ]
+
+    def iter_rows(self, header, band_height=256, channels=None):
+        """
+        Iterate over decompressed bands of rows.
+
+        RLE data are decoded band by band using the byte counts table, so
+        only one band of each channel is in memory at a time. ZIP data are
+        decompressed in full first.
+
+        :param header: See :py:class:`~psd_tools.psd.header.FileHeader`.
+        :param band_height: Number of rows in a band.
+        :param channels: Indices of the channels to decode. Default is all.
+        :return: iterator of (top, `list` of bytes corresponding channels).
+        """
+        channels = list(range(header.channels)) if channels is None else (
+            channels
+        )
+        height = header.height
+        row_size = max((header.width * header.depth + 7) // 8, 1)
+        if self.compression == Compression.RLE:
+            offsets = rle_row_offsets(
+                self.data, height * header.channels, header.version
+            )
+            row_size = max(header.width * header.depth // 8, 1)
+
+            def _get_rows(i, start, stop):
+                return decode_rle_rows(
+                    self.data, offsets, row_size, i * height + start,
+                    i * height + stop
+                )
+        elif self.compression == Compression.RAW:
+
+            def _get_rows(i, start, stop):
+                offset = i * height * row_size
+                return self.data[offset + start * row_size:offset +
+                                 stop * row_size]
+        else:
+            planes = self.get_data(header)
+
+            def _get_rows(i, start, stop):
+                return planes[i][start * row_size:stop * row_size]
+
+        for start in range(0, height, band_height):
+            stop = min(start + band_height, height)
+            yield start, [_get_rows(i, start, stop) for i in channels]
+
     def set_data(self, data, header):
         """
         Set raw data and compress.
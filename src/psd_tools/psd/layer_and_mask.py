@@ -8,7 +8,7 @@ import logging
 
 from psd_tools.psd.base import BaseElement, ListElement
 from psd_tools.psd.tagged_blocks import TaggedBlocks, register
-from psd_tools.compression import compress, decompress
+from psd_tools.compression import compress, decompress, decompress_rows
 from psd_tools.validators import in_, range_
 from psd_tools.constants import (
     BlendMode, Clipping, Compression, ChannelID, GlobalLayerMaskKind, Tag
@@ -867,15 +867,21 @@ class ChannelData(BaseElement):
         # written += write_padding(fp, written, 2)  # Seems no padding here.
         return written
 
-    def get_data(self, width, height, depth, version=1):
+    def get_data(self, width, height, depth, version=1, rows=None):
         """Get decompressed channel data.
 
         :param width: width.
         :param height: height.
         :param depth: bit depth of the pixel.
         :param version: psd file version.
+        :param rows: Optional (start, stop) range of rows to decode.
         :rtype: bytes
         """
+        if rows is not None:
+            return decompress_rows(
+                self.data, self.compression, width, height, depth, version,
+                rows[0], rows[1]
+            )
         return decompress(
             self.data, self.compression, width, height, depth, version
         )
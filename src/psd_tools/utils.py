@@ -6,6 +6,8 @@ import logging
 import sys
 import struct
 import array
+import threading
+from collections import OrderedDict
 
 try:
     unichr = unichr
@@ -306,3 +308,111 @@ def new_registry(attribute=None):
         return decorator
 
     return registry, register
+
+
+class LRUCache(object):
+    """
+    Least-recently-used cache with a memory budget.
+
+    Values are evicted in least-recently-used order when the total size of
+    the stored values exceeds ``max_bytes``, or the number of entries
+    exceeds ``max_items``. The size of a value is the sum of ``nbytes`` of
+    the contained arrays unless given explicitly.
+
+    :param max_bytes: memory budget in bytes, `None` for unlimited.
+    :param max_items: maximum number of entries, `None` for unlimited.
+    """
+    def __init__(self, max_bytes=None, max_items=None):
+        self.max_bytes = max_bytes
+        self.max_items = max_items
+        self._items = OrderedDict()
+        self._lock = threading.RLock()
+        self.nbytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key, default=None):
+        """Returns the value for the key and marks it recently used."""
+        with self._lock:
+            item = self._items.get(key)
+            if item is None:
+                self.misses += 1
+                return default
+            self._items.move_to_end(key)
+            self.hits += 1
+            return item[0]
+
+    def put(self, key, value, nbytes=None):
+        """Stores the value, evicting old entries to fit the budget."""
+        if nbytes is None:
+            nbytes = _sizeof(value)
+        with self._lock:
+            self.pop(key)
+            if self.max_bytes is not None and nbytes > self.max_bytes:
+                logger.debug('Value too large to cache: %d bytes' % nbytes)
+                return
+            self._items[key] = (value, nbytes)
+            self.nbytes += nbytes
+            self._evict()
+
+    def pop(self, key, default=None):
+        """Removes the key and returns its value."""
+        with self._lock:
+            item = self._items.pop(key, None)
+            if item is None:
+                return default
+            self.nbytes -= item[1]
+            return item[0]
+
+    def discard(self, condition):
+        """Removes entries whose key satisfies the condition."""
+        with self._lock:
+            for key in [key for key in self._items if condition(key)]:
+                self.pop(key)
+
+    def clear(self):
+        with self._lock:
+            self._items.clear()
+            self.nbytes = 0
+
+    @property
+    def stats(self):
+        """
+        Cache statistics.
+
+        :return: `dict` of hits, misses, evictions, items, and nbytes.
+        """
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+            'items': len(self._items),
+            'nbytes': self.nbytes,
+        }
+
+    def _evict(self):
+        while self._items and (
+            (self.max_bytes is not None and self.nbytes > self.max_bytes) or
+            (self.max_items is not None and len(self._items) > self.max_items)
+        ):
+            _, (_, nbytes) = self._items.popitem(last=False)
+            self.nbytes -= nbytes
+            self.evictions += 1
+
+    def __contains__(self, key):
+        return key in self._items
+
+    def __len__(self):
+        return len(self._items)
+
+
+def _sizeof(value):
+    """Approximate memory size of the cached value."""
+    if value is None:
+        return 0
+    if hasattr(value, 'nbytes'):
+        return int(value.nbytes)
+    if isinstance(value, (tuple, list)):
+        return sum(_sizeof(x) for x in value)
+    return sys.getsizeof(value)
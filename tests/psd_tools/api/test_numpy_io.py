@@ -1,5 +1,6 @@
 from __future__ import absolute_import, unicode_literals
 import pytest
+import gc
 import logging
 import os
 
@@ -40,3 +41,171 @@ def test_numpy_colormodes(colormode, depth):
     assert isinstance(psd.numpy(), np.ndarray)
     for layer in psd:
         assert isinstance(layer.numpy(), (np.ndarray, type(None)))
+
+
+@pytest.mark.parametrize(
+    'filename', [
+        'colormodes/4x4_8bit_cmyk.psd',
+        'colormodes/4x4_8bit_grayscale.psd',
+        'colormodes/4x4_8bit_rgba.psd',
+        '16bit5x5.psd',
+        '32bit5x5.psd',
+    ]
+)
+def test_numpy_layer_channels(filename):
+    psd = PSDImage.open(full_name(filename))
+    expected = numpy_io.EXPECTED_CHANNELS[psd.color_mode]
+    for layer in psd.descendants():
+        if layer.bbox == (0, 0, 0, 0):
+            continue
+        color = layer.numpy('color')
+        assert color.dtype == np.float32
+        assert color.shape == (layer.height, layer.width, expected)
+        assert color.min() >= 0. and color.max() <= 1.
+        if layer.has_mask() or layer.numpy('shape') is None:
+            continue
+        assert layer.numpy('shape').shape == (layer.height, layer.width, 1)
+        assert layer.numpy().shape == (layer.height, layer.width, expected + 1)
+
+
+def test_decoded_cache():
+    psd = PSDImage.open(full_name('layers/smartobject-layer.psd'))
+    layer = psd[0]
+    numpy_io.decoded_cache.clear()
+    hits = numpy_io.decoded_cache.hits
+    color = numpy_io.get_array(layer, 'color')
+    assert numpy_io.get_array(layer, 'color') is color
+    assert numpy_io.decoded_cache.hits == hits + 1
+    assert not color.flags.writeable
+
+    numpy_io.invalidate_cache(layer)
+    assert len(numpy_io.decoded_cache) == 0
+    assert numpy_io.get_array(layer, 'color') is not color
+
+
+def test_decoded_cache_nbytes():
+    psd = PSDImage.open(full_name('layers/smartobject-layer.psd'))
+    layer = psd[0]
+    numpy_io.decoded_cache.clear()
+    color = numpy_io.get_array(layer, 'color')
+    compressed = sum(len(channel.data) for channel in layer._channels)
+    assert numpy_io.decoded_cache.nbytes == color.nbytes + compressed
+
+
+def test_decoded_cache_collected():
+    psd = PSDImage.open(full_name('layers/smartobject-layer.psd'))
+    numpy_io.decoded_cache.clear()
+    numpy_io.get_array(psd[0], 'color')
+    assert len(numpy_io.decoded_cache) == 1
+    del psd
+    gc.collect()
+    other = PSDImage.open(full_name('layers/pixel-layer.psd'))
+    numpy_io.get_array(other[0], 'color')
+    assert len(numpy_io.decoded_cache) == 1
+
+
+def test_numpy_writable():
+    psd = PSDImage.open(full_name('layers/smartobject-layer.psd'))
+    layer = psd[0]
+    color = layer.numpy('color')
+    assert color.flags.writeable
+    color[:] = 0
+    assert np.any(layer.numpy('color') != 0)
+
+    native = layer.numpy('color', dtype='native', copy=False)
+    assert native is layer.numpy('color', dtype='native', copy=False)
+    assert native.dtype == np.uint8
+    assert not native.flags.writeable
+
+
+def test_decoded_cache_set_data():
+    psd = PSDImage.open(full_name('layers/smartobject-layer.psd'))
+    layer = psd[0]
+    shape = layer.numpy('shape')
+    for info, channel in zip(layer._record.channel_info, layer._channels):
+        if info.id == -1:
+            channel.set_data(
+                b'\x00' * (layer.width * layer.height), layer.width,
+                layer.height, psd.depth, psd.version
+            )
+    assert layer.numpy('shape') is not shape
+    assert np.all(layer.numpy('shape') == 0)
+
+
+@pytest.mark.parametrize('depth', [8, 16, 32])
+def test_numpy_dtype(depth):
+    filename = 'colormodes/4x4_%gbit_rgb.psd' % depth
+    psd = PSDImage.open(full_name(filename))
+    native = {8: np.uint8, 16: np.uint16, 32: np.float32}[depth]
+    scale = {8: 255., 16: 65535., 32: 1.}[depth]
+    for target in (psd, ) + tuple(psd):
+        expected = target.numpy()
+        if expected is None:
+            continue
+        values = target.numpy(dtype='native')
+        assert values.dtype == native
+        assert values.dtype.isnative
+        assert np.allclose(values / scale, expected, atol=1e-6)
+
+        values = target.numpy(dtype=np.uint8)
+        assert values.dtype == np.uint8
+        assert np.abs(values / 255. - expected).max() <= 0.5 / 255. + 1e-6
+
+
+@pytest.mark.parametrize(
+    'filename', [
+        'colormodes/4x4_8bit_cmyk.psd',
+        'colormodes/4x4_8bit_grayscale.psd',
+        '16bit5x5.psd',
+        '32bit5x5.psd',
+    ]
+)
+def test_set_layer_data(filename, tmpdir):
+    psd = PSDImage.open(full_name(filename))
+    for layer in psd.descendants():
+        data = layer.numpy()
+        if data is None:
+            continue
+        layer.set_channel_numpy(_data=1. - data)
+        assert np.allclose(layer.numpy(), 1. - data, atol=1e-4)
+        layer.set_channel_numpy('color', (data[:, :, :1] * 255).astype(np.uint8))
+
+    output = os.path.join(str(tmpdir), 'output.psd')
+    psd.save(output)
+    reloaded = PSDImage.open(output)
+    for layer, expected in zip(reloaded.descendants(), psd.descendants()):
+        if expected.numpy() is not None:
+            assert np.array_equal(layer.numpy(), expected.numpy())
+
+
+@pytest.mark.parametrize(
+    'filename', [
+        'colormodes/4x4_8bit_rgba.psd',
+        'colormodes/4x4_8bit_index_color.psd',
+        '16bit5x5.psd',
+        '32bit5x5.psd',
+    ]
+)
+def test_image_data_channels(filename):
+    psd = PSDImage.open(full_name(filename))
+    data = psd.numpy()
+    color = psd.numpy('color')
+    assert np.array_equal(color, data[:, :, :color.shape[2]])
+    if numpy_io.has_transparency(psd):
+        assert np.array_equal(psd.numpy('shape'), data[:, :, -1:])
+
+
+@pytest.mark.parametrize('dtype', [np.float32, np.uint8, np.uint16])
+def test_remove_white_background(dtype):
+    scale = 1. if dtype == np.float32 else np.iinfo(dtype).max
+    color = np.array([0.2, 0.5, 1.0], dtype=np.float32)
+    alpha = np.array([0.5, 0.0, 1.0], dtype=np.float32)
+    matted = color * alpha + (1. - alpha)
+    data = np.stack([matted, matted, matted, alpha], axis=1)[np.newaxis]
+    data = np.round(data * scale).astype(dtype)
+    expected = data.copy()
+    assert numpy_io.remove_white_background(data) is data
+    assert np.allclose(data[0, 0, :3] / scale, 0.2, atol=2. / scale)
+    assert np.array_equal(data[0, 1], expected[0, 1])
+    assert np.allclose(data[0, 2, :3] / scale, 1.0)
+    assert np.array_equal(data[:, :, 3], expected[:, :, 3])
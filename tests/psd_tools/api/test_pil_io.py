@@ -3,9 +3,11 @@ import pytest
 import logging
 import os
 
+from PIL import Image
 from psd_tools.api import pil_io
+from psd_tools.api.numpy_io import has_transparency, get_transparency_index
 from psd_tools.api.psd_image import PSDImage
-from psd_tools.constants import ColorMode
+from psd_tools.constants import ChannelID, ColorMode
 from psd_tools.psd.patterns import Pattern
 from ..utils import TEST_ROOT, full_name
 
@@ -59,3 +61,77 @@ def test_apply_icc_profile():
     no_icc = psd.topil(apply_icc=False)
     with_icc = psd.topil(apply_icc=True)
     assert no_icc.getextrema() != with_icc.getextrema()
+
+
+def test_icc_transform_cache():
+    filepath = full_name('colorprofiles/north_america_newspaper.psd')
+    psd = PSDImage.open(filepath)
+    pil_io.icc_transform_cache.clear()
+    first = psd.topil(apply_icc=True)
+    assert len(pil_io.icc_transform_cache) == 1
+    misses = pil_io.icc_transform_cache.stats['misses']
+    second = psd.topil(apply_icc=True)
+    assert pil_io.icc_transform_cache.stats['misses'] == misses
+    assert list(first.getdata()) == list(second.getdata())
+
+
+def _image_data_per_channel(psd):
+    """Previous topil() path that merges one image per channel."""
+    size = (psd.width, psd.height)
+    channels = [
+        pil_io._create_image(size, data, psd.depth)
+        for data in psd._record.image_data.get_data(psd._record.header)
+    ]
+    alpha = None
+    if has_transparency(psd):
+        alpha = channels[get_transparency_index(psd)]
+    mode = pil_io.get_pil_mode(psd.color_mode)
+    image = Image.merge(mode, channels[:pil_io.get_pil_channels(mode)])
+    image = pil_io.post_process(image, alpha, None)
+    return pil_io._remove_white_background(image)
+
+
+def _layer_per_channel(layer):
+    """Previous topil() path that merges one image per channel."""
+    channels = [
+        pil_io._get_channel(layer, info.id)
+        for info in layer._record.channel_info if info.id >= 0
+    ]
+    if any(image is None for image in channels):
+        return None
+    channels = pil_io._check_channels(channels, layer._psd.color_mode)
+    image = Image.merge(pil_io.get_pil_mode(layer._psd.color_mode), channels)
+    alpha = pil_io._get_channel(layer, ChannelID.TRANSPARENCY_MASK)
+    return pil_io.post_process(image, alpha, None)
+
+
+@pytest.mark.parametrize(
+    'filename', [
+        'colormodes/4x4_8bit_rgb.psd',
+        'colormodes/4x4_8bit_rgba.psd',
+        '16bit5x5.psd',
+        '32bit5x5.psd',
+        'colormodes/4x4_8bit_lab.psd',
+        'colormodes/4x4_16bit_lab.psd',
+        'descriptors/stroke-color-descriptors-lab.psd',
+        'colormodes/4x4_8bit_cmyk.psd',
+        'colormodes/4x4_16bit_cmyk.psd',
+        'blend-modes/cmyk-blend-modes.psd',
+    ]
+)
+def test_topil_interleaved(filename):
+    psd = PSDImage.open(full_name(filename))
+    expected = _image_data_per_channel(psd)
+    image = psd.topil()
+    assert image.mode == expected.mode
+    assert image.tobytes() == expected.tobytes()
+    for layer in psd.descendants():
+        if layer.is_group():
+            continue
+        expected = _layer_per_channel(layer)
+        image = layer.topil()
+        if expected is None:
+            assert image is None
+            continue
+        assert image.mode == expected.mode
+        assert image.tobytes() == expected.tobytes()
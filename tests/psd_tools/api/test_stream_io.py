@@ -0,0 +1,112 @@
+from __future__ import absolute_import, unicode_literals
+import pytest
+import logging
+import io
+import os
+
+import numpy as np
+from PIL import Image
+from psd_tools.api import stream_io
+from psd_tools.api.psd_image import PSDImage
+from psd_tools.composite import composite
+from psd_tools.constants import ColorMode
+
+from ..utils import full_name
+
+logger = logging.getLogger(__name__)
+
+
+@pytest.mark.parametrize('format', ['png', 'tiff'])
+@pytest.mark.parametrize('channels, bit_depth', [(1, 8), (3, 8), (4, 16)])
+def test_writers(format, channels, bit_depth):
+    dtype = np.uint8 if bit_depth == 8 else np.uint16
+    data = np.random.randint(
+        0, np.iinfo(dtype).max, (13, 7, channels)
+    ).astype(dtype)
+    with io.BytesIO() as f:
+        writer = stream_io.WRITERS[format](f, 7, 13, channels, bit_depth)
+        for y in range(0, 13, 5):
+            writer.write(data[y:y + 5])
+        writer.close()
+        f.seek(0)
+        image = Image.open(f)
+        image.load()
+    assert image.size == (7, 13)
+    if bit_depth == 8:
+        values = np.asarray(image)
+        if channels == 1:
+            values = values[:, :, np.newaxis]
+        assert np.array_equal(values, data)
+
+
+def test_writer_rows():
+    with io.BytesIO() as f:
+        writer = stream_io.PNGWriter(f, 2, 2, 3)
+        with pytest.raises(ValueError):
+            writer.write(np.zeros((1, 3, 3), dtype=np.uint8))
+        writer.write(np.zeros((1, 2, 3), dtype=np.uint8))
+        with pytest.raises(ValueError):
+            writer.close()
+
+
+@pytest.mark.parametrize('format', ['png', 'tiff'])
+@pytest.mark.parametrize(
+    'filename', [
+        'clipping-mask.psd',
+        'transparency/transparency-group.psd',
+        'colormodes/4x4_8bit_grayscale.psd',
+    ]
+)
+def test_composite_to(filename, format, tmpdir):
+    psd = PSDImage.open(full_name(filename))
+    output = os.path.join(str(tmpdir), 'output.' + format)
+    psd.composite_to(output, format=format, band_height=3)
+    color, _, alpha = composite(psd)
+    expected = np.concatenate([color, alpha], axis=2)
+    values = np.asarray(Image.open(output)) / 255.
+    if values.ndim == 2:
+        values = values[:, :, np.newaxis]
+    assert values.shape[2] == (2 if color.shape[2] == 1 else 4)
+    if expected.shape[2] == values.shape[2]:
+        assert np.abs(values - expected).max() <= .5 / 255. + 1e-4
+
+
+@pytest.mark.parametrize(
+    'filename', [
+        'colormodes/4x4_8bit_rgba.psd',
+        'colormodes/4x4_16bit_rgb.psd',
+        'colormodes/4x4_8bit_cmyk.psd',
+        'colormodes/4x4_8bit_index_color.psd',
+        '16bit5x5.psd',
+        'clipping-mask.psd',
+    ]
+)
+def test_iter_preview_rows(filename):
+    psd = PSDImage.open(full_name(filename))
+    rows = list(psd.iter_preview_rows(band=3))
+    assert len(rows) == (psd.height + 2) // 3
+    assert np.array_equal(np.concatenate(rows), psd.numpy())
+
+
+@pytest.mark.parametrize('format', ['png', 'tiff'])
+@pytest.mark.parametrize(
+    'filename', [
+        'colormodes/4x4_8bit_rgba.psd',
+        'colormodes/4x4_8bit_cmyk.psd',
+        'colormodes/4x4_8bit_grayscale.psd',
+        'colormodes/4x4_8bit_index_color.psd',
+        'clipping-mask.psd',
+    ]
+)
+def test_export_preview(filename, format, tmpdir):
+    psd = PSDImage.open(full_name(filename))
+    output = os.path.join(str(tmpdir), 'output.' + format)
+    stream_io.export_preview(psd, output, format=format, band_height=3)
+    image = Image.open(output)
+    assert image.size == psd.size
+    if psd.color_mode in (ColorMode.RGB, ColorMode.GRAYSCALE):
+        expected = psd.topil()
+        assert image.mode == expected.mode
+        assert np.abs(
+            np.asarray(image, dtype=int) - np.asarray(expected, dtype=int)
+        ).max() <= 1
@@ -0,0 +1,169 @@
+from __future__ import absolute_import, unicode_literals
+import pytest
+
+import numpy as np
+from psd_tools.api.psd_image import PSDImage
+from psd_tools.composite import composite
+from psd_tools.composite.adjustments import (
+    LUT_SIZE, ColorLUT, ToneLUT, _parse_cube, get_adjustment_lut,
+    get_color_lut, get_tone_lut
+)
+
+from .test_composite import check_composite_quality
+from ..utils import full_name
+
+
+@pytest.fixture(scope='module')
+def adjustments():
+    psd = PSDImage.open(full_name('fill_adjustments.psd'))
+    return {layer.kind: layer for layer in psd.descendants()}
+
+
+def test_invert(adjustments):
+    lut = get_tone_lut(adjustments['invert'], 3)
+    color = np.random.RandomState(0).rand(8, 8, 3)
+    assert np.allclose(lut.apply(color), 1. - color, atol=1. / LUT_SIZE)
+
+
+def test_posterize(adjustments):
+    layer = adjustments['posterize']
+    lut = get_tone_lut(layer, 3)
+    gray = np.repeat(np.linspace(0., 1., 256).reshape(1, -1, 1), 3, axis=2)
+    levels = np.unique(lut.apply(gray))
+    assert len(levels) == layer.posterize
+
+
+def test_threshold(adjustments):
+    lut = get_tone_lut(adjustments['threshold'], 3)
+    result = lut.apply(np.array([[[0., 0., 0.], [1., 1., 1.]]]))
+    assert np.array_equal(result, [[[0., 0., 0.], [1., 1., 1.]]])
+
+
+@pytest.mark.parametrize('kind', [
+    'brightnesscontrast', 'levels', 'curves', 'exposure', 'gradientmap'
+])
+def test_tone_lut(adjustments, kind):
+    lut = get_tone_lut(adjustments[kind], 3)
+    result = lut.apply(np.random.RandomState(0).rand(8, 8, 3))
+    assert result.shape == (8, 8, 3)
+    assert result.dtype == np.float32
+    assert np.all((result >= 0.) & (result <= 1.))
+
+
+def test_tone_lut_unsupported(adjustments):
+    assert get_tone_lut(adjustments['huesaturation'], 3) is None
+    assert get_color_lut(adjustments['levels'], 3) is None
+    assert get_adjustment_lut(adjustments['vibrance'], 3) is None
+
+
+@pytest.mark.parametrize('kind', [
+    'blackandwhite', 'channelmixer', 'colorbalance', 'huesaturation',
+    'photofilter', 'selectivecolor'
+])
+def test_color_lut(adjustments, kind):
+    lut = get_adjustment_lut(adjustments[kind], 3)
+    assert isinstance(lut, ColorLUT)
+    result = lut.apply(np.random.RandomState(0).rand(8, 8, 3))
+    assert result.shape == (8, 8, 3)
+    assert result.dtype == np.float32
+    assert np.all((result >= 0.) & (result <= 1.))
+
+
+def test_color_lut_identity(adjustments):
+    # The channel mixer of the file keeps every channel as is.
+    lut = get_color_lut(adjustments['channelmixer'], 3)
+    color = np.random.RandomState(0).rand(8, 8, 3)
+    assert np.allclose(lut.apply(color), color, atol=1e-5)
+
+    black_and_white = get_color_lut(adjustments['blackandwhite'], 3)
+    gray = black_and_white.apply(color)
+    assert np.allclose(gray, gray[:, :, :1], atol=1e-5)
+
+
+def test_color_lut_fusion(adjustments):
+    color = np.random.RandomState(0).rand(16, 16, 3)
+    luts = [
+        get_adjustment_lut(adjustments[kind], 3) for kind in (
+            'levels', 'huesaturation', 'curves', 'photofilter',
+            'colorbalance', 'invert'
+        )
+    ]
+    expected = color
+    fused = ToneLUT()
+    for lut in luts:
+        expected = lut.apply(expected)
+        fused = fused.then(lut)
+    assert isinstance(fused, ColorLUT)
+    assert np.allclose(fused.apply(color), expected, atol=2e-2)
+
+
+def test_parse_cube():
+    lines = ['TITLE "swap"', 'LUT_3D_SIZE 2']
+    for b in (0, 1):
+        for g in (0, 1):
+            for r in (0, 1):
+                lines.append('%d %d %d' % (b, g, r))
+    cube = _parse_cube('\n'.join(lines).encode('ascii'))
+    assert cube.shape == (2, 2, 2, 3)
+    assert np.array_equal(cube[1, 0, 0], [0, 0, 1])
+    assert np.array_equal(cube[0, 1, 1], [1, 1, 0])
+
+    with pytest.raises(ValueError):
+        _parse_cube(b'LUT_3D_SIZE 3\n0 0 0\n')
+    with pytest.raises(ValueError):
+        _parse_cube(b'LUT_3D_SIZE two\n')
+
+
+def test_color_lookup_invalid():
+    psd = PSDImage.open(full_name('fill_adjustments.psd'))
+    layer = next(x for x in psd.descendants() if x.kind == 'colorlookup')
+    layer._data[b'LUTFormat'] = 'LUTFormatCUBE'
+    layer._data[b'LUT3DFileData'] = b'LUT_3D_SIZE 3\n0 0 0\n'
+    assert get_color_lut(layer, 3) is None
+    composite(psd)
+
+
+def test_tone_lut_fusion(adjustments):
+    color = np.random.RandomState(0).rand(16, 16, 3)
+    luts = [
+        get_tone_lut(adjustments[kind], 3)
+        for kind in ('levels', 'invert', 'gradientmap', 'curves')
+    ]
+    expected = color
+    fused = ToneLUT()
+    for lut in luts:
+        expected = lut.apply(expected)
+        fused = fused.then(lut)
+    assert np.allclose(fused.apply(color), expected, atol=2e-2)
+
+
+@pytest.mark.parametrize('filename', [
+    'adjustment-mask.psd',
+    'clip-adjustment.psd',
+    'clipping-mask2.psd',
+    'fill_adjustments.psd',
+])
+def test_composite_adjustments(filename):
+    check_composite_quality(filename, 0.025, force=True)
+
+
+def test_adjustment_in_pass_through_group():
+    psd = PSDImage.open(full_name('clipping-mask2.psd'))
+    group = psd[3]
+    group.visible = True
+    layer = group[0]
+    adjustment = layer.clip_layers[0]
+    layer._clip_layers = []
+    group._layers.append(adjustment)
+    adjustment._parent = group
+    expected = composite(psd)[0]
+
+    # The same adjustment at the root.
+    group._layers.remove(adjustment)
+    psd._layers.append(adjustment)
+    adjustment._parent = psd
+    result = composite(psd)[0]
+    assert np.allclose(result, expected, atol=1e-6)
+
+    adjustment.visible = False
+    assert not np.allclose(composite(psd)[0], expected, atol=1e-2)
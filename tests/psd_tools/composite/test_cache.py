@@ -0,0 +1,116 @@
+from __future__ import absolute_import, unicode_literals
+import pytest
+import logging
+
+import numpy as np
+from psd_tools.api.psd_image import PSDImage
+from psd_tools.composite import composite, CompositeCache
+from psd_tools.composite.cache import get_state
+from psd_tools.terminology import Key
+
+from ..utils import full_name
+
+logger = logging.getLogger(__name__)
+
+
+@pytest.mark.parametrize(("filename", ), [
+    ('transparency/knockout-isolated-groups.psd', ),
+    ('transparency/transparency-group.psd', ),
+    ('masks.psd', ),
+])
+def test_composite_cache(filename):
+    psd = PSDImage.open(full_name(filename))
+    cache = CompositeCache()
+    reference = composite(psd)
+    assert all(
+        np.array_equal(x, y)
+        for x, y in zip(reference, composite(psd, cache=cache))
+    )
+    misses = cache.stats['misses']
+    assert misses > 0
+    assert all(
+        np.array_equal(x, y)
+        for x, y in zip(reference, composite(psd, cache=cache))
+    )
+    assert cache.stats['misses'] == misses
+    assert cache.stats['hits'] > 0
+
+
+def test_composite_cache_invalidation():
+    psd = PSDImage.open(full_name('transparency/transparency-group.psd'))
+    cache = CompositeCache()
+    composite(psd, cache=cache)
+    for layer in psd.descendants():
+        if not layer.is_group():
+            layer.opacity = 100
+    reference = composite(psd)
+    result = composite(psd, cache=cache)
+    assert all(np.array_equal(x, y) for x, y in zip(reference, result))
+
+
+def test_composite_cache_descriptors():
+    psd = PSDImage.open(full_name('layers/solid-color-fill.psd'))
+    cache = CompositeCache()
+    composite(psd, cache=cache)
+    color = psd[0].data
+    color[Key.Red], color[Key.Blue] = color[Key.Blue], color[Key.Red]
+    reference = composite(psd)
+    result = composite(psd, cache=cache)
+    assert all(np.array_equal(x, y) for x, y in zip(reference, result))
+
+    psd = PSDImage.open(full_name('layer_effects.psd'))
+    layer = next(x for x in psd if x.name == 'Drop Shadow')
+    state = get_state(layer)
+    effect = list(layer.effects)[0]
+    effect.value[Key.Distance].value += 10.
+    assert get_state(layer) != state
+
+
+def test_composite_cache_states(monkeypatch):
+    from psd_tools.composite import cache as cache_module
+    # Each layer state is computed once per render.
+    psd = PSDImage.open(full_name('transparency/knockout-isolated-groups.psd'))
+    calls = []
+    original = cache_module.get_state
+
+    def get_state(layer):
+        calls.append(id(layer))
+        return original(layer)
+
+    monkeypatch.setattr(cache_module, 'get_state', get_state)
+    composite(psd, cache=CompositeCache())
+    assert calls
+    assert len(calls) == len(set(calls))
+
+
+def test_composite_cache_sources():
+    # Decoded pixels and masks are only kept in the decoded array cache.
+    psd = PSDImage.open(full_name('masks.psd'))
+    cache = CompositeCache()
+    composite(psd, force=True, cache=cache)
+    kinds = set(key[1] for key in cache._items._items if key[0] == 'source')
+    assert kinds
+    assert not kinds & {'pixels', 'mask'}
+
+
+def test_composite_cache_budget():
+    psd = PSDImage.open(full_name('transparency/transparency-group.psd'))
+    cache = CompositeCache(max_bytes=1)
+    composite(psd, cache=cache)
+    assert cache.stats['items'] == 0
+
+
+def test_composite_many():
+    psd = PSDImage.open(full_name('transparency/transparency-group.psd'))
+    layer_filters = [
+        lambda x: x.is_visible(),
+        lambda x: x.is_visible() and x is not psd[0],
+        lambda x: x.is_visible() and x is not psd[1],
+    ]
+    cache = CompositeCache()
+    images = psd.composite_many(layer_filters, cache=cache)
+    assert len(images) == len(layer_filters)
+    assert cache.stats['hits'] > 0
+    for image, layer_filter in zip(images, layer_filters):
+        reference = psd.composite(layer_filter=layer_filter)
+        assert np.array_equal(np.asarray(image), np.asarray(reference))
@@ -0,0 +1,102 @@
+from __future__ import absolute_import, unicode_literals
+import pytest
+import logging
+
+import numpy as np
+from psd_tools.api.psd_image import PSDImage
+from psd_tools.composite import composite
+from psd_tools.composite.color import (
+    convert_to_rgb, cmyk_to_rgb, lab_to_rgb, icc_lut_cache, LUT_SIZE
+)
+from psd_tools.constants import Resource
+
+from ..utils import full_name
+
+logger = logging.getLogger(__name__)
+
+
+def test_lab_to_rgb():
+    neutral = 128. / 255.
+    color = np.array([[[1., neutral, neutral], [0., neutral, neutral],
+                       [.5, neutral, neutral]]],
+                     dtype=np.float32)
+    rgb = lab_to_rgb(color)
+    assert np.allclose(rgb[0, 0], 1., atol=1e-3)
+    assert np.allclose(rgb[0, 1], 0., atol=1e-3)
+    assert np.allclose(rgb[0, 2], 119. / 255., atol=2e-3)
+
+
+def test_cmyk_to_rgb():
+    # Composited CMYK is inverted: 1.0 means no ink.
+    color = np.array([[[1., 1., 1., 1.], [0., 1., 1., 1.], [1., 1., 1., 0.]]],
+                     dtype=np.float32)
+    rgb = cmyk_to_rgb(color)
+    assert np.array_equal(rgb[0], [[1., 1., 1.], [0., 1., 1.], [0., 0., 0.]])
+
+
+@pytest.mark.parametrize(
+    'filename', [
+        'colormodes/4x4_8bit_cmyk.psd',
+        'colormodes/4x4_8bit_grayscale.psd',
+        'colormodes/4x4_8bit_lab.psd',
+        'colormodes/4x4_8bit_rgb.psd',
+    ]
+)
+def test_convert_to_rgb(filename):
+    psd = PSDImage.open(full_name(filename))
+    color, _, _ = composite(psd)
+    rgb = convert_to_rgb(color, psd.color_mode)
+    assert rgb.shape == color.shape[:2] + (3, )
+    assert rgb.dtype == np.float32
+    values = convert_to_rgb(
+        (color * 255).round().astype(np.uint8), psd.color_mode
+    )
+    assert values.dtype == np.uint8
+
+
+@pytest.mark.parametrize(
+    'filename', [
+        'colorprofiles/north_america_newspaper.psd',
+        'colormodes/4x4_8bit_cmyk.psd',
+    ]
+)
+def test_convert_to_rgb_icc(filename):
+    psd = PSDImage.open(full_name(filename))
+    icc = psd.image_resources.get_data(Resource.ICC_PROFILE)
+    icc_lut_cache.clear()
+    rgb = convert_to_rgb(psd.numpy('color'), psd.color_mode, icc)
+    assert len(icc_lut_cache) == 1
+    expected = np.asarray(psd.topil(apply_icc=True).convert('RGB')) / 255.
+    assert np.abs(rgb - expected).max() < 0.005
+
+
+@pytest.mark.parametrize(
+    'filename, mode', [
+        ('colorprofiles/north_america_newspaper.psd', 'RGB'),
+        ('colormodes/4x4_8bit_cmyk.psd', 'CMYK'),
+    ]
+)
+def test_icc_lut_nodes(filename, mode):
+    # Grid nodes are exact 8-bit values, so nodes convert without error.
+    from PIL import Image, ImageCms
+    from psd_tools.api.pil_io import get_icc_transform
+    assert all(255 % (size - 1) == 0 for size in LUT_SIZE.values())
+    psd = PSDImage.open(full_name(filename))
+    icc = psd.image_resources.get_data(Resource.ICC_PROFILE)
+    channels = len(mode)
+    values = np.arange(
+        0, 256, 255 // (LUT_SIZE[channels] - 1), dtype=np.uint8
+    )
+    color = np.stack([np.roll(values, 3 * i) for i in range(channels)],
+                     axis=-1)[np.newaxis]
+    rgb = convert_to_rgb(color / 255., psd.color_mode, icc)
+
+    if mode == 'CMYK':
+        color = 255 - color  # Composited CMYK is inverted.
+    color = np.ascontiguousarray(color)
+    image = Image.frombuffer(
+        mode, (color.shape[1], 1), color, 'raw', mode, 0, 1
+    )
+    transform = get_icc_transform(icc, mode, 'RGB')
+    expected = np.asarray(ImageCms.applyTransform(image, transform)) / 255.
+    assert np.allclose(rgb, expected, atol=1e-6)
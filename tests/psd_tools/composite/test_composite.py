@@ -141,6 +141,80 @@ def test_composite_viewport():
     assert composite(psd[0], viewport=bbox)[1].shape == shape
 
 
+@pytest.mark.parametrize(
+    'filename', [
+        '0layers.psd',
+        '0layers.psb',
+        'colormodes/4x4_1bit_bitmap.psd',
+        'colormodes/4x4_8bit_index_color.psd',
+    ]
+)
+def test_composite_viewport_without_layers(filename):
+    psd = PSDImage.open(full_name(filename))
+    color, shape, _ = composite(psd)
+    top, bottom = psd.height // 3, 2 * psd.height // 3
+    band = composite(psd, viewport=(0, top, psd.width, bottom))
+    assert np.array_equal(band[0], color[top:bottom])
+    assert np.array_equal(band[1], shape[top:bottom])
+
+    viewport = (-1, -1, psd.width + 1, bottom)
+    outside = composite(psd, viewport=viewport)
+    assert outside[0].shape == (bottom + 1, psd.width + 2, color.shape[2])
+    assert np.array_equal(outside[0][1:, 1:-1], color[:bottom])
+    assert np.all(outside[1][0] == 0)
+
+
+@pytest.mark.parametrize('filename', [
+    'mask.psd',
+    'layer_mask_data.psd',
+    'gradient-fill.psd',
+    'layers/gradient-fill.psd',
+    'layers/pattern-fill.psd',
+])
+def test_composite_band_sources(filename, monkeypatch):
+    # Masks and fills are decoded and drawn for the band only.
+    import psd_tools.composite
+    psd = PSDImage.open(full_name(filename))
+    expected = composite(psd, force=True)
+    top = psd.height // 3
+    bottom = top + psd.height // 8
+    sizes = []
+    get_array = psd_tools.composite.get_array
+    create_fill = psd_tools.composite.create_fill
+
+    def _get_array(layer, channel, **kwargs):
+        result = get_array(layer, channel, **kwargs)
+        if channel == 'mask' and result is not None:
+            sizes.append(result.shape[0])
+        return result
+
+    def _create_fill(layer, viewport, region=None):
+        result = create_fill(layer, viewport, region)
+        sizes.append(region[3] - region[1])
+        return result
+
+    monkeypatch.setattr(psd_tools.composite, 'get_array', _get_array)
+    monkeypatch.setattr(psd_tools.composite, 'create_fill', _create_fill)
+    result = composite(
+        psd, force=True, viewport=(0, top, psd.width, bottom)
+    )
+    for x, y in zip(expected, result):
+        assert np.allclose(x[top:bottom], y, atol=1e-6)
+    assert sizes
+    assert max(sizes) <= bottom - top
+
+
+def test_composite_effects_with_clip_layers():
+    # Effects reaching beyond the viewport composite the clip layers again.
+    psd = PSDImage.open(full_name('advanced-blending.psd'))
+    color, shape, alpha = composite(psd)
+    assert color.shape == (psd.height, psd.width, 3)
+    bbox = (0, 100, psd.width, 200)
+    assert np.allclose(
+        composite(psd, viewport=bbox)[0], color[100:200], atol=1e-6
+    )
+
+
 @pytest.mark.parametrize(
     'colormode, depth, mode, ignore_preview, apply_icc', [
         ('bitmap', 1, '1', False, False),
@@ -228,3 +302,21 @@ def test_composite_pixel_layer_with_vector_stroke():
     reference = composite(psd, force=True)
     result = composite(psd)
     assert _mse(reference[0], result[0]) <= 0.01
+
+
+@pytest.mark.parametrize('dtype', [np.uint8, np.uint16])
+def test_composite_dtype(dtype):
+    psd = PSDImage.open(full_name('transparency/transparency-group.psd'))
+    scale = np.iinfo(dtype).max
+    reference = composite(psd)
+    for x, y in zip(reference, composite(psd, dtype=dtype)):
+        assert y.dtype == dtype
+        assert np.abs(x * scale - y).max() <= .5 + 1e-3 * scale / 255.
+
+
+def test_composite_dither():
+    psd = PSDImage.open(full_name('transparency/transparency-group.psd'))
+    color, _, _ = composite(psd)
+    dithered, _, _ = composite(psd, dtype=np.uint8, dither=True)
+    assert np.abs(dithered / 255. - color).max() <= 1. / 255.
+    assert abs(dithered.mean() / 255. - color.mean()) < 1. / 255.
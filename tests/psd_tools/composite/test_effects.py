@@ -1,6 +1,15 @@
 import pytest
 import logging
+import numpy as np
 
+from psd_tools import PSDImage
+from psd_tools.composite import composite
+from psd_tools.composite.effects import (
+    draw_stroke_effect, draw_shadow_effect, get_stroke_effect_size,
+    get_blur_effect_size, get_effect_margin, _gaussian_blur
+)
+
+from ..utils import full_name
 from .test_composite import check_composite_quality
 
 logger = logging.getLogger(__name__)
@@ -22,3 +31,89 @@ def test_stroke_effects_xfail(filename):
 ])
 def test_effects_disabled(filename):
     check_composite_quality(filename, threshold=0.01)
+
+
+@pytest.mark.parametrize(('name', 'expected'), [
+    ('Raster OutsetFrame', (3, 0)),
+    ('Raster InsetFrame', (0, 3)),
+    ('Raster CenterFrame', (1.5, 1.5)),
+])
+def test_draw_stroke_effect_width(name, expected):
+    psd = PSDImage.open(full_name('effects/stroke-effects.psd'))
+    layer = next(x for x in psd.descendants() if x.name == name)
+    desc = list(layer.effects.find('stroke'))[0].value
+    viewport = (0, 0, 32, 32)
+    shape = np.zeros((32, 32, 1), dtype=np.float32)
+    shape[8:24, 8:24] = 1.
+    color, mask = draw_stroke_effect(viewport, shape, desc, psd)
+    assert mask.shape == (32, 32, 1)
+    row = mask[16, :, 0]
+    assert row[:8].sum() == pytest.approx(expected[0])
+    assert row[8:16].sum() == pytest.approx(expected[1])
+    assert get_stroke_effect_size(layer) == int(np.ceil(max(expected))) + 1
+
+
+@pytest.mark.parametrize(('filename', 'top'), [
+    ('effects/stroke-effects.psd', 140),
+    ('layer_params.psd', 120),
+])
+def test_stroke_effect_viewport(filename, top):
+    # Gradient and pattern strokes do not move with the viewport.
+    psd = PSDImage.open(full_name(filename))
+    expected = composite(psd, force=True)[0][top:]
+    viewport = (0, top, psd.width, psd.height)
+    color = composite(psd, force=True, viewport=viewport)[0]
+    assert np.allclose(color, expected, atol=1e-6)
+
+
+@pytest.mark.parametrize(("filename", ), [
+    ('layer_effects.psd', ),
+    ('layer_params.psd', ),
+    ('layer_comps.psd', ),
+])
+def test_shadow_glow_effects(filename):
+    check_composite_quality(filename, threshold=0.005)
+
+
+def test_draw_shadow_effect():
+    psd = PSDImage.open(full_name('layer_effects.psd'))
+    layer = next(x for x in psd.descendants() if x.name == 'Drop Shadow')
+    effect = list(layer.effects.find('dropshadow'))[0]
+    viewport = (0, 0, 160, 160)
+    shape = np.zeros((160, 160, 1), dtype=np.float32)
+    shape[60:100, 60:100] = 1.
+    color, mask = draw_shadow_effect(viewport, shape, effect)
+    assert mask.shape == (160, 160, 1)
+    assert color.shape[:2] == (160, 160)
+    # The light comes from the top at 90 degrees, so the shadow falls down.
+    rows = mask[:, 80, 0]
+    assert np.argmax(rows) == pytest.approx(80 + effect.distance, abs=1)
+    assert mask.sum() == pytest.approx(40 * 40, rel=1e-2)
+    assert get_blur_effect_size(layer) == int(
+        np.ceil(effect.size + effect.distance)
+    ) + 1
+
+
+@pytest.mark.parametrize(("filename", ), [
+    ('effects/stroke-effects.psd', ),
+    ('layer_effects.psd', ),
+    ('stroke.psd', ),
+])
+def test_get_effect_margin(filename):
+    psd = PSDImage.open(full_name(filename))
+    for layer in psd.descendants():
+        margin = get_effect_margin(layer)
+        assert margin >= get_stroke_effect_size(layer)
+        assert margin >= get_blur_effect_size(layer)
+        if layer.has_stroke() and layer.stroke.enabled:
+            assert margin > layer.stroke.line_width
+
+
+@pytest.mark.parametrize('sigma', [0.8, 3., 12.5])
+def test_gaussian_blur(sigma):
+    values = np.zeros((101, 101), dtype=np.float32)
+    values[50, 50] = 1.
+    result = _gaussian_blur(values, sigma)
+    assert result.sum() == pytest.approx(1.)
+    variance = np.sum(result[50] * (np.arange(101) - 50.)**2) / result[50].sum()
+    assert variance == pytest.approx(sigma * sigma, rel=.15)
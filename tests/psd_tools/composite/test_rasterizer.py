@@ -0,0 +1,88 @@
+from __future__ import absolute_import, unicode_literals
+import pytest
+
+import numpy as np
+
+from psd_tools.composite.rasterizer import (
+    fill, flatten_curves, get_curves, stroke
+)
+from psd_tools.psd.vector import ClosedPath, Knot, OpenPath
+
+SQUARE = np.array([[2.5, 2.5], [7.5, 2.5], [7.5, 7.5], [2.5, 7.5]])
+
+
+@pytest.mark.parametrize('points', [SQUARE, SQUARE[::-1]])
+def test_fill_square(points):
+    coverage = fill([points], 10, 10)
+    assert coverage.dtype == np.float32
+    assert coverage.sum() == pytest.approx(25.)
+    assert coverage[2, 2] == pytest.approx(.25)
+    assert coverage[2, 4] == pytest.approx(.5)
+    assert coverage[5, 5] == 1.
+    assert coverage[0, 0] == 0.
+
+
+def test_fill_outside():
+    points = np.array([[-5., -5.], [15., -5.], [15., 15.], [-5., 15.]])
+    assert np.all(fill([points], 10, 10) == 1.)
+    assert np.all(fill([points + 20.], 10, 10) == 0.)
+
+
+def test_fill_circle():
+    theta = np.linspace(0., 2 * np.pi, 256, endpoint=False)
+    points = np.stack([16 + 10 * np.cos(theta), 16 + 10 * np.sin(theta)], 1)
+    coverage = fill([points], 32, 32)
+    assert coverage.sum() == pytest.approx(np.pi * 100., rel=1e-3)
+
+
+def test_fill_rules():
+    # Pentagram, the center has the winding number of 2.
+    theta = np.pi / 2 + np.arange(5) * 4 * np.pi / 5
+    points = np.stack([16 + 15 * np.cos(theta), 16 - 15 * np.sin(theta)], 1)
+    nonzero = fill([points], 32, 32, 'nonzero')
+    evenodd = fill([points], 32, 32, 'evenodd')
+    assert nonzero[16, 16] == 1.
+    assert evenodd[16, 16] == 0.
+    assert nonzero[3, 16] == evenodd[3, 16]
+
+    with pytest.raises(ValueError):
+        fill([points], 32, 32, 'unknown')
+
+
+def test_stroke():
+    points = np.array([[2., 2.], [8., 2.], [8., 8.], [2., 8.]])
+    closed = stroke([points], 2., 10, 10, closed=[True])
+    assert closed.sum() == pytest.approx(8 * 8 - 4 * 4)
+    assert closed[1, 1] == 1.  # Miter join.
+    assert closed[5, 5] == 0.
+
+    opened = stroke([points], 2., 10, 10, closed=[False])
+    assert opened.sum() == pytest.approx(36.)
+
+    bevel = stroke([points], 2., 10, 10, closed=[True], miter_limit=1.)
+    assert bevel[1, 1] == pytest.approx(.5)
+
+
+def test_flatten_curves():
+    k = 4. / 3. * (np.sqrt(2.) - 1.)
+    curves = np.array([[[10., 0.], [10., 10. * k], [10. * k, 10.], [0., 10.]]])
+    points = flatten_curves(curves)
+    assert len(points) > 2
+    assert np.allclose(np.hypot(points[:, 0], points[:, 1]), 10., atol=.01)
+    assert np.array_equal(points[[0, -1]], curves[0, [0, 3]])
+
+    line = np.array([[[0., 0.], [1., 1.], [2., 2.], [3., 3.]]])
+    assert flatten_curves(line).shape == (2, 2)
+    assert flatten_curves(np.zeros((0, 4, 2))).shape == (0, 2)
+
+
+@pytest.mark.parametrize('kls, count', [(ClosedPath, 3), (OpenPath, 2)])
+def test_get_curves(kls, count):
+    anchors = [(.1, .2), (.1, .8), (.9, .5)]
+    path = kls(
+        items=[Knot(preceding=a, anchor=a, leaving=a) for a in anchors]
+    )
+    curves = get_curves(path, 10, 20, offset=(1, 2))
+    assert curves.shape == (count, 4, 2)
+    assert np.allclose(curves[0], [[1., 0.], [1., 0.], [7., 0.], [7., 0.]])
+    assert get_curves(kls(items=[]), 10, 20).shape == (0, 4, 2)
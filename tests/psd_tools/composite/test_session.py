@@ -0,0 +1,82 @@
+from __future__ import absolute_import, unicode_literals
+import pytest
+import logging
+
+import numpy as np
+from psd_tools.api.psd_image import PSDImage
+from psd_tools.composite import composite, CompositeSession
+
+from ..utils import full_name
+
+logger = logging.getLogger(__name__)
+
+
+@pytest.mark.parametrize(("filename", ), [
+    ('hidden-groups.psd', ),
+    ('masks.psd', ),
+    ('transparency/transparency-group.psd', ),
+    ('advanced-blending.psd', ),
+    ('fill_adjustments.psd', ),
+])
+def test_session_update(filename):
+    psd = PSDImage.open(full_name(filename))
+    session = CompositeSession(psd)
+    reference = composite(psd)
+    result = session.update()
+    for x, y in zip(reference, result):
+        assert np.allclose(x, y)
+
+    for layer in psd.descendants():
+        if layer.kind == 'pixel':
+            layer.move((5, 3))
+        layer.opacity = 128
+    layer.visible = not layer.visible
+
+    reference = composite(psd)
+    result = session.update()
+    for x, y in zip(reference, result):
+        assert np.allclose(x, y)
+
+
+def test_session_invalidate():
+    psd = PSDImage.open(full_name('clipping-mask.psd'))
+    session = CompositeSession(psd)
+    session.update()
+    session.invalidate((0, 0, 10, 10))
+    session.invalidate((5, 5, 20, 20))
+    session.invalidate((-10, -10, -5, -5))
+    assert len(session._dirty) == 2
+    color, _, _ = session.update()
+    assert not session._dirty
+    assert np.allclose(color, composite(psd)[0])
+
+
+def test_session_adjustments():
+    psd = PSDImage.open(full_name('fill_adjustments.psd'))
+    session = CompositeSession(psd)
+    session.update()
+    layers = {layer.kind: layer for layer in psd.descendants()}
+    layers['invert'].visible = True
+    layers['exposure'].visible = False
+    color, _, _ = session.update()
+    assert np.allclose(color, composite(psd)[0])
+
+    # Parameters edited in place.
+    layers['levels'].data[0].gamma = 150
+    color, _, _ = session.update()
+    assert np.allclose(color, composite(psd)[0])
+
+
+def test_session_group_bbox():
+    # Moving a child resizes the group, which clips the effects of others.
+    psd = PSDImage.open(full_name('effects/stroke-effects.psd'))
+    session = CompositeSession(psd)
+    session.update()
+    layer = next(
+        layer for layer in psd.descendants()
+        if layer.name == 'Raster Rectangle'
+    )
+    layer.move((7, 4))
+    result = session.update()
+    for x, y in zip(composite(psd), result):
+        assert np.allclose(x, y)
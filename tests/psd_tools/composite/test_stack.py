@@ -0,0 +1,71 @@
+from __future__ import absolute_import, unicode_literals
+import pytest
+import logging
+
+import numpy as np
+from psd_tools.api.psd_image import PSDImage
+from psd_tools.composite import composite, PrefixStack
+
+from ..utils import full_name
+
+logger = logging.getLogger(__name__)
+
+
+def _allclose(reference, result):
+    return all(
+        np.allclose(x, y, rtol=0., atol=1e-6)
+        for x, y in zip(reference, result)
+    )
+
+
+@pytest.mark.parametrize(("filename", ), [
+    ('hidden-groups.psd', ),
+    ('transparency/transparency-group.psd', ),
+    ('fill_adjustments.psd', ),
+    ('layer_effects.psd', ),
+    ('masks.psd', ),
+])
+def test_prefix_stack_toggle(filename):
+    psd = PSDImage.open(full_name(filename))
+    stack = PrefixStack(psd)
+    assert len(stack) == len(psd)
+    assert _allclose(composite(psd), stack.composite())
+    for index, layer in enumerate(psd):
+        visible = layer.is_visible()
+
+        def layer_filter(x):
+            return (not visible) if x is layer else x.is_visible()
+
+        reference = composite(psd, layer_filter=layer_filter)
+        assert _allclose(reference, stack.toggle(index))
+
+
+def test_prefix_stack_opaque_layer():
+    # Pixels without transparency cover the viewport outside the bbox.
+    psd = PSDImage.open(full_name('clipping-mask.psd'))
+    psd[0].move((7, 4))
+    stack = PrefixStack(psd)
+    reference = composite(psd, layer_filter=lambda x: (
+        x is not psd[0] and x.is_visible()
+    ))
+    assert _allclose(reference, stack.toggle(0))
+
+
+def test_prefix_stack_replace():
+    psd = PSDImage.open(full_name('transparency/transparency-group.psd'))
+    stack = PrefixStack(psd)
+    reference = composite(psd, layer_filter=lambda x: x is not psd[0])
+    assert _allclose(reference, stack.replace(0, None))
+    assert _allclose(stack.composite(), stack.replace(0, psd[0]))
+    assert _allclose(stack.composite(), stack.backdrop(len(stack)))
+
+
+def test_prefix_stack_adjustment():
+    psd = PSDImage.open(full_name('fill_adjustments.psd'))
+    stack = PrefixStack(psd)
+    index = next(i for i, x in enumerate(psd) if x.kind == 'invert')
+    reference = composite(
+        psd, layer_filter=lambda x: x.is_visible() or x is psd[index]
+    )
+    assert _allclose(reference, stack.toggle(index))
+    assert not _allclose(stack.composite(), stack.toggle(index))
@@ -1,13 +1,17 @@
 import pytest
 import logging
 
+import numpy as np
+
 from psd_tools import PSDImage
 from psd_tools.constants import Tag
 from psd_tools.psd.descriptor import Double
 from psd_tools.terminology import Enum, Key, Type
-from psd_tools.composite import composite
+from psd_tools.composite import composite, paste
 from psd_tools.composite.vector import (
-    draw_solid_color_fill, draw_pattern_fill, draw_gradient_fill
+    draw_solid_color_fill, draw_pattern_fill, draw_gradient_fill,
+    draw_vector_mask, draw_stroke, coverage_cache, gradient_cache,
+    GRADIENT_LUT_SIZE, _get_gradient_lut, _get_pattern_tile
 )
 
 from ..utils import full_name
@@ -34,18 +38,55 @@ def test_path_operations(filename):
     check_composite_quality(filename, 0.02)
 
 
-@pytest.mark.parametrize(("filename", ), [
-    ('stroke.psd', ),
+@pytest.mark.parametrize('filename', [
+    'path-operations/combine.psd',
+    'path-operations/subtract-first.psd',
+    'path-operations/intersect-all.psd',
 ])
-def test_draw_stroke(filename):
-    check_composite_quality(filename, 0.01, force=True)
+def test_draw_vector_mask_viewport(filename):
+    psd = PSDImage.open(full_name(filename))
+    layer = psd[0]
+    mask, bbox, background = draw_vector_mask(layer)
+    assert mask.shape[:2] == (bbox[3] - bbox[1], bbox[2] - bbox[0])
+    expected = paste(psd.viewbox, bbox, mask, background)
+
+    viewport = (8, 16, psd.width - 8, psd.height // 2)
+    mask, bbox, background = draw_vector_mask(layer, viewport)
+    result = paste(viewport, bbox, mask, background)
+    assert np.allclose(
+        result, expected[viewport[1]:viewport[3], viewport[0]:viewport[2]]
+    )
+
+
+def test_coverage_cache():
+    psd = PSDImage.open(full_name('path-operations/combine.psd'))
+    layer = psd[0]
+    coverage_cache.clear()
+    mask = draw_vector_mask(layer)
+    shape = draw_stroke(layer)
+    assert len(coverage_cache) == 2
+    assert not mask[0].flags.writeable
+
+    misses = coverage_cache.stats['misses']
+    assert draw_vector_mask(layer) is mask
+    assert draw_stroke(layer) is shape
+    assert coverage_cache.stats['misses'] == misses
+
+    # Another document with the same geometry shares the rasterization.
+    other = PSDImage.open(full_name('path-operations/combine.psd'))
+    assert draw_vector_mask(other[0]) is mask
+    composite(other, force=True)
+    assert coverage_cache.stats['misses'] == misses
+
+    draw_vector_mask(layer, (0, 0, 16, 16))
+    assert coverage_cache.stats['misses'] == misses + 1
 
 
 @pytest.mark.parametrize(("filename", ), [
-    ('effects/stroke-composite.psd', ),  # Fix me!
+    ('stroke.psd', ),
+    ('effects/stroke-composite.psd', ),
 ])
-@pytest.mark.xfail
-def test_draw_stroke_fail(filename):
+def test_draw_stroke(filename):
     check_composite_quality(filename, 0.01, force=True)
 
 
@@ -68,6 +109,24 @@ def test_draw_pattern_fill(filename):
     draw_pattern_fill(psd.viewbox, psd, desc)
 
 
+def test_pattern_cache():
+    psd = PSDImage.open(full_name('layers-minimal/pattern-fill.psd'))
+    desc = psd[0].tagged_blocks.get_data(Tag.PATTERN_FILL_SETTING)
+    pattern_id = desc[Enum.Pattern][Key.ID].value.rstrip('\x00')
+    panel, channels = _get_pattern_tile(psd, pattern_id, 1.)
+    assert not panel.flags.writeable
+    assert _get_pattern_tile(psd, pattern_id, 1.)[0] is panel
+    assert _get_pattern_tile(psd, pattern_id, .5)[0].shape[0] == max(
+        1, int(panel.shape[0] * .5)
+    )
+    assert _get_pattern_tile(psd, 'unknown', 1.) is None
+
+    viewport = (0, 0, 2 * panel.shape[1] + 3, 3 * panel.shape[0] + 1)
+    color, _ = draw_pattern_fill(viewport, psd, desc)
+    expected = np.tile(panel, (4, 3, 1))[:viewport[3], :viewport[2]]
+    assert np.array_equal(color, expected[:, :, :color.shape[2]])
+
+
 def test_draw_gradient_fill():
     psd = PSDImage.open(full_name('layers-minimal/gradient-fill.psd'))
     desc = psd[0].tagged_blocks.get_data(Tag.GRADIENT_FILL_SETTING)
@@ -79,6 +138,26 @@ def test_draw_gradient_fill():
     draw_gradient_fill(psd.viewbox, desc)
 
 
+def test_gradient_cache():
+    psd = PSDImage.open(full_name('layers-minimal/gradient-fill.psd'))
+    desc = psd[0].tagged_blocks.get_data(Tag.GRADIENT_FILL_SETTING)
+    gradient_cache.clear()
+    color, shape = draw_gradient_fill(psd.viewbox, desc)
+    assert color.shape[:2] == (psd.height, psd.width)
+    assert color.dtype == np.float32
+    assert len(gradient_cache) == 1
+    lut = _get_gradient_lut(desc.get(Key.Gradient))[0]
+    assert lut.shape[0] == GRADIENT_LUT_SIZE
+    assert not lut.flags.writeable
+
+    misses = gradient_cache.stats['misses']
+    assert np.array_equal(draw_gradient_fill(psd.viewbox, desc)[0], color)
+    desc[b'Rvrs'] = True
+    reversed_color = draw_gradient_fill(psd.viewbox, desc)[0]
+    assert gradient_cache.stats['misses'] == misses
+    assert np.allclose(reversed_color, color[:, ::-1], atol=1e-3)
+
+
 @pytest.mark.parametrize(("filename", ), [
     ('gradient-styles.psd', ),
     ('gradient-sizes.psd', ),
@@ -2,8 +2,8 @@ from __future__ import unicode_literals, print_function
 import pytest
 import logging
 from psd_tools.compression import (
-    compress, decompress, encode_prediction, decode_prediction,
-    encode_rle, decode_rle
+    compress, decompress, decompress_rows, encode_prediction,
+    decode_prediction, encode_rle, decode_rle, rle_offsets_cache
 )
 from psd_tools.constants import Compression
 
@@ -66,6 +66,21 @@ def test_compress_decompress(data, kind, width, height, depth, version):
     assert output == data, 'output=%r, expected=%r' % (output, data)
 
 
+@pytest.mark.parametrize('version', [1, 2])
+def test_decompress_rows_rle(version):
+    data = bytes(bytearray(range(256))) * 2
+    encoded = encode_rle(data, 64, 8, 8, version)
+    rle_offsets_cache.clear()
+    misses = rle_offsets_cache.misses
+    for start in range(0, 8, 3):
+        output = decompress_rows(
+            encoded, Compression.RLE, 64, 8, 8, version, start, start + 3
+        )
+        assert output == data[start * 64:(start + 3) * 64]
+    # The byte counts table is parsed once.
+    assert rle_offsets_cache.misses == misses + 1
+
+
 # This will fail due to irreversible zlib compression.
 @pytest.mark.xfail
 @pytest.mark.parametrize(
@@ -60,3 +60,19 @@ def test_image_data_data(compression, data, header):
     image_data.set_data(data, header)
     output = image_data.get_data(header)
     assert output == data, 'output=%r, expected=%r' % (output, data)
+
+
+@pytest.mark.parametrize(
+    'compression', [Compression.RAW, Compression.RLE, Compression.ZIP]
+)
+@pytest.mark.parametrize('version', [1, 2])
+def test_image_data_channels(compression, version):
+    header = FileHeader(width=3, height=3, depth=8, channels=3, version=version)
+    data = [RAW_IMAGE_3x3_8bit, b'\x01' * 9, b'\x02' * 9]
+    image_data = ImageData(compression)
+    image_data.set_data(data, header)
+    assert image_data.get_data(header, channels=[2, 0]) == [data[2], data[0]]
+    assert image_data.get_data(header, channels=[2, 0], rows=(1, 3)) == [
+        data[2][3:], data[0][3:]
+    ]
+    assert image_data.get_data(header, rows=(0, 1)) == [x[:3] for x in data]
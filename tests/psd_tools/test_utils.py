@@ -3,7 +3,7 @@ import pytest
 import io
 from psd_tools.utils import (
     pack, unpack, read_length_block, write_length_block, read_pascal_string,
-    write_pascal_string, read_unicode_string, write_unicode_string
+    write_pascal_string, read_unicode_string, write_unicode_string, LRUCache
 )
 
 
@@ -123,3 +123,27 @@ def test_unicode_stringrw(fixture, padding):
         write_unicode_string(f, data, padding=padding)
         output = f.getvalue()
         assert fixture == output
+
+
+def test_lru_cache():
+    cache = LRUCache(max_bytes=10)
+    cache.put('a', b'', nbytes=4)
+    cache.put('b', b'', nbytes=4)
+    assert cache.get('a') == b''
+    cache.put('c', b'', nbytes=4)
+    assert 'a' in cache
+    assert 'b' not in cache
+    assert cache.get('b') is None
+    cache.put('d', b'', nbytes=20)
+    assert 'd' not in cache
+    assert cache.stats == {
+        'hits': 1,
+        'misses': 1,
+        'evictions': 1,
+        'items': 2,
+        'nbytes': 8,
+    }
+    cache.discard(lambda key: key == 'a')
+    assert len(cache) == 1
+    cache.clear()
+    assert cache.nbytes == 0
@@ -0,0 +1,118 @@
+"""
+Benchmark of vector path rasterization against aggdraw.
+
+Rasterizes the vector masks and strokes of all the layers in the given PSD
+files with the built-in scanline rasterizer and with aggdraw, then reports
+the time and the difference of the coverage. aggdraw is only needed for
+the comparison.
+
+Usage:
+
+    python tools/benchmark_rasterizer.py \
+        tests/psd_files/path-operations/*.psd tests/psd_files/stroke.psd
+"""
+from __future__ import print_function
+import argparse
+import time
+
+import numpy as np
+
+from psd_tools import PSDImage
+from psd_tools.composite.rasterizer import fill, flatten_curves, stroke
+from psd_tools.composite.vector import _get_curves
+
+
+def rasterize(layer, line_width=None):
+    width, height = layer._psd.width, layer._psd.height
+    planes = []
+    for subpath in layer.vector_mask.paths:
+        if len(subpath) <= 1:
+            continue
+        polyline = flatten_curves(_get_curves(subpath, width, height))
+        if line_width:
+            planes.append(
+                stroke([polyline], line_width, width, height,
+                       [subpath.is_closed()])
+            )
+        else:
+            planes.append(fill([polyline], width, height))
+    return planes
+
+
+def rasterize_aggdraw(layer, line_width=None):
+    import aggdraw
+    from PIL import Image
+    width, height = layer._psd.width, layer._psd.height
+    planes = []
+    for subpath in layer.vector_mask.paths:
+        if len(subpath) <= 1:
+            continue
+        curves = _get_curves(subpath, width, height)
+        path = ['M', curves[0, 0, 0], curves[0, 0, 1], 'C']
+        path.extend(curves[:, 1:].ravel())
+        if subpath.is_closed():
+            path.append('Z')
+        mask = Image.new('L', (width, height), 0)
+        draw = aggdraw.Draw(mask)
+        pen = aggdraw.Pen(255, line_width) if line_width else None
+        brush = None if line_width else aggdraw.Brush(255)
+        draw.symbol((0, 0), aggdraw.Symbol(' '.join(map(str, path))), pen,
+                    brush)
+        draw.flush()
+        del draw
+        planes.append(np.asarray(mask, dtype=np.float32) / 255.)
+    return planes
+
+
+def measure(func, layers, repeat):
+    start = time.perf_counter()
+    for _ in range(repeat):
+        results = [func(layer, line_width) for layer, line_width in layers]
+    return (time.perf_counter() - start) / repeat, results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('files', nargs='+', help='PSD files to rasterize.')
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+
+    print('%-40s %8s %10s %10s %8s %8s' % (
+        'file', 'layers', 'built-in', 'aggdraw', 'max', 'mean'
+    ))
+    for filename in args.files:
+        psd = PSDImage.open(filename)
+        layers = []
+        for layer in psd.descendants():
+            if not layer.has_vector_mask():
+                continue
+            layers.append((layer, None))
+            if layer.has_stroke():
+                width = layer.stroke._data.get('strokeStyleLineWidth', 1.)
+                layers.append((layer, float(width)))
+
+        elapsed, results = measure(rasterize, layers, args.repeat)
+        try:
+            elapsed_agg, expected = measure(
+                rasterize_aggdraw, layers, args.repeat
+            )
+        except ImportError:
+            elapsed_agg, expected = float('nan'), None
+
+        if expected:
+            diff = np.concatenate([
+                np.abs(a - b).ravel()
+                for planes, planes_agg in zip(results, expected)
+                for a, b in zip(planes, planes_agg)
+            ] or [np.zeros(1)])
+            error = (diff.max(), diff.mean())
+        else:
+            error = (float('nan'), float('nan'))
+        print('%-40s %8d %9.2fms %9.2fms %8.3f %8.4f' % (
+            filename[-40:], len(layers), elapsed * 1e3, elapsed_agg * 1e3,
+            error[0], error[1]
+        ))
+
+
+if __name__ == '__main__':
+    main()